@@ -0,0 +1,76 @@
+# Reports the space saved by delta storage against the time taken to revert,
+# for several chain lengths.  Each run saves a series of states of one file,
+# where each state changes a few small regions of the previous state.
+#   $ python benchmarks/bench_delta.py --size 64 --saves 100 --chains 0 1 4 16 64
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import quicksave
+
+def _edit(data, edits, edit_size):
+    data = bytearray(data)
+    for _ in range(edits):
+        offset = random.randrange(len(data))
+        data[offset:offset+edit_size] = os.urandom(edit_size)
+    return bytes(data)
+
+def run(chain, size, saves, edits, edit_size):
+    #Returns (stored bytes, save seconds, mean revert seconds, max revert seconds)
+    with tempfile.TemporaryDirectory() as directory:
+        repository = quicksave.Repository(os.path.join(directory, 'database'))
+        repository.database.flags['storage.delta'] = str(chain)
+        repository.database.save()
+        sourcefile = os.path.join(directory, 'source.bin')
+        data = os.urandom(size)
+        with open(sourcefile, 'wb') as writer:
+            writer.write(data)
+        start = time.perf_counter()
+        filekey = repository.register(sourcefile)['file_key']
+        for _ in range(saves-1):
+            data = _edit(data, edits, edit_size)
+            with open(sourcefile, 'wb') as writer:
+                writer.write(data)
+            repository.save(sourcefile, no_cache=True)
+        elapsed = time.perf_counter() - start
+        database = repository.database
+        stored = sum(
+            os.path.getsize(database.data_path(filekey, data_file))
+            for data_file in database.file_keys[filekey][2]
+        )
+        reverts = []
+        for key in database.list_sk(filekey, False):
+            start = time.perf_counter()
+            database.read_data(filekey, database.state_keys[key][2])
+            reverts.append(time.perf_counter() - start)
+        return (stored, elapsed, sum(reverts)/len(reverts), max(reverts))
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks delta storage for different chain lengths")
+    parser.add_argument('--size', type=int, default=16, help="File size in MiB. Default: 16")
+    parser.add_argument('--saves', type=int, default=50, help="Number of states to save. Default: 50")
+    parser.add_argument('--edits', type=int, default=4, help="Edited regions per state. Default: 4")
+    parser.add_argument('--edit-size', type=int, default=256, help="Bytes per edited region. Default: 256")
+    parser.add_argument('--chains', type=int, nargs='+', default=[0, 1, 4, 16, 64], help="Chain lengths to test")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    size = args.size << 20
+    print("%d states of a %d MiB file, %d edits of %d bytes per state" % (args.saves, args.size, args.edits, args.edit_size))
+    print("%8s %14s %8s %10s %12s %12s" % ('chain', 'stored (MiB)', 'saved', 'save (s)', 'revert (ms)', 'worst (ms)'))
+    for chain in args.chains:
+        random.seed(args.seed)
+        (stored, elapsed, mean, worst) = run(chain, size, args.saves, args.edits, args.edit_size)
+        print("%8d %14.1f %7.1f%% %10.2f %12.1f %12.1f" % (
+            chain,
+            stored / (1 << 20),
+            100 * (1 - stored / (size * args.saves)),
+            elapsed,
+            mean * 1000,
+            worst * 1000
+        ))
+
+if __name__ == '__main__':
+    main()
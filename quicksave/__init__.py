@@ -0,0 +1,9 @@
+from .qs_repository import (
+    Repository,
+    QuicksaveError,
+    DatabaseError,
+    VerificationError,
+    KeyNotFoundError,
+    KeyConflictError,
+    ReservedKeyError,
+)
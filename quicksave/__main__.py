@@ -8,6 +8,20 @@ if sys.version_info < (3,3):
     FileNotFoundError = IOError
 
 def main(args_input=sys.argv[1:]):
+    command = [arg for arg in args_input if not arg.startswith('-')][:1]
+    if ('QUICKSAVE_NO_DAEMON' not in os.environ and os.path.exists(utils.daemonfile) and
+            command not in (['daemon'], ['batch'])):
+        from . import qs_daemon
+        response = qs_daemon.forward(args_input)
+        if response is not None:
+            sys.stdout.write(response['stdout'])
+            sys.stderr.write(response['stderr'])
+            error = qs_daemon.error(response)
+            if error is not None:
+                raise error
+            if response['code']:
+                sys.exit(response['code'])
+            return response['result']
     parser = argparse.ArgumentParser(
         "quicksave",
         description="A very simple file versioning system.  Useful for quickly "+
@@ -20,7 +34,44 @@ def main(args_input=sys.argv[1:]):
     )
     subparsers = parser.add_subparsers()
     helper = {'__main__':parser.print_help}
+    #Only the requested subcommand is built (and its command module imported).
+    #All subcommands are built when help or usage may need to list them
+    builders = [builder for (names, builder) in _SUBCOMMANDS if command[0] in names] if len(command) else []
+    if command == ['help'] or not len(builders):
+        builders = [builder for (names, builder) in _SUBCOMMANDS]
+    for builder in builders:
+        builder(subparsers, helper)
 
+    args = parser.parse_args(args_input)
+
+    def do_print(*_args, **kwargs):
+        if not args.return_result:
+            print(*_args, **kwargs)
+
+    if 'func' not in dir(args):
+        parser.print_help()
+        sys.exit(2)
+    result = None
+    try:
+        result = args.func(args, do_print)
+    except FileNotFoundError as e:
+        raise FileNotFoundError("Command failed!  Unable to open a requested file. "+
+                                " Try running `$ quicksave clean -w` to clean the database") from e
+    except Exception as e:
+        raise RuntimeError("Command failed!  Encountered an unknown exception!") from e
+    if args.return_result:
+        return result
+
+def command_help(args, helper, do_print):
+    if not args.subcommand:
+        helper['__main__']()
+        do_print("\nUse '$ quicksave help <subcommand>' for help with a specific subcommand")
+    elif args.subcommand =='__main__' or args.subcommand not in helper:
+        sys.exit("Unknown subcommand name: %s"%args.subcommand)
+    else:
+        helper[args.subcommand]()
+
+def _build_init(subparsers, helper):
     init_parser = subparsers.add_parser(
         'init', aliases=['load-db'],
         description="Initializes the quicksave database at the specified path.\n"+
@@ -38,6 +89,7 @@ def main(args_input=sys.argv[1:]):
         help="The database path to initialize.  If it exists, then load the database.  If not, then create a new one"
     )
 
+def _build_register(subparsers, helper):
     register_parser = subparsers.add_parser(
         'register',
         description="Registers a new file for versioning.  Different versions of a single\n"+
@@ -48,10 +100,13 @@ def main(args_input=sys.argv[1:]):
         "Returns the file key and list of aliases for the new set of versions, and the initial state key for the starting version"
     )
     register_parser.set_defaults(func=commands.command_register)
+    register_parser.set_defaults(help=register_parser.print_usage)
     helper['register'] = register_parser.print_help
     register_parser.add_argument(
         'filename',
         type=argparse.FileType('rb'),
+        nargs='?',
+        default=None,
         help="The file to save.  The filename and path will be used as aliases for the new file key\n"+
         "if they are not already aliases for a different file key"
     )
@@ -77,7 +132,43 @@ def main(args_input=sys.argv[1:]):
         "at least one must be unique or the operation will be canceled.",
         default=[]
     )
+    register_parser.add_argument(
+        '--copy-strategy',
+        choices=('auto', 'reflink', 'copy_file_range', 'copy', 'hardlink'),
+        help="How to copy the file into the database.  'auto' tries a reflink clone (instant on btrfs, XFS, and other\n"+
+        "copy-on-write filesystems), then an in-kernel copy_file_range, then a plain copy.  'hardlink' behaves like 'auto' here.\n"+
+        "The strategy which was used is reported.  Default: the 'storage.copy' setting, or 'auto'",
+        default=None
+    )
+    register_parser.add_argument(
+        '--files',
+        nargs='+',
+        help="Register many files at once, instead of a single filename.  Each path may be a file, "+
+        "a glob, or a directory, which is searched recursively.  Files are hashed in parallel, and the index is "+
+        "saved once.  Other options apply to every file.  A file which fails does not stop the others",
+        default=None
+    )
+    register_parser.add_argument(
+        '--include',
+        action='append',
+        help="With --files, only register files whose name or relative path matches this pattern.  May be repeated",
+        default=[]
+    )
+    register_parser.add_argument(
+        '--exclude',
+        action='append',
+        help="With --files, skip files whose name or relative path matches this pattern.  May be repeated",
+        default=[]
+    )
+    register_parser.add_argument(
+        '--workers',
+        type=int,
+        help="With --files, the number of threads which hash files. "+
+        "Default: the 'save.workers' setting, or the number of CPUs",
+        default=None
+    )
 
+def _build_save(subparsers, helper):
     save_parser = subparsers.add_parser(
         'save',
         description="Saves the current state of the file to the set of versions for this file.\n"+
@@ -88,10 +179,13 @@ def main(args_input=sys.argv[1:]):
         "Returns the file key (iff it was inferred), the new state key, and a list of aliases"
     )
     save_parser.set_defaults(func=commands.command_save)
+    save_parser.set_defaults(help=save_parser.print_usage)
     helper['save'] = save_parser.print_help
     save_parser.add_argument(
         'filename',
         type=argparse.FileType('rb'),
+        nargs='?',
+        default=None,
         help="The file to save.  Iff the filename differs from the original filename for the file key,\n"+
         "it will be added as an alias to the new state key."
     )
@@ -121,7 +215,51 @@ def main(args_input=sys.argv[1:]):
         action='store_true',
         help='Save the state even if an identical state exists.'
     )
+    save_parser.add_argument(
+        '--no-cache',
+        action='store_true',
+        help="Always read the file to compute its hash.  By default, the hash is reused "+
+        "if the file's size, modification time, and inode have not changed since it was last hashed. "+
+        "The cache can be disabled by setting 'hash.cache' to 0",
+        dest='no_cache'
+    )
+    save_parser.add_argument(
+        '--copy-strategy',
+        choices=('auto', 'reflink', 'copy_file_range', 'copy', 'hardlink'),
+        help="How to copy the file into the database.  'auto' tries a reflink clone (instant on btrfs, XFS, and other\n"+
+        "copy-on-write filesystems), then an in-kernel copy_file_range, then a plain copy.  'hardlink' behaves like 'auto' here.\n"+
+        "The strategy which was used is reported.  Default: the 'storage.copy' setting, or 'auto'",
+        default=None
+    )
+    save_parser.add_argument(
+        '--files',
+        nargs='+',
+        help="Save many files at once, instead of a single filename.  Each path may be a file, "+
+        "a glob, or a directory, which is searched recursively.  Files are hashed in parallel, and the index is "+
+        "saved once.  Other options apply to every file.  A file which fails does not stop the others",
+        default=None
+    )
+    save_parser.add_argument(
+        '--include',
+        action='append',
+        help="With --files, only save files whose name or relative path matches this pattern.  May be repeated",
+        default=[]
+    )
+    save_parser.add_argument(
+        '--exclude',
+        action='append',
+        help="With --files, skip files whose name or relative path matches this pattern.  May be repeated",
+        default=[]
+    )
+    save_parser.add_argument(
+        '--workers',
+        type=int,
+        help="With --files, the number of threads which hash files. "+
+        "Default: the 'save.workers' setting, or the number of CPUs",
+        default=None
+    )
 
+def _build_revert(subparsers, helper):
     revert_parser = subparsers.add_parser(
         'revert',
         description="Reverts the specified file to the state specified by the provided state key or alias.\n"+
@@ -165,7 +303,25 @@ def main(args_input=sys.argv[1:]):
         action='store_true',
         help="Forces the revert even if the file is already in the requested state"
     )
+    revert_parser.add_argument(
+        '--no-cache',
+        action='store_true',
+        help="Always read the file to compute its hash.  By default, the hash is reused "+
+        "if the file's size, modification time, and inode have not changed since it was last hashed. "+
+        "The cache can be disabled by setting 'hash.cache' to 0",
+        dest='no_cache'
+    )
+    revert_parser.add_argument(
+        '--copy-strategy',
+        choices=('auto', 'reflink', 'copy_file_range', 'copy', 'hardlink'),
+        help="How to copy the state out of the database.  'auto' tries a reflink clone (instant on btrfs, XFS, and other\n"+
+        "copy-on-write filesystems), then an in-kernel copy_file_range, then a plain copy.\n"+
+        "'hardlink' checks out uncompressed full copies as read-only hardlinks to the stored state.\n"+
+        "The strategy which was used is reported.  Default: the 'storage.copy' setting, or 'auto'",
+        default=None
+    )
 
+def _build_alias(subparsers, helper):
     alias_parser = subparsers.add_parser(
         'alias',
         description="Create, override, or delete an alias for a file or state key.\n"+
@@ -174,6 +330,8 @@ def main(args_input=sys.argv[1:]):
         "'$ quicksave alias -d <link>' deletes the file key alias <link>.  Cannot delete file keys (only aliases).\n"+
         "'$ quicksave alias <link> <target> <filekey>' creates or overwrites the state key alias <link> to point to the state key (or alias) <target> under the file key <file>.\n"+
         "'$ quicksave alias -d <link> <filekey>' deletes the state key alias <link> under the file key <filekey>.  Cannot delete state keys (only aliases).\n"+
+        "State aliases of 4 or more lowercase hexadecimal digits are reserved for prefixes of state hashes.  "+
+        "Such aliases created by older versions are kept, and take precedence over the hash of a state.\n"+
         "To delete authoritative file or state keys, use '$ quicksave delete-key <file key> [state key]'"
     )
     alias_parser.set_defaults(func=commands.command_alias)
@@ -201,6 +359,7 @@ def main(args_input=sys.argv[1:]):
         help='Deletes the provided file or state alias'
     )
 
+def _build_list(subparsers, helper):
     list_parser = subparsers.add_parser(
         'list',
         description="Lists all file keys in this database, or all state keys under a provided file key (or alias)"
@@ -218,6 +377,11 @@ def main(args_input=sys.argv[1:]):
         action='store_true',
         help='Display key aliases in addition to just keys'
     )
+    list_parser.add_argument(
+        '-l', '--long',
+        action='store_true',
+        help="Display the size, save time, and digest of each state key"
+    )
     list_parser.add_argument(
         '-t', '--target',
         help="Only display aliases for the provided target key.  Implies the -a option. "+
@@ -226,6 +390,7 @@ def main(args_input=sys.argv[1:]):
         default=None
     )
 
+def _build_delete(subparsers, helper):
     delete_parser = subparsers.add_parser(
         'delete-key',
         aliases=['rm', 'delete'],
@@ -271,6 +436,7 @@ def main(args_input=sys.argv[1:]):
         "been made to point to ~trash"
     )
 
+def _build_lookup(subparsers, helper):
     lookup_parser = subparsers.add_parser(
         'lookup',
         description="Returns the authoritative file or state key for a given alias"
@@ -289,6 +455,7 @@ def main(args_input=sys.argv[1:]):
         "Iff <filekey> is provided, then <target> is taken to be a state alias, otherwise it is taken to be a file alias."
     )
 
+def _build_recover(subparsers, helper):
     recover_parser = subparsers.add_parser(
         'recover',
         description="Recovers the most recently deleted file key.\n"+
@@ -308,6 +475,7 @@ def main(args_input=sys.argv[1:]):
         default = []
     )
 
+def _build_show(subparsers, helper):
     show_parser = subparsers.add_parser(
         'show',
         description="Shows the current database path"
@@ -315,6 +483,7 @@ def main(args_input=sys.argv[1:]):
     show_parser.set_defaults(func = lambda args, printer:utils.initdb(printer) if args.return_result else printer(utils.initdb(printer)))
     helper['show'] = show_parser.print_help
 
+def _build_clean(subparsers, helper):
     clean_parser = subparsers.add_parser(
         'clean',
         description="Cleans the database to reduce used space.\n"+
@@ -339,14 +508,24 @@ def main(args_input=sys.argv[1:]):
         "a file under the same file key. Removes all but one state key from each "+
         "set of duplicates, and updates all aliases of the deleted keys to point "+
         "to the remaining state key.  Deduplication will also replace any missing "+
-        "hash aliases for all remaining states."
+        "hash aliases for all remaining states.  States with a digest recorded in the index are not read, "+
+        "and other states are only hashed if another state of the same file key has the same size"
+    )
+    clean_parser.add_argument(
+        '-m', '--metadata',
+        action='store_true',
+        help="Records the size, digest, and creation time of state keys which were saved "+
+        "by older versions of quicksave, so that they can be deduplicated and listed without reading them. "+
+        "The creation time is taken from the modification time of the stored state.  "+
+        "Also removes stored hash aliases, which are resolved from the recorded digests, "+
+        "and the name counters of deleted file keys"
     )
     clean_parser.add_argument(
         '-w', '--walk-database',
         action='store_true',
         help="Checks the database file manifest against the list of files visible "+
         "within the directory.  Files found in the database directory that do not "+
-        "exist in the manifest are deleted.  Files listed in the manifest which cannot "+
+        "exist in the manifest are deleted, unless they were modified within the last hour.  Files listed in the manifest which cannot "+
         "be found in the directory will have their corresponding state key (and its aliases) deleted"
     )
     clean_parser.add_argument(
@@ -365,12 +544,55 @@ def main(args_input=sys.argv[1:]):
         help="Checks the file index for each file key against the filename registered to each state key. "+
         "The file index is rebuilt using this list of filenames."
     )
+    clean_parser.add_argument(
+        '-j', '--journal',
+        action='store_true',
+        help="Compacts the storage used by the database index. "+
+        "With the text engine, changes to the database are appended to a journal "+
+        "which is compacted into a new checkpoint.  The journal is also compacted "+
+        "automatically once it grows larger than the last checkpoint"
+    )
     clean_parser.add_argument(
         '--clean-all',
         action='store_true',
-        help="Runs all cleaning subroutines.  Equivalent to -tdwasr"
+        help="Runs all cleaning subroutines.  Equivalent to -tdwasrjm"
+    )
+    clean_parser.add_argument(
+        '-i', '--incremental',
+        action='store_true',
+        help="Collects garbage incrementally, within the limits set by --budget and --max-bytes. "+
+        "Removes state keys with missing data files, records missing metadata, removes duplicate "+
+        "states, and removes orphaned files from data folders.  Orphaned files modified within the last "+
+        "hour are kept, since they may belong to a save in another process.  The index is saved after every batch, "+
+        "and the next run continues where the last one stopped.  Not included in --clean-all"
+    )
+    clean_parser.add_argument(
+        '--budget',
+        type=float,
+        help="With --incremental, stop after this many seconds",
+        default=None
+    )
+    clean_parser.add_argument(
+        '--max-bytes',
+        type=int,
+        help="With --incremental, stop after reading this many bytes of stored states",
+        default=None
+    )
+    clean_parser.add_argument(
+        '--dry-run',
+        action='store_true',
+        help="Reports the folders, files, and keys which --walk-database would remove, without removing them. "+
+        "Cannot be combined with the other stages"
+    )
+    clean_parser.add_argument(
+        '--workers',
+        type=int,
+        help="The number of threads which hash states during deduplication, and scan data folders during --walk-database. "+
+        "Default: the 'clean.workers' setting, or the number of CPUs",
+        default=None
     )
 
+def _build_status(subparsers, helper):
     status_parser = subparsers.add_parser(
         'status',
         description="Checks if the given file currently matches a known state"
@@ -390,7 +612,16 @@ def main(args_input=sys.argv[1:]):
         "quicksave will require the user to provide this option.",
         default=None
     )
+    status_parser.add_argument(
+        '--no-cache',
+        action='store_true',
+        help="Always read the file to compute its hash.  By default, the hash is reused "+
+        "if the file's size, modification time, and inode have not changed since it was last hashed. "+
+        "The cache can be disabled by setting 'hash.cache' to 0",
+        dest='no_cache'
+    )
 
+def _build_export(subparsers, helper):
     export_parser = subparsers.add_parser(
         'export',
         aliases=['archive'],
@@ -422,6 +653,7 @@ def main(args_input=sys.argv[1:]):
         help="Exclude global configuration keys from the export"
     )
 
+def _build_import(subparsers, helper):
     import_parser = subparsers.add_parser(
         'import',
         description="Imports a database from a .tar.gz, .tar.bz2, or .zip file"
@@ -454,6 +686,7 @@ def main(args_input=sys.argv[1:]):
         default='merge'
     )
 
+def _build_config(subparsers, helper):
     config_parser = subparsers.add_parser(
         'config',
         description="Sets or checks the current configuration of quicksave"
@@ -496,6 +729,163 @@ def main(args_input=sys.argv[1:]):
         dest="_list"
     )
 
+def _build_migrate(subparsers, helper):
+    from . import qs_engines
+    migrate_parser = subparsers.add_parser(
+        'migrate',
+        description="Moves the database index to a different storage engine. "+
+        "The 'text' engine stores the index in a tab-separated checkpoint file and a journal. "+
+        "The 'sqlite' engine stores the index in an SQLite database with indexed tables. "+
+        "Stored states are not affected"
+    )
+    migrate_parser.set_defaults(func=commands.command_migrate)
+    helper['migrate'] = migrate_parser.print_help
+    migrate_parser.add_argument(
+        'engine',
+        help="The storage engine to migrate to",
+        choices=sorted(qs_engines.ENGINES)
+    )
+
+def _build_repack(subparsers, helper):
+    repack_parser = subparsers.add_parser(
+        'repack',
+        description="Rewrites the stored states of file keys as chains of deltas. "+
+        "Each state is stored as a delta against the previous state, and a full copy "+
+        "is stored at least every N states, which bounds the number of deltas applied to revert a state. "+
+        "New states are stored as deltas when the 'storage.delta' setting is a chain length greater than 0. "+
+        "States are also recompressed according to the 'storage.compression' settings. "+
+        "States in the blob store are not affected"
+    )
+    repack_parser.set_defaults(func=commands.command_repack)
+    helper['repack'] = repack_parser.print_help
+    repack_parser.add_argument(
+        'filekey',
+        nargs='?',
+        help="The file key to repack.  Default: all file keys",
+        default=None
+    )
+    repack_parser.add_argument(
+        '-c', '--chain',
+        type=int,
+        help="The maximum number of deltas between full copies.  0 stores every state as a full copy. "+
+        "Default: the 'storage.delta' setting",
+        default=None
+    )
+
+def _build_layout(subparsers, helper):
+    layout_parser = subparsers.add_parser(
+        'layout',
+        description="Shows or changes how data files are placed in their data folders. "+
+        "In the 'flat' layout, every state of a file key is stored directly in its data folder. "+
+        "In the 'sharded' layout, states are spread across subfolders named by a prefix of the hash of "+
+        "their name, which keeps folders small for file keys with many states. "+
+        "Changing the layout moves every stored state.  If it is interrupted, run it again to finish"
+    )
+    layout_parser.set_defaults(func=commands.command_layout)
+    helper['layout'] = layout_parser.print_help
+    layout_parser.add_argument(
+        'layout',
+        nargs='?',
+        help="The layout to move the database to.  If omitted, the current layout is shown",
+        choices=('flat', 'sharded'),
+        default=None
+    )
+
+def _build_verify(subparsers, helper):
+    verify_parser = subparsers.add_parser(
+        'verify',
+        aliases=['fsck'],
+        description="Checks stored states against the size and digest recorded when they were saved. "+
+        "Reports states whose data is missing or corrupted, states saved without a recorded digest, "+
+        "and files in the data folders, blob store, or chunk store which are not stored by any state key. "+
+        "Nothing is modified.  Exits with an error if any states are missing or corrupted"
+    )
+    verify_parser.set_defaults(func=commands.command_verify)
+    helper['verify'] = verify_parser.print_help
+    helper['fsck'] = verify_parser.print_help
+    verify_parser.add_argument(
+        'filekey',
+        nargs='?',
+        help="Only verify the states of this file key.  Orphaned files are only reported when every state is verified",
+        default=None
+    )
+    verify_parser.add_argument(
+        'states',
+        nargs='*',
+        help="Only verify these states of the file key"
+    )
+    verify_parser.add_argument(
+        '-f', '--fast',
+        action='store_true',
+        help="Only check that each state exists and has its recorded size, without reading it"
+    )
+    verify_parser.add_argument(
+        '-o', '--output',
+        help="Writes the report as JSON to this file.  Use '-' to print the report as JSON",
+        default=None
+    )
+    verify_parser.add_argument(
+        '--workers',
+        type=int,
+        help="The number of threads which read states. "+
+        "Default: the 'verify.workers' setting, or the number of CPUs",
+        default=None
+    )
+
+def _build_batch(subparsers, helper):
+    batch_parser = subparsers.add_parser(
+        'batch',
+        description="Runs a list of quicksave commands against a single loaded database. "+
+        "Each line of the input is one command, either as a command line (ie: 'alias myfile.txt backup') "+
+        "or as a JSON list of arguments.  Blank lines and lines starting with '#' are ignored. "+
+        "Changes are saved once, after the last command.  A failed command is reported, "+
+        "and its changes are discarded, but the remaining commands still run"
+    )
+    batch_parser.set_defaults(func=commands.command_batch)
+    helper['batch'] = batch_parser.print_help
+    batch_parser.add_argument(
+        'input',
+        nargs='?',
+        help="The file containing the commands to run.  Default: stdin",
+        type=argparse.FileType('r'),
+        default='-'
+    )
+    batch_parser.add_argument(
+        '-c', '--commit-every',
+        type=int,
+        help="Saves changes after every N successful commands, instead of only after the last command",
+        default=0
+    )
+    batch_parser.add_argument(
+        '--atomic',
+        action='store_true',
+        help="Runs the batch as a single transaction.  If any command fails, "+
+        "the batch stops and no changes are saved. "+
+        "Cannot be combined with --commit-every"
+    )
+
+def _build_daemon(subparsers, helper):
+    daemon_parser = subparsers.add_parser(
+        'daemon',
+        description="Runs a daemon which keeps the current database loaded in memory "+
+        "and serves quicksave commands over a Unix domain socket.  While the daemon "+
+        "is running, quicksave commands are forwarded to it.  Commands run in-process "+
+        "when no daemon is running.  The daemon runs in the foreground until stopped"
+    )
+    daemon_parser.set_defaults(func=commands.command_daemon)
+    helper['daemon'] = daemon_parser.print_help
+    daemon_parser.add_argument(
+        '--stop',
+        action='store_true',
+        help="Stops the running daemon"
+    )
+    daemon_parser.add_argument(
+        '--status',
+        action='store_true',
+        help="Checks if a daemon is running"
+    )
+
+def _build_help(subparsers, helper):
     help_parser = subparsers.add_parser(
         'help',
         description="Displays help about quicksave and its subcommands"
@@ -509,34 +899,30 @@ def main(args_input=sys.argv[1:]):
         default = None
     )
 
-    args = parser.parse_args(args_input)
-
-    def do_print(*_args, **kwargs):
-        if not args.return_result:
-            print(*_args, **kwargs)
-
-    if 'func' not in dir(args):
-        parser.print_help()
-        sys.exit(2)
-    result = None
-    try:
-        result = args.func(args, do_print)
-    except FileNotFoundError as e:
-        raise FileNotFoundError("Command failed!  Unable to open a requested file. "+
-                                " Try running `$ quicksave clean -w` to clean the database") from e
-    except Exception as e:
-        raise RuntimeError("Command failed!  Encountered an unknown exception!") from e
-    if args.return_result:
-        return result
-
-def command_help(args, helper, do_print):
-    if not args.subcommand:
-        helper['__main__']()
-        do_print("\nUse '$ quicksave help <subcommand>' for help with a specific subcommand")
-    elif args.subcommand =='__main__' or args.subcommand not in helper:
-        sys.exit("Unknown subcommand name: %s"%args.subcommand)
-    else:
-        helper[args.subcommand]()
+_SUBCOMMANDS = [
+    (('init', 'load-db'), _build_init),
+    (('register',), _build_register),
+    (('save',), _build_save),
+    (('revert',), _build_revert),
+    (('alias',), _build_alias),
+    (('list',), _build_list),
+    (('delete-key', 'rm', 'delete'), _build_delete),
+    (('lookup',), _build_lookup),
+    (('recover',), _build_recover),
+    (('show',), _build_show),
+    (('clean',), _build_clean),
+    (('status',), _build_status),
+    (('export', 'archive'), _build_export),
+    (('import',), _build_import),
+    (('config',), _build_config),
+    (('migrate',), _build_migrate),
+    (('repack',), _build_repack),
+    (('layout',), _build_layout),
+    (('verify', 'fsck'), _build_verify),
+    (('batch',), _build_batch),
+    (('daemon',), _build_daemon),
+    (('help',), _build_help),
+]
 
 if __name__ == '__main__':
     # print("No previous database registered in config file.  Please run '$ quicksave init'")
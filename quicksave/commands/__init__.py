@@ -1,13 +1,72 @@
-from .command_init import command_init
-from .command_register import command_register
-from .command_save import command_save
-from .command_revert import command_revert
-from .command_alias import command_alias
-from .command_list import command_list
-from .command_delete import command_delete
-from .command_lookup import command_lookup
-from .command_recover import command_recover
-from .command_clean import command_clean
-from .command_status import command_status
-from .command_config import command_config
-from .command_export import command_export, command_import
+# Command modules are imported on first use, so that running one command does
+# not import the dependencies of every other command
+
+import importlib
+
+def _load(module, name):
+    wrapper = globals()[module]
+    command = getattr(importlib.import_module('.'+module, __name__), name)
+    # Importing a submodule binds it on this package, over the wrapper which
+    # shares its name
+    globals()[module] = wrapper
+    return command
+
+def command_init(args, do_print):
+    return _load('command_init', 'command_init')(args, do_print)
+
+def command_register(args, do_print):
+    return _load('command_register', 'command_register')(args, do_print)
+
+def command_save(args, do_print):
+    return _load('command_save', 'command_save')(args, do_print)
+
+def command_revert(args, do_print):
+    return _load('command_revert', 'command_revert')(args, do_print)
+
+def command_alias(args, do_print):
+    return _load('command_alias', 'command_alias')(args, do_print)
+
+def command_list(args, do_print):
+    return _load('command_list', 'command_list')(args, do_print)
+
+def command_delete(args, do_print):
+    return _load('command_delete', 'command_delete')(args, do_print)
+
+def command_lookup(args, do_print):
+    return _load('command_lookup', 'command_lookup')(args, do_print)
+
+def command_recover(args, do_print):
+    return _load('command_recover', 'command_recover')(args, do_print)
+
+def command_clean(args, do_print):
+    return _load('command_clean', 'command_clean')(args, do_print)
+
+def command_status(args, do_print):
+    return _load('command_status', 'command_status')(args, do_print)
+
+def command_config(args, do_print):
+    return _load('command_config', 'command_config')(args, do_print)
+
+def command_export(args, do_print):
+    return _load('command_export', 'command_export')(args, do_print)
+
+def command_import(args, do_print):
+    return _load('command_export', 'command_import')(args, do_print)
+
+def command_migrate(args, do_print):
+    return _load('command_migrate', 'command_migrate')(args, do_print)
+
+def command_daemon(args, do_print):
+    return _load('command_daemon', 'command_daemon')(args, do_print)
+
+def command_batch(args, do_print):
+    return _load('command_batch', 'command_batch')(args, do_print)
+
+def command_repack(args, do_print):
+    return _load('command_repack', 'command_repack')(args, do_print)
+
+def command_layout(args, do_print):
+    return _load('command_layout', 'command_layout')(args, do_print)
+
+def command_verify(args, do_print):
+    return _load('command_verify', 'command_verify')(args, do_print)
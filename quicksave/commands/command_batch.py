@@ -0,0 +1,21 @@
+import sys
+from .. import qs_batch
+
+def command_batch(args, do_print):
+    if args.atomic and args.commit_every:
+        sys.exit("Unable to run batch: --atomic cannot be combined with --commit-every")
+    results = qs_batch.run_batch(
+        args.input,
+        args.commit_every,
+        args.atomic,
+        args.return_result,
+        do_print
+    )
+    args.input.close()
+    failed = [result for result in results if result['code']]
+    if args.atomic and len(failed):
+        sys.exit("Unable to complete batch: Line %d failed.  No changes were saved" % failed[0]['line'])
+    if len(failed):
+        sys.exit("Unable to complete batch: %d of %d commands failed" % (len(failed), len(results)))
+    do_print("Ran", len(results), "commands")
+    return results
@@ -1,9 +1,84 @@
 import os
 import sys
+import time
 from shutil import rmtree
+from concurrent.futures import ThreadPoolExecutor
 from .. import utils
+from ..qs_gc import collect, scan_files, in_progress
+from ..qs_database import BLOB_PREFIX, COMPRESSED_PREFIX, HASH_ALGORITHM, RELAYOUT_MARKER, is_blob, is_delta, is_chunked, shard
+from ..qs_errors import DatabaseFailure
+
+def _state_size(key, entry):
+    #the size of a stored state, if it can be found without reading the state
+    meta = utils._CURRENT_DATABASE.state_meta(key)
+    if meta is not None:
+        return meta[0]
+    if is_chunked(entry[2]) and os.path.isfile(utils._CURRENT_DATABASE.data_path(entry[1], entry[2])):
+        return sum(size for (digest, size) in utils._CURRENT_DATABASE.read_manifest(entry[1], entry[2]))
+    if is_delta(entry[2]) or entry[2].startswith(COMPRESSED_PREFIX):
+        return None
+    try:
+        return os.path.getsize(utils._CURRENT_DATABASE.data_path(entry[1], entry[2]))
+    except OSError:
+        return None
+
+def _state_digests(keys, workers):
+    #Returns {state key: digest} for every state which may have a duplicate under its file key, in the order of keys.
+    #Digests recorded in the index are reused.  The remaining states are only
+    #hashed if another state of the same file key has the same size
+    digests = {}
+    sizes = {} #state key -> size, or None if the size is unknown
+    buckets = {} #(file key, size) -> number of states
+    for key in keys:
+        entry = utils._CURRENT_DATABASE.state_keys[key]
+        meta = utils._CURRENT_DATABASE.state_meta(key)
+        if meta is not None and meta[2] == HASH_ALGORITHM:
+            digests[key] = meta[1]
+        elif is_blob(entry[2]):
+            digests[key] = entry[2].lstrip(COMPRESSED_PREFIX)[len(BLOB_PREFIX):] #blobs are named by their digest
+        sizes[key] = _state_size(key, entry)
+        if sizes[key] is not None:
+            buckets[(entry[1], sizes[key])] = buckets.get((entry[1], sizes[key]), 0) + 1
+    pending = [
+        key for key in keys
+        if key not in digests and (
+            sizes[key] is None or buckets[(utils._CURRENT_DATABASE.state_keys[key][1], sizes[key])] > 1
+        )
+    ]
+    if len(pending):
+        entries = [utils._CURRENT_DATABASE.state_keys[key] for key in pending]
+        #hashlib releases the GIL, so states are hashed in parallel
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for (key, (size, digest)) in zip(pending, pool.map(
+                    lambda entry: utils._CURRENT_DATABASE.content_meta(entry[1], entry[2]),
+                    entries
+                    )):
+                digests[key] = digest
+    return {key:digests[key] for key in keys if key in digests}
+
+def _mark(listing, name):
+    #marks a listed file as found.  Returns False if it is not listed
+    if name in listing:
+        listing[name][1] = True
+        return True
+    return False
+
+def _walk_folder(path, check, dry_run):
+    #Removes every file below path which is not listed, unless dry_run.  Returns the paths of the unlisted files.
+    #Recent and staging files are skipped, since they may belong to a save in another process
+    orphans = []
+    now = time.time()
+    for (folder, name) in scan_files(path):
+        if not check(folder, name) and not in_progress(folder, name, now):
+            if not dry_run:
+                os.remove(os.path.join(folder, name))
+            orphans.append(os.path.join(folder, name))
+    return orphans
 
 def command_clean(args, do_print):
+    if args.dry_run and (args.clean_all or args.incremental or args.trash or args.deduplicate or args.aliases or
+            args.states or args.rebuild_file_index or args.metadata or args.journal):
+        sys.exit("Unable to clean: --dry-run can only be used with --walk-database alone")
     utils.initdb(do_print)
     didop = False
     msg = ''
@@ -11,10 +86,11 @@ def command_clean(args, do_print):
     if args.states or args.clean_all:
         didop = True
         keys = []
-        for key in list(utils._CURRENT_DATABASE.state_keys):
-            if utils._CURRENT_DATABASE.state_keys[key][1] not in utils._CURRENT_DATABASE.file_keys:
-                keys.append(""+key)
-                del utils._CURRENT_DATABASE.state_keys[key]
+        for filekey in utils._CURRENT_DATABASE.state_owners():
+            if filekey not in utils._CURRENT_DATABASE.file_keys:
+                for key in utils._CURRENT_DATABASE.list_sk(filekey):
+                    keys.append(""+key)
+                    del utils._CURRENT_DATABASE.state_keys[key]
         if len(keys):
             msg += "Removed the following %d orphaned state keys and aliases: %s\n"%(
                 len(keys),
@@ -25,12 +101,13 @@ def command_clean(args, do_print):
         didop = True
         state_keys = []
         file_keys = []
-        for key in [key for key in utils._CURRENT_DATABASE.file_keys if utils._CURRENT_DATABASE.file_keys[key][0]]:
-            if utils._CURRENT_DATABASE.file_keys[key][0] not in utils._CURRENT_DATABASE.file_keys:
+        #Remove the entire chain of aliases leading to each missing target
+        for target in utils._CURRENT_DATABASE.missing_targets(True):
+            for key in utils._CURRENT_DATABASE.list_fa(target, True):
                 file_keys.append(""+key)
                 del utils._CURRENT_DATABASE.file_keys[key]
-        for key in [key for key in utils._CURRENT_DATABASE.state_keys if utils._CURRENT_DATABASE.state_keys[key][0]]:
-            if utils._CURRENT_DATABASE.state_keys[key][0] not in utils._CURRENT_DATABASE.state_keys:
+        for target in utils._CURRENT_DATABASE.missing_targets(False):
+            for key in utils._CURRENT_DATABASE.list_sa(target, True):
                 state_keys.append(""+key)
                 del utils._CURRENT_DATABASE.state_keys[key]
         if len(file_keys):
@@ -51,7 +128,7 @@ def command_clean(args, do_print):
         for key in [key for key in utils._CURRENT_DATABASE.file_keys if not utils._CURRENT_DATABASE.file_keys[key][0]]:
             old_list = utils._CURRENT_DATABASE.file_keys[key][2]
             new_list = set()
-            for statekey in [statekey for statekey in utils._CURRENT_DATABASE.state_keys if utils._CURRENT_DATABASE.state_keys[statekey][1]==key]:
+            for statekey in utils._CURRENT_DATABASE.list_sk(key, False):
                 state = utils._CURRENT_DATABASE.state_keys[statekey]
                 if state[2] not in new_list:
                     new_list.add(state[2])
@@ -65,6 +142,9 @@ def command_clean(args, do_print):
             result['rebuilt'] = rebuilt
     if args.walk_database or args.clean_all:
         didop=True
+        if os.path.exists(os.path.join(utils._CURRENT_DATABASE.base_dir, RELAYOUT_MARKER)):
+            raise DatabaseFailure("Unable to walk the database: A layout change was interrupted.  Run '$ quicksave layout' again to finish it")
+        sharded = utils._CURRENT_DATABASE.layout() == 'sharded'
         prune_folders = []
         prune_files = []
         prune_filekeys = []
@@ -75,141 +155,198 @@ def command_clean(args, do_print):
             if not utils._CURRENT_DATABASE.file_keys[key][0]
         }
         manifest = {entry:{} for entry in utils._CURRENT_DATABASE.data_folders}
+        blobs = {} #blob: [state keys, found]
+        chunks = {} #chunk: [state keys, found]
+        prune_chunks = 0
 
         for key in utils._CURRENT_DATABASE.state_keys:
             entry = [item for item in utils._CURRENT_DATABASE.state_keys[key]]
             if not entry[0]:
-                manifest[folder_map[entry[1]]][entry[2]] = [key, False]
-        for path in os.walk(utils._CURRENT_DATABASE.base_dir):
-            if path[0] == utils._CURRENT_DATABASE.base_dir:
-                #Folders phase
-                for target in set(path[1])-{os.path.basename(folder) for folder in utils._CURRENT_DATABASE.data_folders}:
-                    rmtree(os.path.join(
-                        os.path.abspath(utils._CURRENT_DATABASE.base_dir),
-                        os.path.basename(target)
-                    ))
-                    prune_folders.append(''+target)
-            else:
-                for target in path[2]:
-                    if path[0] in manifest and target in manifest[path[0]]:
-                        manifest[path[0]][target][1] = True
-                    else:
-                        full_filepath = os.path.join(
-                            path[0],
-                            target
-                        )
-                        if os.path.isfile(full_filepath):
-                            os.remove(full_filepath)
-                        prune_files.append(os.path.join(
-                            os.path.relpath(path[0], os.path.abspath(utils._CURRENT_DATABASE.base_dir)),
-                            target
-                        ))
+                if is_blob(entry[2]):
+                    blobs.setdefault(
+                        os.path.basename(utils._CURRENT_DATABASE.data_path(entry[1], entry[2])),
+                        [[], False]
+                    )[0].append(key)
+                else:
+                    manifest[folder_map[entry[1]]][entry[2]] = [key, False]
+                    if is_chunked(entry[2]) and os.path.isfile(utils._CURRENT_DATABASE.data_path(entry[1], entry[2])):
+                        for (digest, size) in utils._CURRENT_DATABASE.read_manifest(entry[1], entry[2]):
+                            chunks.setdefault(digest, [[], False])[0].append(key)
+        for (key, folder) in folder_map.items():
+            #released files are removed once the index is saved
+            for datafile in utils._CURRENT_DATABASE.pending_files(key):
+                manifest[folder].setdefault(datafile, [None, False])
+        bases = {} #(folder, delta): base
+        folder_keys = {folder: key for (key, folder) in folder_map.items()}
+        for folder in manifest:
+            pending = [datafile for datafile in manifest[folder] if is_delta(datafile)]
+            while len(pending):
+                datafile = pending.pop()
+                if (folder, datafile) in bases or not os.path.isfile(utils._CURRENT_DATABASE.data_path(folder_keys[folder], datafile)):
+                    continue
+                bases[(folder, datafile)] = utils._CURRENT_DATABASE.delta_header(folder_keys[folder], datafile)[0]
+                if bases[(folder, datafile)] is not None and bases[(folder, datafile)] not in manifest[folder]:
+                    #the base of a delta is kept, even if no state key stores it
+                    manifest[folder][bases[(folder, datafile)]] = [None, False]
+                    pending.append(bases[(folder, datafile)])
+        base_dir = os.path.abspath(utils._CURRENT_DATABASE.base_dir)
+        roots = [] #(folder, check), where check(folder, name) marks a listed file as found
+        for folder in manifest:
+            roots.append((folder, lambda folder, name, root=folder: _mark(
+                #in the sharded layout, data files are stored in subfolders of their data folder
+                manifest[root],
+                name
+            ) if folder == root or (
+                sharded and os.path.dirname(folder) == root and os.path.basename(folder) == shard(name)
+            ) else False))
+        roots.append((utils._CURRENT_DATABASE.blob_dir, lambda folder, name: (
+            os.path.dirname(folder) == utils._CURRENT_DATABASE.blob_dir and _mark(blobs, name)
+        )))
+        with os.scandir(base_dir) as iterator:
+            #Folders phase.  New data folders are created before the index is saved
+            known = {os.path.basename(root) for (root, check) in roots} | {os.path.basename(utils._CURRENT_DATABASE.chunk_dir)}
+            now = time.time()
+            for entry in iterator:
+                if entry.is_dir(follow_symlinks=False) and entry.name not in known and not in_progress(base_dir, entry.name, now):
+                    if not args.dry_run:
+                        rmtree(entry.path)
+                    prune_folders.append(''+entry.name)
+        with ThreadPoolExecutor(max_workers=utils.worker_count(args.workers)) as pool:
+            #data folders are scanned concurrently.  Only orphaned files are kept in memory
+            files = [pool.submit(_walk_folder, root, check, args.dry_run) for (root, check) in roots]
+            #chunks which are not listed by any manifest are garbage collected
+            orphan_chunks = pool.submit(_walk_folder, utils._CURRENT_DATABASE.chunk_dir, lambda folder, name: (
+                os.path.dirname(folder) == utils._CURRENT_DATABASE.chunk_dir and _mark(chunks, name)
+            ), args.dry_run)
+            for future in files:
+                prune_files += [os.path.relpath(path, base_dir) for path in future.result()]
+            prune_chunks = len(orphan_chunks.result())
+        #deltas are missing if their base is missing
+        for (folder, datafile) in bases:
+            base = bases[(folder, datafile)]
+            while base is not None and manifest[folder][base][1]:
+                base = bases.get((folder, base))
+            if base is not None:
+                manifest[folder][datafile][1] = False
         #filekeys phase
         for key in folder_map:
             if not os.path.isdir(os.path.join(
                 os.path.abspath(utils._CURRENT_DATABASE.base_dir),
                 folder_map[key]
             )):
-                for alias in [alias for alias in utils._CURRENT_DATABASE.file_keys if utils._CURRENT_DATABASE.file_keys[alias][0]==key]:
+                prune_filekeys.append(''+key)
+                if args.dry_run:
+                    continue
+                for alias in utils._CURRENT_DATABASE.list_fa(key, True):
                     del utils._CURRENT_DATABASE.file_keys[alias]
-                for statekey in [statekey for statekey in utils._CURRENT_DATABASE.state_keys if utils._CURRENT_DATABASE.state_keys[statekey][1]==key]:
+                for statekey in utils._CURRENT_DATABASE.list_sk(key):
                     del utils._CURRENT_DATABASE.state_keys[statekey]
                 del utils._CURRENT_DATABASE.file_keys[key]
-                prune_filekeys.append(''+key)
         #statekeys phase
-        for entry in [manifest[folder][datafile] for folder in manifest for datafile in manifest[folder]]:
+        for entry in [manifest[folder][datafile] for folder in manifest for datafile in manifest[folder]] + [
+            [key, blobs[blob][1]] for blob in blobs for key in blobs[blob][0]
+        ] + [
+            [key, False] for chunk in chunks if not chunks[chunk][1] for key in chunks[chunk][0]
+        ]:
             if entry[0] in utils._CURRENT_DATABASE.state_keys and not entry[1]:
+                if args.dry_run:
+                    if utils._CURRENT_DATABASE.state_keys[entry[0]][1] not in prune_filekeys and entry[0] not in prune_statekeys:
+                        prune_statekeys.append(''+entry[0])
+                    continue
                 del utils._CURRENT_DATABASE.state_keys[entry[0]]
                 prune_statekeys.append(''+entry[0])
-                for alias in [alias for alias in utils._CURRENT_DATABASE.state_keys if utils._CURRENT_DATABASE.state_keys[alias][0]==entry[0]]:
+                for alias in utils._CURRENT_DATABASE.list_sa(entry[0], True):
                     del utils._CURRENT_DATABASE.state_keys[alias]
+        verb = "Found" if args.dry_run else "Removed"
         if len(prune_folders):
-            msg += "Removed the following %d unused database folders:%s\n"%(len(prune_folders), str(prune_folders))
+            msg += verb+" the following %d unused database folders:%s\n"%(len(prune_folders), str(prune_folders))
             result['prune_folders'] = prune_folders
         if len(prune_files):
-            msg += "Removed the following %d orphaned files in the database:%s\n"%(len(prune_files), str(prune_files))
+            msg += verb+" the following %d orphaned files in the database:%s\n"%(len(prune_files), str(prune_files))
             result['prune_files'] = prune_files
+        if prune_chunks:
+            msg += verb+" %d unreferenced chunks\n"%prune_chunks
+            result['prune_chunks'] = prune_chunks
         if len(prune_filekeys):
-            msg += "Removed the following %d file keys with missing data folders:%s\n"%(len(prune_filekeys), str(prune_filekeys))
+            msg += verb+" the following %d file keys with missing data folders:%s\n"%(len(prune_filekeys), str(prune_filekeys))
             result['prune_filekeys'] = prune_filekeys
         if len(prune_statekeys):
-            msg += "Removed the following %d state keys with missing data files:%s\n"%(len(prune_statekeys), str(prune_statekeys))
+            msg += verb+" the following %d state keys with missing data files:%s\n"%(len(prune_statekeys), str(prune_statekeys))
             result['prune_statekeys'] = prune_statekeys
     if args.trash or args.clean_all:
         didop = True
         statekeys = 0
         statealiases = 0
         trashaliases = 0
-        for key in [key for key in utils._CURRENT_DATABASE.file_keys if utils._CURRENT_DATABASE.file_keys[key][0] == '~trash']:
+        for key in utils._CURRENT_DATABASE.list_fa('~trash', True):
             trashaliases +=1
             del utils._CURRENT_DATABASE.file_keys[key]
-        for key in [key for key in utils._CURRENT_DATABASE.state_keys]:
-            if key.startswith("~trash:"): #this state key belongs to the trash file key
-                if not utils._CURRENT_DATABASE.state_keys[key][0]:
-                    statekeys+=1
-                else:
+        for key in utils._CURRENT_DATABASE.list_sk('~trash'): #state keys belonging to the trash file key
+            if not utils._CURRENT_DATABASE.state_keys[key][0]:
+                statekeys+=1
+            else:
+                statealiases+=1
+            del utils._CURRENT_DATABASE.state_keys[key]
+        for filekey in utils._CURRENT_DATABASE.state_owners():
+            key = filekey+":~trash"
+            if key in utils._CURRENT_DATABASE.state_keys: #this is a trash state key, but it belongs to a regular key
+                for alias in utils._CURRENT_DATABASE.list_sa(key, True):
                     statealiases+=1
-                del utils._CURRENT_DATABASE.state_keys[key]
-            elif key.endswith(":~trash"): #this is a trash state key, but it belongs to a regular key
-                datafile = utils._CURRENT_DATABASE.state_keys[key][2]
-                utils._CURRENT_DATABASE.file_keys[utils._CURRENT_DATABASE.state_keys[key][1]][2].remove(datafile)
-                os.remove(os.path.join(
-                    os.path.abspath(utils._CURRENT_DATABASE.base_dir),
-                    utils._CURRENT_DATABASE.file_keys[utils._CURRENT_DATABASE.state_keys[key][1]][1],
-                    datafile
-                ))
+                    del utils._CURRENT_DATABASE.state_keys[alias]
+                utils._CURRENT_DATABASE.release_data(key)
                 statekeys+=1
                 del utils._CURRENT_DATABASE.state_keys[key]
-            else: #alias to a trash state key
-                entry = [item for item in utils._CURRENT_DATABASE.state_keys[key]]
-                if entry[0] and entry[0].count('~trash'):
-                    statealiases+=1
-                    del utils._CURRENT_DATABASE.state_keys[key]
         if statekeys+statealiases:
             msg += "Cleaned %d ~trash state keys and %d aliases\n"%(statekeys, statealiases)
             result['trash_state'] = [statekeys, statealiases]
         if '~trash' in utils._CURRENT_DATABASE.file_keys:
-            rmtree(os.path.join(
-                os.path.abspath(utils._CURRENT_DATABASE.base_dir),
-                utils._CURRENT_DATABASE.file_keys['~trash'][1]
-            ))
+            utils._CURRENT_DATABASE.release_folder('~trash')
             del utils._CURRENT_DATABASE.file_keys['~trash']
             msg+="Cleaned the ~trash file key and %d aliases.\n"%trashaliases
             result['trash_file'] = trashaliases
+    if args.metadata or args.clean_all:
+        didop = True
+        backfilled = utils._CURRENT_DATABASE.backfill_meta()
+        if backfilled:
+            msg += "Recorded the size, digest, and creation time of %d state keys\n"%backfilled
+            result['metadata'] = backfilled
+        dropped = utils._CURRENT_DATABASE.drop_hash_aliases()
+        if dropped:
+            msg += "Removed %d stored hash aliases, which are now resolved from state digests\n"%dropped
+            result['hash_aliases'] = dropped
+        pruned = utils._CURRENT_DATABASE.prune_counters()
+        if pruned:
+            msg += "Removed %d name counters of deleted keys\n"%pruned
+            result['counters'] = pruned
     if args.deduplicate or args.clean_all:
         didop = True
         duplicates = {} #file key -> hash -> original state key
         forward = {} #duplicate state key -> original state key
-        for key in sorted([key for key in utils._CURRENT_DATABASE.state_keys if not utils._CURRENT_DATABASE.state_keys[key][0]]):
-            entry = [item for item in utils._CURRENT_DATABASE.state_keys[key]]
-            reader = open(os.path.join(
-                os.path.abspath(utils._CURRENT_DATABASE.base_dir),
-                utils._CURRENT_DATABASE.file_keys[entry[1]][1],
-                entry[2]
-            ), mode='rb')
-            hashsum = utils.gethash(reader)
-            reader.close()
+        digests = _state_digests(
+            sorted([key for key in utils._CURRENT_DATABASE.state_keys if not utils._CURRENT_DATABASE.state_keys[key][0]]),
+            utils.worker_count(args.workers)
+        )
+        for key in digests:
+            entry = utils._CURRENT_DATABASE.state_keys[key]
+            hashsum = digests[key]
             if entry[1] not in duplicates:
                 duplicates[entry[1]] = {}
             if hashsum not in duplicates[entry[1]]:
                 duplicates[entry[1]][hashsum] = ''+key
             else:
                 forward[''+key] = duplicates[entry[1]][hashsum]
-                entry = [item for item in utils._CURRENT_DATABASE.state_keys[key]]
-                os.remove(os.path.join(
-                    os.path.abspath(utils._CURRENT_DATABASE.base_dir),
-                    utils._CURRENT_DATABASE.file_keys[entry[1]][1],
-                    entry[2]
-                ))
-                utils._CURRENT_DATABASE.file_keys[entry[1]][2].remove(entry[2])
+                utils._CURRENT_DATABASE.release_data(key)
                 del utils._CURRENT_DATABASE.state_keys[key]
         didforward = 0
-        for key in [key for key in utils._CURRENT_DATABASE.state_keys if utils._CURRENT_DATABASE.state_keys[key][0]]:
-            if utils._CURRENT_DATABASE.state_keys[key][0] in forward: #this is a state alias which should be forwarded
-                utils._CURRENT_DATABASE.state_keys[key][0] = forward[utils._CURRENT_DATABASE.state_keys[key][0]]
+        for duplicate in forward:
+            for key in utils._CURRENT_DATABASE.list_sa(duplicate): #state aliases which should be forwarded
+                entry = utils._CURRENT_DATABASE.state_keys[key]
+                utils._CURRENT_DATABASE.state_keys[key] = [forward[duplicate], entry[1], None]
                 didforward += 1
         for filekey in duplicates:
             for hashkey in duplicates[filekey]:
+                if utils._CURRENT_DATABASE.state_meta(duplicates[filekey][hashkey]) is not None:
+                    continue #resolved virtually from the recorded digest
                 if filekey+":"+hashkey not in utils._CURRENT_DATABASE.state_keys:
                     utils._CURRENT_DATABASE.register_sa(filekey, duplicates[filekey][hashkey].replace(filekey+":", '', 1), hashkey, overwrite=True)
                 if filekey+":"+hashkey[:7] not in utils._CURRENT_DATABASE.state_keys:
@@ -221,9 +358,33 @@ def command_clean(args, do_print):
                 didforward
             )
             result['deduplicate'] = forward
+    if args.incremental:
+        didop = True
+        if os.path.exists(os.path.join(utils._CURRENT_DATABASE.base_dir, RELAYOUT_MARKER)):
+            raise DatabaseFailure("Unable to collect garbage: A layout change was interrupted.  Run '$ quicksave layout' again to finish it")
+        summary = collect(utils._CURRENT_DATABASE, args.budget, args.max_bytes)
+        msg += "Checked %d keys and folders (%s)\n"%(
+            summary['items'],
+            "finished" if summary['complete'] else "the next run will continue from here"
+        )
+        if len(summary['prune_statekeys']):
+            msg += "Removed the following %d state keys with missing data files:%s\n"%(len(summary['prune_statekeys']), str(summary['prune_statekeys']))
+        if summary['metadata']:
+            msg += "Recorded the size, digest, and creation time of %d state keys\n"%summary['metadata']
+        if len(summary['deduplicate']):
+            msg += "Removed the following %d duplicate state keys:%s\n"%(len(summary['deduplicate']), str(list(summary['deduplicate'])))
+        if len(summary['prune_files']):
+            msg += "Removed the following %d orphaned files in the database:%s\n"%(len(summary['prune_files']), str(summary['prune_files']))
+        if summary['counters']:
+            msg += "Removed %d name counters of deleted keys\n"%summary['counters']
+        result['incremental'] = summary
+    if args.journal or args.clean_all:
+        didop = True
+        msg += "Compacted the database index (%s engine)\n" % utils._CURRENT_DATABASE.engine.name
+        result['journal'] = utils._CURRENT_DATABASE.engine.name
     if not didop:
         sys.exit("No action taken.  Set at least one of the flags when using '$ quicksave clean'")
-    utils._CURRENT_DATABASE.save()
+    utils._CURRENT_DATABASE.save(checkpoint=args.journal or args.clean_all)
     if len(msg):
         do_print(msg[:-1])
     else:
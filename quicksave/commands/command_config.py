@@ -1,9 +1,12 @@
 import sys
 import csv
-from .. import utils
+from .. import utils, qs_database
 
 def command_config(args, do_print):
     utils.initdb(do_print)
+    if args.key == qs_database.LAYOUT_FLAG and not args._global and (args.value is not None or args.clear):
+        #changing the setting without moving the data files would lose every state
+        sys.exit("Unable to change %s: Use '$ quicksave layout' to change the layout of the database"%args.key)
     if args.value is not None: #set config
         if args._global:
             utils._FLAGS[args.key] = args.value
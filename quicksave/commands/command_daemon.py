@@ -0,0 +1,19 @@
+import sys
+from .. import utils, qs_daemon
+
+def command_daemon(args, do_print):
+    if args.stop or args.status:
+        response = qs_daemon.request({'stop' if args.stop else 'ping': True})
+        if response is None:
+            sys.exit("No daemon is running")
+        do_print("Daemon %s after serving %d requests" % (
+            'stopped' if args.stop else 'is running',
+            response['served']
+        ))
+        return response['served']
+    database_path = utils.initdb(do_print)
+    do_print("Serving database", database_path, "at", utils.daemonfile)
+    sys.stdout.flush()
+    served = qs_daemon.serve(do_print=do_print)
+    do_print("Daemon stopped after serving %d requests" % served)
+    return served
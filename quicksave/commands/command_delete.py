@@ -1,7 +1,7 @@
 import sys
 import os
-from shutil import rmtree
 from .. import utils
+from ..qs_errors import KeyNotFound
 
 def command_delete(args, do_print):
     utils.initdb(do_print)
@@ -15,25 +15,22 @@ def command_delete(args, do_print):
         #   - Unregister all file aliases
         #   - Update all state keys and aliases to point to ~trash:<key>
         if args.target not in utils._CURRENT_DATABASE.file_keys:
-            sys.exit("Unable to delete key: The provided file key does not exist in this database (%s)"%args.target)
+            raise KeyNotFound("Unable to delete key: The provided file key does not exist in this database (%s)"%args.target)
         if utils._CURRENT_DATABASE.file_keys[args.target][0]:
             sys.exit("Unable to delete key: The provided file key was an alias.  Use '$ quicksave alias -d <file alias>' to delete")
         if args.target == '~trash':
             sys.exit("Unable to directly delete ~trash keys.  Use '$ quicksave clean -t' to clean all ~trash keys")
         if args.save and '~trash' in utils._CURRENT_DATABASE.file_keys:
-            rmtree(os.path.join(
-                os.path.abspath(utils._CURRENT_DATABASE.base_dir),
-                utils._CURRENT_DATABASE.file_keys['~trash'][1]
-            ))
+            utils._CURRENT_DATABASE.release_folder('~trash')
             if args.clean_aliases:
-                for key in [key for key in utils._CURRENT_DATABASE.file_keys if utils._CURRENT_DATABASE.file_keys[key][0]=='~trash']:
+                for key in utils._CURRENT_DATABASE.list_fa('~trash', True):
                     del utils._CURRENT_DATABASE.file_keys[key]
-            for key in [key for key in utils._CURRENT_DATABASE.state_keys if key.startswith('~trash')]:
+            for key in utils._CURRENT_DATABASE.list_sk('~trash'):
                 del utils._CURRENT_DATABASE.state_keys[key]
             del utils._CURRENT_DATABASE.file_keys['~trash']
-        for key in [key for key in utils._CURRENT_DATABASE.file_keys if utils._CURRENT_DATABASE.file_keys[key][0]==args.target]:
+        for key in utils._CURRENT_DATABASE.list_fa(args.target, True):
             del utils._CURRENT_DATABASE.file_keys[key]
-        for key in [key for key in utils._CURRENT_DATABASE.state_keys if key.startswith(args.target+":")]:
+        for key in utils._CURRENT_DATABASE.list_sk(args.target):
             if args.save:
                 entry = [item for item in utils._CURRENT_DATABASE.state_keys[key]]
                 entry[1] = entry[1].replace(args.target, '~trash', 1)
@@ -45,10 +42,7 @@ def command_delete(args, do_print):
             didtrash = True
             utils._CURRENT_DATABASE.file_keys['~trash'] = [item for item in utils._CURRENT_DATABASE.file_keys[args.target]]
         else:
-            rmtree(os.path.join(
-                os.path.abspath(utils._CURRENT_DATABASE.base_dir),
-                utils._CURRENT_DATABASE.file_keys[args.target][1]
-            ))
+            utils._CURRENT_DATABASE.release_folder(args.target)
         del utils._CURRENT_DATABASE.file_keys[args.target]
         utils._CURRENT_DATABASE.save()
         do_print("Deleted file key: %s"%args.target)
@@ -61,41 +55,27 @@ def command_delete(args, do_print):
         #   - Remove any state aliases to ~trash (-c)
         #   - Unregister all state aliases
         if args.filekey not in utils._CURRENT_DATABASE.file_keys:
-            sys.exit("Unable to delete key: The provided file key does not exist in this database (%s)"%args.filekey)
+            raise KeyNotFound("Unable to delete key: The provided file key does not exist in this database (%s)"%args.filekey)
         authoritative_key = utils._CURRENT_DATABASE.resolve_key(args.filekey, True)
         if authoritative_key+":"+args.target not in utils._CURRENT_DATABASE.state_keys:
-            sys.exit("Unable to delete key: The provided state key does not exist in this database (%s)"%args.target)
+            raise KeyNotFound("Unable to delete key: The provided state key does not exist in this database (%s)"%args.target)
         if utils._CURRENT_DATABASE.state_keys[authoritative_key+":"+args.target][0]:
             sys.exit("Unable to delete key: The provided state key was an alias.  Use '$ quicksave alias -d <state alias> <file key>' to delete a state alias")
         if args.target == '~trash':
             sys.exit("Unable to directly delete ~trash keys.  Use '$ quicksave clean -t' to clean all ~trash keys")
         if args.save and authoritative_key+":~trash" in utils._CURRENT_DATABASE.state_keys:
-            os.remove(os.path.join(
-                os.path.abspath(utils._CURRENT_DATABASE.base_dir),
-                utils._CURRENT_DATABASE.file_keys[authoritative_key][1],
-                utils._CURRENT_DATABASE.state_keys[authoritative_key+":~trash"][2]
-            ))
-            utils._CURRENT_DATABASE.file_keys[authoritative_key][2].remove(
-                utils._CURRENT_DATABASE.state_keys[authoritative_key+":~trash"][2]
-            )
+            utils._CURRENT_DATABASE.release_data(authoritative_key+":~trash")
             if args.clean_aliases:
-                for key in [key for key in utils._CURRENT_DATABASE.state_keys if utils._CURRENT_DATABASE.state_keys[key][0]==authoritative_key+":~trash"]:
+                for key in utils._CURRENT_DATABASE.list_sa(authoritative_key+":~trash", True):
                     del utils._CURRENT_DATABASE.state_keys[key]
             del utils._CURRENT_DATABASE.state_keys[authoritative_key+":~trash"]
-        for key in [key for key in utils._CURRENT_DATABASE.state_keys if utils._CURRENT_DATABASE.state_keys[key][0]==authoritative_key+":"+args.target]:
+        for key in utils._CURRENT_DATABASE.list_sa(authoritative_key+":"+args.target, True):
             del utils._CURRENT_DATABASE.state_keys[key]
         if args.save:
             didtrash = True
             utils._CURRENT_DATABASE.state_keys[authoritative_key+":~trash"] = [item for item in utils._CURRENT_DATABASE.state_keys[authoritative_key+":"+args.target]]
         else:
-            os.remove(os.path.join(
-                os.path.abspath(utils._CURRENT_DATABASE.base_dir),
-                utils._CURRENT_DATABASE.file_keys[authoritative_key][1],
-                utils._CURRENT_DATABASE.state_keys[authoritative_key+":"+args.target][2]
-            ))
-            utils._CURRENT_DATABASE.file_keys[authoritative_key][2].remove(
-                utils._CURRENT_DATABASE.state_keys[authoritative_key+":"+args.target][2]
-            )
+            utils._CURRENT_DATABASE.release_data(authoritative_key+":"+args.target)
         del utils._CURRENT_DATABASE.state_keys[authoritative_key+":"+args.target]
         utils._CURRENT_DATABASE.register_fa(authoritative_key, '~last', True)
         utils._CURRENT_DATABASE.save()
@@ -1,6 +1,6 @@
 import os
 import sys
-from .. import utils, qs_database
+from .. import utils, qs_database, qs_engines, qs_compress
 import argparse
 import zipfile
 import tarfile
@@ -28,6 +28,10 @@ def get_member(archive, member, staging_dir):
         member
     )
 
+def read_member(archive, member, staging_dir):
+    with open(get_member(archive, member, staging_dir), mode='rb') as reader:
+        return reader.read()
+
 def strip_key(key, keycode):
     return keycode.join(key.split(keycode)[:-1])+keycode
 
@@ -59,10 +63,12 @@ def command_export(args, do_print):
 
     staging = tempfile.TemporaryDirectory()
     meta = open(staging.name+os.path.sep+'META', 'w')
+    #archives always contain the index in the text format
+    qs_engines.TextEngine(staging.name).create(utils._CURRENT_DATABASE.rows())
     add_file(
         archive,
         os.path.join(
-            utils._CURRENT_DATABASE.base_dir,
+            staging.name,
             '.db_config'
         ),
         'DATABASE'
@@ -78,15 +84,24 @@ def command_export(args, do_print):
                 '--KEY:\t%s\n' % key
             )
             for state in data[2]:
-                add_file(
-                    archive,
-                    os.path.join(
-                        utils._CURRENT_DATABASE.base_dir,
-                        data[1],
-                        state
-                    ),
-                    key+'.'+state
-                )
+                if qs_database.is_chunked(state):
+                    #chunks are not archived, so chunked states are archived in full
+                    utils._CURRENT_DATABASE.copy_data(key, state, os.path.join(staging.name, 'STATE'))
+                    add_file(archive, os.path.join(staging.name, 'STATE'), key+'.'+state)
+                    os.remove(os.path.join(staging.name, 'STATE'))
+                elif state.startswith(qs_database.COMPRESSED_PREFIX):
+                    #archives are already compressed, so states are archived decompressed
+                    with open(utils._CURRENT_DATABASE.data_path(key, state), mode='rb') as reader:
+                        with open(os.path.join(staging.name, 'STATE'), mode='wb') as writer:
+                            qs_compress.decompress(reader, writer)
+                    add_file(archive, os.path.join(staging.name, 'STATE'), key+'.'+state)
+                    os.remove(os.path.join(staging.name, 'STATE'))
+                else:
+                    add_file(
+                        archive,
+                        utils._CURRENT_DATABASE.data_path(key, state),
+                        key+'.'+state
+                    )
     if not args.exclude_global:
         for (key, value) in utils._FLAGS.items():
             meta.write(
@@ -204,16 +219,18 @@ def command_import(args, do_print):
                 if args.mode == 'overwrite' or args.mode == 'merge':
                     foldernames[filekey] = utils._CURRENT_DATABASE.file_keys[filekey][1]
                 elif args.mode == 'rename' or args.mode == 'copy':
-                    keynames[filekey] = qs_database.make_key(
+                    keynames[filekey] = utils._CURRENT_DATABASE.next_key(
+                        'FK:'+strip_key(filekey, '_FK')[:-len('_FK')],
                         strip_key(filekey, '_FK'),
-                        utils._CURRENT_DATABASE.file_keys
+                        utils._CURRENT_DATABASE.file_keys.__contains__
                     )
                     foldernames[filekey] = os.path.abspath(
                         os.path.join(
                             utils._CURRENT_DATABASE.base_dir,
-                            qs_database.reserve_name(
+                            utils._CURRENT_DATABASE.next_name(
+                                'folder:'+os.path.basename(filedata[1]),
                                 os.path.basename(filedata[1]),
-                                current_folders
+                                current_folders.__contains__
                             )
                         )
                     )
@@ -225,9 +242,10 @@ def command_import(args, do_print):
                 foldernames[filekey] = os.path.abspath(
                     os.path.join(
                         utils._CURRENT_DATABASE.base_dir,
-                        qs_database.reserve_name(
+                        utils._CURRENT_DATABASE.next_name(
+                            'folder:'+filedata[1],
                             filedata[1],
-                            current_folders
+                            current_folders.__contains__
                         )
                     )
                 )
@@ -253,30 +271,58 @@ def command_import(args, do_print):
             newkey = keynames[parent]+':'+state
             keynames[newkey] = newkey
             keynames[statekey] = newkey
-            filenames[newkey] = statedata[2]
-            filenames[statekey] = statedata[2]
+            #deltas are imported as full copies, since their bases may be renamed.
+            #Compressed and chunked states are archived in full, and imported as full copies
+            filenames[newkey] = statedata[2].lstrip(
+                qs_database.COMPRESSED_PREFIX+qs_database.DELTA_PREFIX+qs_database.CHUNKED_PREFIX
+            )
+            filenames[statekey] = filenames[newkey]
             if newkey in utils._CURRENT_DATABASE.state_keys:
                 if args.mode == 'overwrite' or args.mode == 'merge':
-                    filenames[newkey] = utils._CURRENT_DATABASE.state_keys[newkey][2]
+                    current = utils._CURRENT_DATABASE.state_keys[newkey][2]
+                    if (current.startswith((
+                                qs_database.BLOB_PREFIX,
+                                qs_database.DELTA_PREFIX,
+                                qs_database.COMPRESSED_PREFIX,
+                                qs_database.CHUNKED_PREFIX
+                            )) or
+                            filenames[newkey].startswith(qs_database.BLOB_PREFIX)):
+                        #the stored state cannot be replaced in place
+                        utils._CURRENT_DATABASE.release_data(newkey)
+                        if filenames[newkey] in utils._CURRENT_DATABASE.file_keys[keynames[parent]][2]:
+                            filenames[newkey] = utils._CURRENT_DATABASE.next_name(
+                                'DF:'+keynames[parent]+':'+filenames[newkey],
+                                filenames[newkey],
+                                utils._CURRENT_DATABASE.file_keys[keynames[parent]][2].__contains__
+                            )
+                    else:
+                        utils._CURRENT_DATABASE.detach_data(keynames[parent], current)
+                        filenames[newkey] = current
                     filenames[statekey] = filenames[newkey]
                 elif args.mode == 'rename' or args.mode == 'copy':
-                    keynames[newkey] = qs_database.make_key(
-                        strip_key(newkey, '_SK'),
-                        utils._CURRENT_DATABASE.state_keys
+                    prefix = strip_key(state, '_SK')
+                    keynames[newkey] = keynames[parent]+':'+utils._CURRENT_DATABASE.next_key(
+                        'SK:'+keynames[parent]+':'+prefix[:-len('_SK')],
+                        prefix,
+                        lambda key: keynames[parent]+':'+key in utils._CURRENT_DATABASE.state_keys
                     )
                     keynames[statekey] = keynames[newkey]
-                    filenames[newkey] = qs_database.reserve_name(
-                        statedata[2],
-                        utils._CURRENT_DATABASE.file_keys[keynames[parent]][2]
-                    )
+                    if not qs_database.is_blob(statedata[2]): #blobs with the same name are identical
+                        filenames[newkey] = utils._CURRENT_DATABASE.next_name(
+                            'DF:'+keynames[parent]+':'+filenames[newkey],
+                            filenames[newkey],
+                            utils._CURRENT_DATABASE.file_keys[keynames[parent]][2].__contains__
+                        )
                     filenames[statekey] = filenames[newkey]
                 elif args.mode == 'keep' or args.mode == 'fail':
                     del keynames[statekey]
                     continue
-            elif statedata[2] in utils._CURRENT_DATABASE.file_keys[keynames[parent]][2]:
-                filenames[newkey] = qs_database.reserve_name(
-                    statedata[2],
-                    utils._CURRENT_DATABASE.file_keys[keynames[parent]][2]
+            elif (filenames[newkey] in utils._CURRENT_DATABASE.file_keys[keynames[parent]][2] and
+                    not qs_database.is_blob(statedata[2])):
+                filenames[newkey] = utils._CURRENT_DATABASE.next_name(
+                    'DF:'+keynames[parent]+':'+filenames[newkey],
+                    filenames[newkey],
+                    utils._CURRENT_DATABASE.file_keys[keynames[parent]][2].__contains__
                 )
                 filenames[statekey] = filenames[newkey]
             output[statekey] = [keynames[newkey], filenames[newkey]]
@@ -288,18 +334,24 @@ def command_import(args, do_print):
                 None,
                 keynames[parent],
                 filenames[newkey]
-            ]
-            shutil.copyfile(
-                get_member(
-                    archive,
-                    statedata[1]+'.'+statedata[2],
-                    staging
-                ),
-                os.path.join(
-                    foldernames[parent],
-                    filenames[newkey]
+            ] + statedata[3:] #the metadata recorded by the exporting database, if any
+            destination = utils._CURRENT_DATABASE.data_path(keynames[parent], filenames[newkey])
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+            if qs_database.is_delta(statedata[2]):
+                with open(destination, mode='wb') as writer:
+                    writer.write(qs_database.read_data(
+                        lambda name: read_member(archive, statedata[1]+'.'+name, staging),
+                        statedata[2]
+                    ))
+            elif not (filenames[newkey].startswith(qs_database.BLOB_PREFIX) and os.path.isfile(destination)):
+                shutil.copyfile(
+                    get_member(
+                        archive,
+                        statedata[1]+'.'+statedata[2],
+                        staging
+                    ),
+                    destination
                 )
-            )
             utils._CURRENT_DATABASE.file_keys[keynames[parent]][2].add(
                 filenames[newkey]
             )
@@ -310,9 +362,10 @@ def command_import(args, do_print):
             keynames[filealias] = filealias
             if filealias in utils._CURRENT_DATABASE.file_keys:
                 if args.mode == 'rename' or args.mode == 'copy':
-                    keynames[filealias] = qs_database.make_key(
+                    keynames[filealias] = utils._CURRENT_DATABASE.next_key(
+                        'FA:'+filealias,
                         filealias,
-                        utils._CURRENT_DATABASE.file_keys
+                        utils._CURRENT_DATABASE.file_keys.__contains__
                     )
                 elif args.mode == 'keep' or args.mode == 'fail':
                     continue
@@ -333,9 +386,10 @@ def command_import(args, do_print):
             keynames[statealias] = statealias
             if statealias in utils._CURRENT_DATABASE.state_keys:
                 if args.mode == 'rename' or args.mode == 'copy':
-                    keynames[statealias] = qs_database.make_key(
+                    keynames[statealias] = utils._CURRENT_DATABASE.next_key(
+                        'SA:'+statealias,
                         statealias,
-                        utils._CURRENT_DATABASE.state_keys
+                        utils._CURRENT_DATABASE.state_keys.__contains__
                     )
                 elif args.mode == 'keep' or args.mode == 'fail':
                     continue
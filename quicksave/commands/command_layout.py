@@ -0,0 +1,23 @@
+import os
+from .. import utils
+from ..qs_database import RELAYOUT_MARKER
+from ..qs_errors import DatabaseFailure
+
+def command_layout(args, do_print):
+    utils.initdb(do_print)
+    current = utils._CURRENT_DATABASE.layout()
+    marker = os.path.join(utils._CURRENT_DATABASE.base_dir, RELAYOUT_MARKER)
+    if args.layout is None:
+        do_print("Data folders use the %s layout"%current)
+        if os.path.exists(marker):
+            do_print("A layout change was interrupted.  Run '$ quicksave layout' again to finish it")
+        return [current]
+    if args.layout == current and not os.path.exists(marker):
+        raise DatabaseFailure("Unable to change layout: The database already uses the %s layout"%current)
+    #the marker stops '$ quicksave clean -w' from removing files which were not moved yet
+    open(marker, 'w').close()
+    moved = utils._CURRENT_DATABASE.relayout(args.layout)
+    utils._CURRENT_DATABASE.save()
+    os.remove(marker)
+    do_print("Moved %d data files from the %s layout to the %s layout"%(moved, current, args.layout))
+    return [current, args.layout, moved]
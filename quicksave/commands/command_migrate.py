@@ -0,0 +1,15 @@
+import sys
+from .. import utils
+from ..qs_errors import DatabaseFailure
+
+def command_migrate(args, do_print):
+    utils.initdb(do_print)
+    current = utils._CURRENT_DATABASE.engine.name
+    if args.engine == current:
+        raise DatabaseFailure("Unable to migrate: The database already uses the %s engine"%current)
+    try:
+        utils._CURRENT_DATABASE.migrate(args.engine)
+    except ValueError as e:
+        sys.exit("Unable to migrate: %s"%e)
+    do_print("Migrated the database index from the %s engine to the %s engine"%(current, args.engine))
+    return [current, args.engine]
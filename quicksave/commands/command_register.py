@@ -1,27 +1,29 @@
 import os
 import sys
-from .. import utils
+from .. import utils, qs_bulk
+from ..qs_errors import KeyConflict, ReservedKey
+from ..qs_database import MIN_HASH_PREFIX, hash_like
 
-def command_register(args, do_print):
-    utils.initdb(do_print)
-    filepath = os.path.abspath(args.filename.name)
+def _register_fk(args, filepath):
+    #Registers a new file key and its aliases.  Returns (file key, data folder, file aliases)
+    filepath = os.path.abspath(filepath)
     if filepath in utils._CURRENT_DATABASE.file_keys and not args.ignore_filepath:
-        sys.exit("Unable to register: Filepath is registered to file key %s (use --ignore-filepath to override this behavior)"%(
+        raise KeyConflict("Unable to register: Filepath is registered to file key %s (use --ignore-filepath to override this behavior)"%(
             utils._CURRENT_DATABASE.file_keys[filepath][0]
         ))
     (key, folder) = utils._CURRENT_DATABASE.register_fk(filepath)
     utils._CURRENT_DATABASE.register_fa(key, '~last', True)
     if key in utils._SPECIAL_FILE:
-        sys.exit("Unable to register: The provided filename overwrites a reserved file key (%s)"%key)
+        raise ReservedKey("Unable to register: The provided filename overwrites a reserved file key (%s)"%key)
     file_aliases = []
     if len(args.file_alias):
         for user_alias in args.file_alias:
             if user_alias in utils._SPECIAL_FILE:
-                sys.exit("Unable to register: Cannot create a file alias which overwrites a reserved file key (%s)"%user_alias)
+                raise ReservedKey("Unable to register: Cannot create a file alias which overwrites a reserved file key (%s)"%user_alias)
             if utils._CURRENT_DATABASE.register_fa(key, user_alias):
                 file_aliases.append(''+user_alias)
         if not len(file_aliases):
-            sys.exit("Unable to register: None of the provided aliases were available")
+            raise KeyConflict("Unable to register: None of the provided aliases were available")
     if (
             (utils._checkflag('inference.path', '1')=='1' or utils._checkflag('inference.norecord', '0')=='0') and
             filepath not in utils._SPECIAL_FILE and
@@ -34,27 +36,82 @@ def command_register(args, do_print):
             utils._CURRENT_DATABASE.register_fa(key, os.path.basename(filepath))
         ):
         file_aliases.append(os.path.basename(filepath))
-    (statekey, datafile) = utils._CURRENT_DATABASE.register_sk(key, os.path.relpath(filepath))
-    hashalias = utils.gethash(args.filename)
-    args.filename.close()
-    utils._CURRENT_DATABASE.register_sa(key, statekey, hashalias)
+    return (key, folder, file_aliases)
+
+def _register_sk(args, do_print, filepath, key, file_aliases, strategy, prepared):
+    (hashalias, staged, manifest) = prepared
+    (statekey, datafile) = utils._CURRENT_DATABASE.register_sk(
+        key,
+        os.path.relpath(filepath),
+        staged=staged,
+        manifest=manifest,
+        copy=strategy,
+        hashsum=hashalias,
+        **utils.storage_options(key, hashalias)
+    )
     state_aliases = []
-    if key+":"+hashalias[:7] in utils._CURRENT_DATABASE.state_keys:
-        del utils._CURRENT_DATABASE.state_keys[key+":"+hashalias[:7]]
-    else:
-        utils._CURRENT_DATABASE.register_sa(key, statekey, hashalias[:7])
+    if utils._CURRENT_DATABASE.is_hash_alias(key+":"+hashalias[:7]):
+        #hash aliases are resolved from the state's digest, and are not stored
         state_aliases.append(hashalias[:7])
     if len(args.aliases):
         for user_alias in args.aliases:
             if user_alias in utils._SPECIAL_STATE:
-                sys.exit("Unable to register: Cannot create a state alias which overwrites a reserved state key (%s)" % user_alias)
+                raise ReservedKey("Unable to register: Cannot create a state alias which overwrites a reserved state key (%s)" % user_alias)
+            if hash_like(user_alias):
+                raise ReservedKey("Unable to register: State aliases of %d or more hexadecimal digits are reserved for state hashes (%s)" % (MIN_HASH_PREFIX, user_alias))
             if utils._CURRENT_DATABASE.register_sa(key, statekey, user_alias):
                 state_aliases.append(''+user_alias)
         if not len(state_aliases):
-            sys.exit("Unable to save: None of the provided aliases were available")
+            raise KeyConflict("Unable to save: None of the provided aliases were available")
     utils._CURRENT_DATABASE.save()
     do_print("Registered new file key:", key)
     do_print("Aliases for this file key:", file_aliases)
     do_print("Initial state key:", statekey)
     do_print("Aliases for this state key:", state_aliases)
+    if utils._CURRENT_DATABASE.copy_strategy is not None:
+        do_print("Copied with:", utils._CURRENT_DATABASE.copy_strategy)
     return [key, [item for item in file_aliases], statekey, [item for item in state_aliases]]
+
+def _register_many(args, do_print, use_cache, strategy):
+    def commit(path, prepared):
+        do_print(path)
+        try:
+            (key, folder, file_aliases) = _register_fk(args, path)
+        except SystemExit:
+            #new file keys have no data folder until they are registered, so files are staged in the database folder
+            if prepared[1] is not None:
+                os.remove(prepared[1])
+            raise
+        return _register_sk(args, do_print, path, key, file_aliases, strategy, prepared)
+    paths = qs_bulk.expand(args.files, args.include, args.exclude)
+    if not len(paths):
+        sys.exit("Unable to register: No files matched the provided paths")
+    results = qs_bulk.run(
+        paths,
+        lambda path: utils._CURRENT_DATABASE.base_dir,
+        lambda reader, folder, cache: utils.prepare_file(reader, folder, strategy, use_cache, cache),
+        commit,
+        utils.worker_count(args.workers, 'save.workers'),
+        do_print
+    )
+    do_print("Registered %d of %d files"%(len([result for result in results if result['error'] is None]), len(results)))
+    return results
+
+def command_register(args, do_print):
+    utils.initdb(do_print)
+    use_cache = utils._checkflag('hash.cache', '1')=='1'
+    strategy = utils.copy_strategy(args.copy_strategy)
+    if args.files:
+        if args.filename is not None:
+            sys.exit("Unable to register: Provide either a filename or --files, not both")
+        return _register_many(args, do_print, use_cache, strategy)
+    if args.filename is None:
+        args.help()
+        sys.exit("Unable to register: A filename or --files must be provided")
+    (key, folder, file_aliases) = _register_fk(args, args.filename.name)
+    cache = utils._load_hash_cache() if use_cache else None
+    prepared = utils.prepare_file(args.filename, folder, strategy, use_cache, cache)
+    if cache is not None and cache.changed:
+        utils._write_hash_cache(cache)
+    args.filename.close()
+    return _register_sk(args, do_print, os.path.abspath(args.filename.name), key, file_aliases, strategy, prepared)
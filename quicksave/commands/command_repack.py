@@ -0,0 +1,35 @@
+import os
+import sys
+from .. import utils
+from ..qs_errors import KeyNotFound
+
+def _folder_size(database, filekey):
+    return sum(
+        os.path.getsize(database.data_path(filekey, data_file))
+        for data_file in database.file_keys[filekey][2]
+        if os.path.isfile(database.data_path(filekey, data_file))
+    )
+
+def command_repack(args, do_print):
+    utils.initdb(do_print)
+    chain = args.chain if args.chain is not None else int(utils._checkflag('storage.delta', '0'))
+    if chain < 0:
+        sys.exit("Unable to repack: The chain length cannot be negative")
+    if args.filekey is not None:
+        if args.filekey not in utils._CURRENT_DATABASE.file_keys:
+            raise KeyNotFound("Unable to repack: The requested file key does not exist in this database (%s)"%args.filekey)
+        filekeys = [utils._CURRENT_DATABASE.resolve_key(args.filekey, True)]
+    else:
+        filekeys = [
+            key for (key, entry) in utils._CURRENT_DATABASE.file_keys.items()
+            if entry[0] is None and key != '~trash'
+        ]
+    result = {}
+    for filekey in filekeys:
+        before = _folder_size(utils._CURRENT_DATABASE, filekey)
+        utils._CURRENT_DATABASE.repack(filekey, chain, utils.storage_options(filekey, None)['compress'])
+        result[filekey] = [before, _folder_size(utils._CURRENT_DATABASE, filekey)]
+    utils._CURRENT_DATABASE.save()
+    for (filekey, (before, after)) in result.items():
+        do_print("%s: %d bytes -> %d bytes" % (filekey, before, after))
+    return result
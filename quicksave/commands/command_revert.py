@@ -1,10 +1,10 @@
 import os
-import sys
-from shutil import copyfile
 from .. import utils
+from ..qs_errors import KeyConflict, KeyNotFound
 
 def command_revert(args, do_print):
     utils.initdb(do_print)
+    strategy = utils.copy_strategy(args.copy_strategy)
     infer = not bool(args.file_key)
     did_stash = False
     args.stash = utils._check_action(args.stash, args.nstash, 'revert.stash', '1')
@@ -15,37 +15,50 @@ def command_revert(args, do_print):
         elif utils._checkflag('inference.name', '1')=='1' and os.path.basename(filepath) in utils._CURRENT_DATABASE.file_keys:
             args.file_key = utils._CURRENT_DATABASE.resolve_key(os.path.basename(filepath), True)
         else:
-            sys.exit("Unable to revert: Could not infer the file key.  Please set one explicitly with the -k option")
+            raise KeyNotFound("Unable to revert: Could not infer the file key.  Please set one explicitly with the -k option")
     if args.file_key not in utils._CURRENT_DATABASE.file_keys:
-        sys.exit("Unable to revert: The requested file key does not exist in this database (%s)" %(args.file_key))
+        raise KeyNotFound("Unable to revert: The requested file key does not exist in this database (%s)" %(args.file_key))
     args.file_key = utils._CURRENT_DATABASE.resolve_key(args.file_key, True)
     if args.file_key+":"+args.state not in utils._CURRENT_DATABASE.state_keys:
-        sys.exit("Unable to revert: The requested state (%s) does not exist for this file key (%s)" %(args.state, args.file_key))
+        raise KeyNotFound("Unable to revert: The requested state (%s) does not exist for this file key (%s)" %(args.state, args.file_key))
     utils._CURRENT_DATABASE.register_fa(args.file_key, '~last', True)
-    hashalias = utils.gethash(args.filename)
+    use_cache = utils._check_action(False, args.no_cache, 'hash.cache', '1')
+    cache = utils._load_hash_cache() if use_cache else None
+    hashalias = utils.gethash_cached(args.filename, use_cache, cache)
+    if cache is not None and cache.changed:
+        utils._write_hash_cache(cache)
     currentstate = utils.fetchstate(hashalias, args.file_key)
     authoritative_key = utils._CURRENT_DATABASE.resolve_key(args.file_key+":"+args.state, False)
     if currentstate == authoritative_key and not args.force:
-        sys.exit("Unable to revert: The file is already in the requested state")
+        raise KeyConflict("Unable to revert: The file is already in the requested state")
     if args.stash and not args.state == '~stash':
         did_stash = True
         if args.file_key+":~stash" in utils._CURRENT_DATABASE.state_keys:
-            oldfile = utils._CURRENT_DATABASE.state_keys[args.file_key+":~stash"][2]
-            if oldfile in utils._CURRENT_DATABASE.file_keys[args.file_key][2]:
-                utils._CURRENT_DATABASE.file_keys[args.file_key][2].remove(oldfile)
+            if utils._CURRENT_DATABASE.state_keys[args.file_key+":~stash"][2] is not None:
+                #the old stash is removed, since its name is not reused
+                utils._CURRENT_DATABASE.release_data(args.file_key+":~stash")
             del utils._CURRENT_DATABASE.state_keys[args.file_key+":~stash"]
         if currentstate:
             utils._CURRENT_DATABASE.register_sa(args.file_key, hashalias, '~stash', True)
         else:
-            utils._CURRENT_DATABASE.register_sk(args.file_key, os.path.abspath(args.filename.name), '~stash')
+            utils._CURRENT_DATABASE.register_sk(
+                args.file_key,
+                os.path.abspath(args.filename.name),
+                '~stash',
+                copy=strategy,
+                hashsum=hashalias,
+                **utils.storage_options(args.file_key, hashalias)
+            )
     args.filename.close()
     statefile = utils._CURRENT_DATABASE.state_keys[authoritative_key][2]
-    copyfile(os.path.join(utils._CURRENT_DATABASE.file_keys[args.file_key][1], statefile), args.filename.name)
+    utils._CURRENT_DATABASE.copy_data(args.file_key, statefile, args.filename.name, strategy)
     if infer:
         do_print("Inferred file key:", args.file_key)
     do_print("State key reverted to:", authoritative_key.replace(args.file_key+":", '', 1))
     if did_stash:
         do_print("Old state saved to: ~stash")
+    if utils._CURRENT_DATABASE.copy_strategy is not None:
+        do_print("Copied with:", utils._CURRENT_DATABASE.copy_strategy)
     utils._CURRENT_DATABASE.register_fa(args.file_key, '~last', True)
     utils._CURRENT_DATABASE.save()
     return [args.file_key, authoritative_key.replace(args.file_key+":", '', 1)]
@@ -1,53 +1,110 @@
 import os
 import sys
-from .. import utils
+from .. import utils, qs_bulk
+from ..qs_errors import KeyConflict, KeyNotFound, ReservedKey
+from ..qs_database import MIN_HASH_PREFIX, hash_like
 
-def command_save(args, do_print):
-    utils.initdb(do_print)
-    infer = not bool(args.file_key)
+def _infer(filepath, file_key):
+    #Returns (file key, True if it was inferred)
+    infer = not bool(file_key)
     if infer:
-        filepath = os.path.abspath(args.filename.name)
+        filepath = os.path.abspath(filepath)
         if utils._checkflag('inference.path', '1')=='1' and filepath in utils._CURRENT_DATABASE.file_keys:
-            args.file_key = utils._CURRENT_DATABASE.resolve_key(filepath, True)
+            file_key = utils._CURRENT_DATABASE.resolve_key(filepath, True)
         elif utils._checkflag('inference.name', '1')=='1' and os.path.basename(filepath) in utils._CURRENT_DATABASE.file_keys:
-            args.file_key = utils._CURRENT_DATABASE.resolve_key(os.path.basename(filepath), True)
+            file_key = utils._CURRENT_DATABASE.resolve_key(os.path.basename(filepath), True)
         else:
-            sys.exit("Unable to save: Could not infer the file key.  Please set one explicitly with the -k option")
-    if args.file_key not in utils._CURRENT_DATABASE.file_keys:
-        sys.exit("Unable to save: The requested file key does not exist in this database (%s)" %(args.file_key))
-    args.file_key = utils._CURRENT_DATABASE.resolve_key(args.file_key, True)
-    hashalias = utils.gethash(args.filename)
-    args.filename.close()
-    currentstate = utils.fetchstate(hashalias, args.file_key)
+            raise KeyNotFound("Unable to save: Could not infer the file key.  Please set one explicitly with the -k option")
+    if file_key not in utils._CURRENT_DATABASE.file_keys:
+        raise KeyNotFound("Unable to save: The requested file key does not exist in this database (%s)" %(file_key))
+    return (utils._CURRENT_DATABASE.resolve_key(file_key, True), infer)
+
+def _save(args, do_print, filepath, file_key, infer, strategy, prepared):
+    (hashalias, staged, manifest) = prepared
+    currentstate = utils.fetchstate(hashalias, file_key)
     if currentstate and not args.allow_duplicate:
-        sys.exit("Unable to save: Duplicate of %s (use --allow-duplicate to override this behavior, or '$ quicksave alias' to create aliases)"%(
-            currentstate.replace(args.file_key+":", '', 1)
+        if staged is not None:
+            os.remove(staged)
+        raise KeyConflict("Unable to save: Duplicate of %s (use --allow-duplicate to override this behavior, or '$ quicksave alias' to create aliases)"%(
+            currentstate.replace(file_key+":", '', 1)
         ))
-    (key, datafile) = utils._CURRENT_DATABASE.register_sk(args.file_key, os.path.abspath(args.filename.name))
-    utils._CURRENT_DATABASE.register_fa(args.file_key, '~last', True)
+    (key, datafile) = utils._CURRENT_DATABASE.register_sk(
+        file_key,
+        os.path.abspath(filepath),
+        staged=staged,
+        manifest=manifest,
+        copy=strategy,
+        hashsum=hashalias,
+        **utils.storage_options(file_key, hashalias)
+    )
+    utils._CURRENT_DATABASE.register_fa(file_key, '~last', True)
     aliases = []
     if len(args.aliases):
         for user_alias in args.aliases:
             if user_alias in utils._SPECIAL_STATE:
-                sys.exit("Unable to save: Cannot create an alias which overwrites a reserved state key (%s)" % user_alias)
-            if utils._CURRENT_DATABASE.register_sa(args.file_key, key, user_alias, args.force):
+                raise ReservedKey("Unable to save: Cannot create an alias which overwrites a reserved state key (%s)" % user_alias)
+            if hash_like(user_alias):
+                raise ReservedKey("Unable to save: Aliases of %d or more hexadecimal digits are reserved for state hashes (%s)" % (MIN_HASH_PREFIX, user_alias))
+            if utils._CURRENT_DATABASE.register_sa(file_key, key, user_alias, args.force):
                 aliases.append(''+user_alias)
         if not len(aliases):
-            sys.exit("Unable to save: None of the provided aliases were available")
-    if args.file_key+":"+hashalias[:7] in utils._CURRENT_DATABASE.state_keys:
-        del utils._CURRENT_DATABASE.state_keys[args.file_key+":"+hashalias[:7]]
-    elif args.file_key+":"+hashalias not in utils._CURRENT_DATABASE.state_keys:
-        utils._CURRENT_DATABASE.register_sa(args.file_key, key, hashalias[:7], args.force)
+            raise KeyConflict("Unable to save: None of the provided aliases were available")
+    if (utils._CURRENT_DATABASE.is_hash_alias(file_key+":"+hashalias[:7]) and
+        utils.fetchstate(hashalias[:7], file_key) == file_key+":"+key):
+        #hash aliases are resolved from the state's digest, and are not stored
         aliases.append(hashalias[:7])
-    basefile = os.path.basename(args.filename.name)
-    if ((basefile not in utils._CURRENT_DATABASE.file_keys or utils._CURRENT_DATABASE.file_keys[basefile][0]!=args.file_key) and
-        args.file_key+":"+basefile not in utils._CURRENT_DATABASE.state_keys):
-        utils._CURRENT_DATABASE.register_sa(args.file_key, key, basefile)
+    basefile = os.path.basename(filepath)
+    if (not hash_like(basefile) and
+        (basefile not in utils._CURRENT_DATABASE.file_keys or utils._CURRENT_DATABASE.file_keys[basefile][0]!=file_key) and
+        file_key+":"+basefile not in utils._CURRENT_DATABASE.state_keys):
+        utils._CURRENT_DATABASE.register_sa(file_key, key, basefile)
         aliases.append(""+basefile)
-    utils._CURRENT_DATABASE.register_sa(args.file_key, key, hashalias)
     utils._CURRENT_DATABASE.save()
     if infer:
-        do_print("Inferred file key:", args.file_key)
+        do_print("Inferred file key:", file_key)
     do_print("New state key:", key)
     do_print("Aliases for this key:", aliases)
-    return [args.file_key, key, [item for item in aliases]]
+    if utils._CURRENT_DATABASE.copy_strategy is not None:
+        do_print("Copied with:", utils._CURRENT_DATABASE.copy_strategy)
+    return [file_key, key, [item for item in aliases]]
+
+def _save_many(args, do_print, use_cache, strategy):
+    inferred = {} #path: (file key, inferred)
+    def target(path):
+        inferred[path] = _infer(path, args.file_key)
+        return utils._CURRENT_DATABASE.file_keys[inferred[path][0]][1]
+    def commit(path, prepared):
+        do_print(path)
+        return _save(args, do_print, path, inferred[path][0], inferred[path][1], strategy, prepared)
+    paths = qs_bulk.expand(args.files, args.include, args.exclude)
+    if not len(paths):
+        sys.exit("Unable to save: No files matched the provided paths")
+    results = qs_bulk.run(
+        paths,
+        target,
+        lambda reader, folder, cache: utils.prepare_file(reader, folder, strategy, use_cache, cache),
+        commit,
+        utils.worker_count(args.workers, 'save.workers'),
+        do_print
+    )
+    do_print("Saved %d of %d files"%(len([result for result in results if result['error'] is None]), len(results)))
+    return results
+
+def command_save(args, do_print):
+    utils.initdb(do_print)
+    use_cache = utils._check_action(False, args.no_cache, 'hash.cache', '1')
+    strategy = utils.copy_strategy(args.copy_strategy)
+    if args.files:
+        if args.filename is not None:
+            sys.exit("Unable to save: Provide either a filename or --files, not both")
+        return _save_many(args, do_print, use_cache, strategy)
+    if args.filename is None:
+        args.help()
+        sys.exit("Unable to save: A filename or --files must be provided")
+    (file_key, infer) = _infer(args.filename.name, args.file_key)
+    cache = utils._load_hash_cache() if use_cache else None
+    prepared = utils.prepare_file(args.filename, utils._CURRENT_DATABASE.file_keys[file_key][1], strategy, use_cache, cache)
+    if cache is not None and cache.changed:
+        utils._write_hash_cache(cache)
+    args.filename.close()
+    return _save(args, do_print, args.filename.name, file_key, infer, strategy, prepared)
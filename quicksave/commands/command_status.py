@@ -1,6 +1,6 @@
 import os
-import sys
 from .. import utils
+from ..qs_errors import KeyNotFound
 
 def command_status(args, do_print):
     utils.initdb(do_print)
@@ -13,12 +13,16 @@ def command_status(args, do_print):
         elif utils._checkflag('inference.name', '1')=='1' and os.path.basename(filepath) in utils._CURRENT_DATABASE.file_keys:
             args.file_key = utils._CURRENT_DATABASE.resolve_key(os.path.basename(filepath), True)
         else:
-            sys.exit("Unable to check status: Could not infer the file key.  Please set one explicitly with the -k option")
+            raise KeyNotFound("Unable to check status: Could not infer the file key.  Please set one explicitly with the -k option")
     if args.file_key not in utils._CURRENT_DATABASE.file_keys:
-        sys.exit("Unable to check status: The requested file key does not exist in this database (%s)" %(args.file_key))
+        raise KeyNotFound("Unable to check status: The requested file key does not exist in this database (%s)" %(args.file_key))
     args.file_key = utils._CURRENT_DATABASE.resolve_key(args.file_key, True)
     utils._CURRENT_DATABASE.register_fa(args.file_key, '~last', True)
-    hashalias = utils.gethash(args.filename)
+    use_cache = utils._check_action(False, args.no_cache, 'hash.cache', '1')
+    cache = utils._load_hash_cache() if use_cache else None
+    hashalias = utils.gethash_cached(args.filename, use_cache, cache)
+    if cache is not None and cache.changed:
+        utils._write_hash_cache(cache)
     currentstate = utils.fetchstate(hashalias, args.file_key)
     args.filename.close()
     basefile = os.path.basename(args.filename.name)
@@ -0,0 +1,142 @@
+import os
+import sys
+import json
+from concurrent.futures import ThreadPoolExecutor
+from .. import utils
+from ..qs_database import BLOB_PREFIX, COMPRESSED_PREFIX, is_blob, is_chunked, is_delta
+from ..qs_gc import scan_files, orphaned_files
+from ..qs_errors import KeyNotFound, VerifyFailure
+
+_PROGRESS = 1000 #states verified between progress updates
+
+def _stored_size(entry):
+    #the size of a state, read without reading its contents.  None for states
+    #which must be decoded to find their size.  Raises FileNotFoundError for missing chunks
+    database = utils._CURRENT_DATABASE
+    if is_chunked(entry[2]):
+        size = 0
+        for (digest, chunk_size) in database.read_manifest(entry[1], entry[2]):
+            if not os.path.isfile(database.chunk_path(digest)):
+                raise FileNotFoundError(database.chunk_path(digest))
+            size += chunk_size
+        return size
+    if is_delta(entry[2]) or entry[2].startswith(COMPRESSED_PREFIX):
+        return None
+    return os.path.getsize(database.data_path(entry[1], entry[2]))
+
+def _check(entry, fast):
+    #'ok', 'missing', 'corrupted', or 'unverified' if the state has no recorded metadata
+    database = utils._CURRENT_DATABASE
+    meta = entry[3] if len(entry) > 3 else None
+    if not os.path.isfile(database.data_path(entry[1], entry[2])):
+        return 'missing'
+    digest = None
+    try:
+        if fast:
+            size = _stored_size(entry)
+        else:
+            (size, digest) = database.content_meta(entry[1], entry[2])
+    except FileNotFoundError:
+        return 'missing' #a chunk, or the base of a delta
+    except Exception:
+        #compression codecs raise their own errors for corrupted data
+        return 'corrupted'
+    if meta is None:
+        return 'unverified'
+    if (size is not None and size != meta[0]) or (digest is not None and digest != meta[1]):
+        return 'corrupted'
+    return 'ok'
+
+def _orphaned_blobs():
+    #blobs in the blob store which are not stored by any state key
+    database = utils._CURRENT_DATABASE
+    orphans = []
+    for (folder, name) in scan_files(database.blob_dir):
+        data_file = COMPRESSED_PREFIX+BLOB_PREFIX+name[1:] if name.startswith(COMPRESSED_PREFIX) else BLOB_PREFIX+name
+        if not (is_blob(data_file) and database.blob_refs(data_file) and database.data_path(None, data_file) == os.path.join(folder, name)):
+            orphans.append(os.path.join(folder, name))
+    return orphans
+
+def _orphaned_chunks():
+    #chunks in the chunk store which are not listed by any chunk manifest
+    database = utils._CURRENT_DATABASE
+    listed = set()
+    for entry in dict.values(database.state_keys):
+        if not entry[0] and is_chunked(entry[2]) and os.path.isfile(database.data_path(entry[1], entry[2])):
+            listed.update(digest for (digest, size) in database.read_manifest(entry[1], entry[2]))
+    return [
+        os.path.join(folder, name) for (folder, name) in scan_files(database.chunk_dir)
+        if not (name in listed and database.chunk_path(name) == os.path.join(folder, name))
+    ]
+
+def _orphaned(workers):
+    #files in the data folders, blob store, and chunk store which are not stored by any state key.
+    #Each store is scanned concurrently
+    database = utils._CURRENT_DATABASE
+    filekeys = sorted(key for (key, entry) in dict.items(database.file_keys) if not entry[0])
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        folders = [
+            pool.submit(lambda key: [os.path.join(folder, name) for (folder, name) in orphaned_files(database, key)], key)
+            for key in filekeys
+        ]
+        (blobs, chunks) = (pool.submit(_orphaned_blobs), pool.submit(_orphaned_chunks))
+        paths = [path for future in folders for path in future.result()] + blobs.result() + chunks.result()
+    return sorted(os.path.relpath(path, database.base_dir) for path in paths)
+
+def command_verify(args, do_print):
+    utils.initdb(do_print)
+    database = utils._CURRENT_DATABASE
+    if args.filekey:
+        if args.filekey not in database.file_keys:
+            raise KeyNotFound("Unable to verify: The requested file key does not exist in this database (%s)"%args.filekey)
+        filekey = database.resolve_key(args.filekey, True)
+        keys = database.list_sk(filekey, False)
+        if len(args.states):
+            for state in args.states:
+                if filekey+":"+state not in database.state_keys:
+                    raise KeyNotFound("Unable to verify: The requested state key does not exist in this database (%s)"%state)
+            keys = list({database.resolve_key(filekey+":"+state, False):None for state in args.states})
+    else:
+        if len(args.states):
+            sys.exit("Unable to verify: A file key must be provided to verify specific states")
+        keys = sorted(key for (key, entry) in dict.items(database.state_keys) if not entry[0])
+    entries = [dict.__getitem__(database.state_keys, key) for key in keys]
+    report = {
+        'checked': 0,
+        'fast': args.fast,
+        'missing': [],
+        'corrupted': [],
+        'unverified': [],
+        'orphaned': []
+    }
+    workers = utils.worker_count(args.workers, 'verify.workers')
+    #hashlib releases the GIL, so states are verified in parallel
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for (key, status) in zip(keys, pool.map(lambda entry: _check(entry, args.fast), entries)):
+            report['checked'] += 1
+            if status != 'ok':
+                report[status].append(key)
+            if report['checked'] % _PROGRESS == 0:
+                do_print("\rVerified %d/%d states"%(report['checked'], len(keys)), end='', flush=True)
+    if len(keys) >= _PROGRESS:
+        do_print()
+    if not args.filekey:
+        report['orphaned'] = _orphaned(workers)
+    if args.output == '-':
+        do_print(json.dumps(report, indent=2))
+    else:
+        if args.output:
+            with open(args.output, mode='w') as writer:
+                json.dump(report, writer, indent=2)
+        do_print("Verified %d states%s"%(report['checked'], " (sizes only)" if args.fast else ''))
+        for status in ('missing', 'corrupted', 'unverified', 'orphaned'):
+            if len(report[status]):
+                do_print("%d %s:"%(len(report[status]), status), report[status])
+        if len(report['unverified']):
+            do_print("States without a recorded digest can be verified after running '$ quicksave clean -m'")
+    if len(report['missing']) or len(report['corrupted']):
+        raise VerifyFailure(
+            "Verification failed: %d missing and %d corrupted states"%(len(report['missing']), len(report['corrupted'])),
+            report
+        )
+    return report
@@ -0,0 +1,107 @@
+import os
+import json
+import shlex
+from . import utils
+
+# Each line of a batch is a single quicksave command, either as a shell-style
+# command line or as a JSON list of arguments.  A leading 'quicksave' is optional.
+# Blank lines and lines starting with '#' are ignored
+
+_EXCLUDED = {'init', 'load-db', 'import', 'migrate', 'batch', 'daemon'} #commands which replace or serve the database
+
+def parse_line(line):
+    #Returns the arguments for a line, or None if the line is blank
+    line = line.strip()
+    if not len(line) or line.startswith('#'):
+        return None
+    if line.startswith('['):
+        args = json.loads(line)
+        if not (isinstance(args, list) and all(isinstance(arg, str) for arg in args)):
+            raise ValueError("JSON commands must be a list of strings")
+    else:
+        args = shlex.split(line)
+    if args[:1] == ['quicksave']:
+        args = args[1:]
+    return args
+
+def _run(main, args, quiet):
+    #Runs a single command.  Returns (exit code, result, error message)
+    command = [arg for arg in args if not arg.startswith('-')][:1]
+    if not len(command):
+        return (1, None, "No command provided")
+    if command[0] in _EXCLUDED:
+        return (1, None, "The '%s' command cannot be run in a batch" % command[0])
+    try:
+        return (0, main(['--return-result']+args if quiet else args), None)
+    except SystemExit as e:
+        if e.code is None or e.code == 0:
+            return (0, None, None)
+        if isinstance(e.code, int):
+            return (e.code, None, "Exited with code %d" % e.code)
+        return (1, None, str(e.code))
+    except Exception as e:
+        return (1, None, str(e.__cause__) if e.__cause__ is not None else str(e))
+
+def _flush(database):
+    if not database.flush():
+        raise ValueError("Unable to write the database index")
+
+def run_batch(lines, commit_every=0, atomic=False, quiet=True, do_print=print):
+    #Runs each command against a single loaded database.
+    #Saves are deferred, so changes are committed once at the end, or after
+    #every <commit_every> successful commands.  A failed command only discards
+    #its own changes.  If atomic, the first failure discards all changes and stops the batch.
+    #Returns a list of {line, args, code, result, error} for each command which was run
+    from .__main__ import main
+    if atomic and commit_every:
+        raise ValueError("Atomic batches cannot be committed at intervals")
+    keep_database = utils._KEEP_DATABASE
+    no_daemon = os.environ.get('QUICKSAVE_NO_DAEMON')
+    utils._KEEP_DATABASE = True
+    os.environ['QUICKSAVE_NO_DAEMON'] = '1' #each command is run against this process's database
+    results = []
+    database = None
+    try:
+        utils.initdb(do_print)
+        database = utils._CURRENT_DATABASE
+        database.deferred = True
+        pending = 0
+        for (number, line) in enumerate(lines, 1):
+            try:
+                args = parse_line(line)
+            except ValueError as e:
+                args = []
+                (code, result, error) = (1, None, "Unable to parse command: %s" % e)
+            else:
+                if args is None:
+                    continue
+                (code, result, error) = _run(main, args, quiet)
+            results.append({
+                'line': number,
+                'args': args,
+                'code': code,
+                'result': result,
+                'error': error
+            })
+            if code:
+                do_print("Line %d failed:" % number, error)
+                if atomic:
+                    database.rollback(True)
+                    return results
+                database.rollback()
+            else:
+                pending += 1
+                if commit_every and pending >= commit_every:
+                    _flush(database)
+                    pending = 0
+        _flush(database)
+    finally:
+        if database is not None:
+            database.deferred = False
+            database.rollback(True) #discards any changes left uncommitted by an interrupted batch
+        utils._KEEP_DATABASE = keep_database
+        if no_daemon is None:
+            del os.environ['QUICKSAVE_NO_DAEMON']
+        else:
+            os.environ['QUICKSAVE_NO_DAEMON'] = no_daemon
+    return results
@@ -0,0 +1,98 @@
+import os
+import glob
+from fnmatch import fnmatch
+from concurrent.futures import ThreadPoolExecutor
+from . import utils
+from .qs_errors import DatabaseFailure
+
+# Saving or registering many files at once.  Paths are expanded in the main
+# thread, then every file is hashed (and staged, for the 'copy' strategy) on a
+# thread pool.  The files are then added to the database one at a time, in
+# order, and the index is saved once at the end.  A file which fails only
+# discards its own changes
+
+def _matches(path, root, patterns):
+    #patterns match the file name, or the path relative to the expanded argument
+    return any(fnmatch(os.path.basename(path), pattern) or fnmatch(os.path.relpath(path, root), pattern) for pattern in patterns)
+
+def expand(paths, include=(), exclude=()):
+    #Returns the absolute paths of the files named by paths, in order.  Each path
+    #may be a file, a glob, or a directory, which is searched recursively.
+    #Files in the database are skipped
+    database_dir = os.path.abspath(utils._CURRENT_DATABASE.base_dir)
+    output = {}
+    for path in paths:
+        matches = sorted(glob.glob(path, recursive=True)) if glob.has_magic(path) else [path]
+        for match in matches:
+            if os.path.isdir(match):
+                root = os.path.abspath(match)
+                for (folder, folders, files) in os.walk(root):
+                    folders.sort()
+                    for name in sorted(files):
+                        output.setdefault(os.path.join(folder, name), root)
+            elif os.path.isfile(match) or not glob.has_magic(path):
+                output.setdefault(os.path.abspath(match), os.path.dirname(os.path.abspath(match)))
+    return [
+        path for (path, root) in output.items()
+        if os.path.commonpath([path, database_dir]) != database_dir
+        and (not len(include) or _matches(path, root, include))
+        and not _matches(path, root, exclude)
+    ]
+
+def _prepare(path, folder, prepare, cache):
+    with open(path, mode='rb') as reader:
+        return prepare(reader, folder, cache)
+
+def run(paths, target, prepare, commit, workers, do_print):
+    #target(path) returns the folder in which a file is staged.
+    #prepare(reader, folder, hash cache) hashes an open file on a worker thread.
+    #commit(path, prepared) adds a prepared file to the database.
+    #Each may fail with sys.exit.  Returns a list of {path, result, error, copy_strategy} for each file
+    database = utils._CURRENT_DATABASE
+    deferred = database.deferred
+    database.deferred = True
+    cache = utils._load_hash_cache()
+    results = []
+    try:
+        folders = []
+        for path in paths:
+            try:
+                folders.append(target(path))
+            except SystemExit as e:
+                database.rollback()
+                folders.append(None)
+                results.append({'path': path, 'result': None, 'error': str(e.code), 'copy_strategy': None})
+                do_print("Unable to add %s:" % path, e.code)
+            else:
+                results.append({'path': path, 'result': None, 'error': None, 'copy_strategy': None})
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            prepared = [
+                pool.submit(_prepare, path, folder, prepare, cache) if folder is not None else None
+                for (path, folder) in zip(paths, folders)
+            ]
+            for (result, future) in zip(results, prepared):
+                if future is None:
+                    continue
+                try:
+                    result['result'] = commit(result['path'], future.result())
+                    result['copy_strategy'] = database.copy_strategy
+                    database.save()
+                except SystemExit as e:
+                    database.rollback()
+                    result['error'] = str(e.code)
+                except OSError as e:
+                    database.rollback()
+                    result['error'] = str(e)
+                if result['error'] is not None:
+                    do_print("Unable to add %s:" % result['path'], result['error'])
+    except BaseException:
+        if not deferred:
+            database.rollback(True)
+        raise
+    finally:
+        database.deferred = deferred
+        if cache.changed:
+            utils._write_hash_cache(cache)
+    if not deferred and not database.flush():
+        raise DatabaseFailure("Unable to write the database index")
+    return results
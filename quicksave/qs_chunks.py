@@ -0,0 +1,67 @@
+from hashlib import sha256
+
+# Files are split into chunks at content-defined boundaries, so an edit only
+# changes the chunks around it, even if it shifts the rest of the file.
+# Boundaries are found with a gear hash, which is updated at every byte and
+# depends on the last 32 bytes.  A boundary is placed where the top bits of the
+# hash are zero.  The first _MIN_SIZE bytes of a chunk are skipped, and the
+# mask is stricter before _AVG_SIZE and looser after it, so that chunk sizes
+# stay close to _AVG_SIZE (normalized chunking, as in FastCDC).
+# Chunks are limited to _MIN_SIZE.._MAX_SIZE bytes
+
+MAGIC = b'QSCHUNK1\n'
+_GEAR = [int.from_bytes(sha256(bytes([value])).digest()[:4], 'big') for value in range(256)]
+_MASK_SMALL = 0xffffc000 #18 bits, used before _AVG_SIZE
+_MASK_LARGE = 0xfffc0000 #14 bits, used after _AVG_SIZE
+_MIN_SIZE = 1<<14
+_AVG_SIZE = 1<<16
+_MAX_SIZE = 1<<18
+_READ_SIZE = 1<<22
+
+def _boundary(data, start, end):
+    #the end of the chunk starting at start, where end is the end of the available data
+    limit = min(end, start+_MAX_SIZE)
+    if limit-start <= _MIN_SIZE:
+        return limit
+    gear = _GEAR
+    digest = 0
+    position = start+_MIN_SIZE
+    for (stop, mask) in ((min(limit, start+_AVG_SIZE), _MASK_SMALL), (limit, _MASK_LARGE)):
+        for byte in data[position:stop]:
+            digest = ((digest << 1) + gear[byte]) & 0xffffffff
+            position += 1
+            if not digest & mask:
+                return position
+    return limit
+
+def split(reader):
+    #yields the chunks of a binary file
+    data = b''
+    start = 0
+    eof = False
+    while True:
+        if not eof and len(data)-start < _MAX_SIZE:
+            block = reader.read(_READ_SIZE)
+            if len(block):
+                data = data[start:]+block
+                start = 0
+                continue
+            eof = True
+        if start >= len(data):
+            return
+        end = _boundary(data, start, len(data))
+        yield data[start:end]
+        start = end
+
+def write_manifest(writer, chunks):
+    #chunks is a list of (digest, size)
+    writer.write(MAGIC)
+    writer.write(''.join('%s\t%d\n' % chunk for chunk in chunks).encode())
+
+def read_manifest(reader):
+    if reader.readline() != MAGIC:
+        raise ValueError("Not a chunk manifest")
+    return [
+        (digest, int(size))
+        for (digest, size) in (line.decode().split('\t') for line in reader)
+    ]
@@ -0,0 +1,72 @@
+import io
+import bz2
+import lzma
+import zlib
+
+# Compressed data files start with a header naming their codec.
+# Each codec is (compressor factory, decompressor factory)
+CODECS = {
+    'zlib': (lambda: zlib.compressobj(6), zlib.decompressobj),
+    'bz2': (bz2.BZ2Compressor, bz2.BZ2Decompressor),
+    'lzma': (lzma.LZMACompressor, lzma.LZMADecompressor),
+}
+_MAGIC = b'QSZ1\n'
+_CHUNK_SIZE = 1<<20
+_SAMPLE_SIZE = 1<<16
+_SAMPLES = 4
+_RATIO = 0.9 #data is only compressed if the samples shrink below this fraction of their size
+
+def compressible(reader, codec):
+    #Estimates whether compressing a seekable file is worthwhile by compressing
+    #samples from its start, middle, and end.  Leaves the reader at the start
+    size = reader.seek(0, io.SEEK_END)
+    if size == 0:
+        reader.seek(0)
+        return False
+    total = 0
+    compressed = 0
+    for offset in sorted({
+        max(0, min(size-_SAMPLE_SIZE, size*i//(_SAMPLES-1)))
+        for i in range(_SAMPLES)
+    }):
+        reader.seek(offset)
+        sample = reader.read(_SAMPLE_SIZE)
+        compressor = CODECS[codec][0]()
+        compressed += len(compressor.compress(sample)) + len(compressor.flush())
+        total += len(sample)
+    reader.seek(0)
+    return compressed < total*_RATIO
+
+def compress(reader, writer, codec):
+    writer.write(_MAGIC+codec.encode()+b'\n')
+    compressor = CODECS[codec][0]()
+    chunk = reader.read(_CHUNK_SIZE)
+    while len(chunk):
+        writer.write(compressor.compress(chunk))
+        chunk = reader.read(_CHUNK_SIZE)
+    writer.write(compressor.flush())
+
+def read_codec(reader):
+    #Reads the header of a compressed data file, and returns its codec
+    if reader.readline() != _MAGIC:
+        raise ValueError("Not a compressed data file")
+    codec = reader.readline().decode().strip()
+    if codec not in CODECS:
+        raise ValueError("Unknown compression codec: %s" % codec)
+    return codec
+
+def decompress(reader, writer):
+    codec = read_codec(reader)
+    decompressor = CODECS[codec][1]()
+    chunk = reader.read(_CHUNK_SIZE)
+    while len(chunk):
+        writer.write(decompressor.decompress(chunk))
+        chunk = reader.read(_CHUNK_SIZE)
+    if hasattr(decompressor, 'flush'):
+        writer.write(decompressor.flush())
+
+def read(reader):
+    #the decompressed contents of a compressed data file
+    output = io.BytesIO()
+    decompress(reader, output)
+    return output.getvalue()
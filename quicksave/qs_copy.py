@@ -0,0 +1,108 @@
+import os
+import errno
+import shutil
+
+# Strategies for copying a file, fastest first.  'auto' tries each in turn:
+#   reflink: clones the file's extents (FICLONE).  O(1) on btrfs, XFS, and other CoW filesystems
+#   copy_file_range: copies inside the kernel, without passing the data through userspace
+#   copy: a plain copy
+# 'hardlink' links the destination to the source, and makes it read-only.
+# It is only used for checking out immutable stored states, and must be requested explicitly.
+# The read-only mode is the only protection for the stored state: a program which
+# writes to the checked out file in place (instead of replacing it), after making
+# it writable or while running as root, modifies the stored state as well.
+# Hardlinks are therefore never made by root, which falls back to the other strategies
+STRATEGIES = ('auto', 'reflink', 'copy_file_range', 'copy', 'hardlink')
+_FICLONE = 0x40049409
+_UNSUPPORTED = {errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP, errno.ENOTTY, errno.EPERM}
+_REFLINK = {} #device: whether files on the device can be cloned
+
+def _reflink(source, destination):
+    import fcntl
+    with open(source, mode='rb') as reader:
+        with open(destination, mode='wb') as writer:
+            fcntl.ioctl(writer.fileno(), _FICLONE, reader.fileno())
+
+def reflink_supported(folder):
+    #checks whether files in folder can be cloned, by cloning a small probe file.
+    #The result is cached for the folder's device
+    device = os.stat(folder).st_dev
+    if device not in _REFLINK:
+        probe = os.path.join(folder, '.reflink_probe_%d' % os.getpid())
+        try:
+            with open(probe, mode='wb') as writer:
+                writer.write(b'probe')
+            _reflink(probe, probe+'.clone')
+            _REFLINK[device] = True
+        except (ImportError, AttributeError):
+            _REFLINK[device] = False
+        except OSError as e:
+            if e.errno not in _UNSUPPORTED:
+                raise
+            _REFLINK[device] = False
+        finally:
+            for path in (probe, probe+'.clone'):
+                if os.path.exists(path):
+                    os.remove(path)
+    return _REFLINK[device]
+
+def _copy_file_range(source, destination):
+    with open(source, mode='rb') as reader:
+        with open(destination, mode='wb') as writer:
+            size = os.fstat(reader.fileno()).st_size
+            offset = 0
+            while offset < size:
+                copied = os.copy_file_range(reader.fileno(), writer.fileno(), size-offset, offset, offset)
+                if not copied:
+                    #some filesystems report no data instead of an error.  Fall back to a plain copy
+                    raise OSError(errno.EOPNOTSUPP, "copy_file_range stopped after %d of %d bytes" % (offset, size))
+                offset += copied
+
+def _hardlink(source, destination):
+    if hasattr(os, 'geteuid') and os.geteuid() == 0:
+        #root can write to read-only files, so the stored state would be unprotected
+        raise OSError(errno.EPERM, "Stored states are not hardlinked by root")
+    os.chmod(source, 0o444)
+    if os.path.lexists(destination):
+        os.remove(destination)
+    os.link(source, destination)
+
+def unlink_shared(destination):
+    #removes destination if it is hardlinked to another file, so that writing to
+    #it does not modify a stored state which was checked out with 'hardlink'
+    if os.path.isfile(destination) and os.stat(destination).st_nlink > 1:
+        os.remove(destination)
+
+def _copy(source, destination):
+    shutil.copyfile(source, destination)
+
+_METHODS = {
+    'reflink': _reflink,
+    'copy_file_range': _copy_file_range,
+    'hardlink': _hardlink,
+    'copy': _copy,
+}
+
+def copy(source, destination, strategy='auto'):
+    #Copies source to destination.  Strategies which are not supported by the
+    #platform or filesystem fall back to the next strategy.  Returns the strategy which was used
+    if strategy not in STRATEGIES:
+        raise ValueError("Unknown copy strategy: %s" % strategy)
+    if strategy != 'hardlink':
+        unlink_shared(destination)
+    candidates = ['reflink', 'copy_file_range', 'copy']
+    if strategy == 'hardlink':
+        candidates.insert(0, 'hardlink')
+    elif strategy != 'auto':
+        candidates = candidates[candidates.index(strategy):]
+    for method in candidates:
+        try:
+            _METHODS[method](source, destination)
+            return method
+        except (ImportError, AttributeError):
+            #not available on this platform
+            continue
+        except OSError as e:
+            if method == 'copy' or e.errno not in _UNSUPPORTED:
+                raise
+    return 'copy'
@@ -0,0 +1,174 @@
+import os
+import sys
+import io
+import json
+import socket
+import builtins
+from contextlib import redirect_stdout, redirect_stderr
+from . import utils
+from . import qs_errors
+
+# Requests and responses are single JSON documents.  The client sends its
+# arguments and working directory, then shuts down its side of the connection.
+# The daemon replies with the captured output, exit code, and result.
+# Sets, tuples, and dictionaries with keys other than strings are tagged, so that
+# the client receives the same types as a command run in its own process.
+# Errors are sent by class name, and raised again by the client
+_TAGS = {
+    '__set__': set,
+    '__tuple__': tuple,
+    '__items__': dict,
+}
+
+def _pack(obj):
+    if isinstance(obj, dict):
+        if all(isinstance(key, str) for key in obj) and not (len(obj) == 1 and list(obj)[0] in _TAGS):
+            return {key: _pack(value) for (key, value) in obj.items()}
+        return {'__items__': [[_pack(key), _pack(value)] for (key, value) in obj.items()]}
+    if isinstance(obj, list):
+        return [_pack(item) for item in obj]
+    if isinstance(obj, tuple):
+        return {'__tuple__': [_pack(item) for item in obj]}
+    if isinstance(obj, (set, frozenset)):
+        return {'__set__': [_pack(item) for item in obj]}
+    return obj
+
+def _unpack(obj):
+    if len(obj) == 1 and list(obj)[0] in _TAGS:
+        (tag, items) = list(obj.items())[0]
+        return _TAGS[tag](items)
+    return obj
+
+def _encode(obj):
+    return str(obj)
+
+def _send(connection, message):
+    connection.sendall(json.dumps(_pack(message), default=_encode).encode())
+    connection.shutdown(socket.SHUT_WR)
+
+def _receive(connection):
+    chunks = []
+    chunk = connection.recv(65536)
+    while len(chunk):
+        chunks.append(chunk)
+        chunk = connection.recv(65536)
+    return json.loads(b''.join(chunks).decode(), object_hook=_unpack)
+
+def request(message, path=None):
+    #Sends a request to the daemon.  Returns None if no daemon is running
+    path = path if path else utils.daemonfile
+    if not (hasattr(socket, 'AF_UNIX') and os.path.exists(path)):
+        return None
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(path)
+    except OSError:
+        connection.close()
+        return None
+    try:
+        _send(connection, message)
+        return _receive(connection)
+    finally:
+        connection.close()
+
+def forward(args_input, path=None):
+    #Runs a command in the daemon, if one is running
+    return request({'args': [arg for arg in args_input], 'cwd': os.getcwd()}, path)
+
+def error(response):
+    #The exception raised by a forwarded command, or None.  qs_errors exits and
+    #builtin exceptions are raised with their original class
+    if 'exit' in response:
+        kind = getattr(qs_errors, response['exit']['type'], None)
+        if not (isinstance(kind, type) and issubclass(kind, qs_errors.CommandError)):
+            kind = SystemExit
+        if 'report' in response['exit']:
+            return kind(response['exit']['message'], response['exit']['report'])
+        return kind(response['exit']['message'])
+    if 'error' in response:
+        kind = getattr(builtins, response.get('error_type', ''), None)
+        if not (isinstance(kind, type) and issubclass(kind, Exception)):
+            kind = RuntimeError
+        return kind(response['error'])
+    return None
+
+def _execute(message):
+    from .__main__ import main
+    response = {'code': 0, 'result': None}
+    stdout = io.StringIO()
+    stderr = io.StringIO()
+    cwd = os.getcwd()
+    try:
+        os.chdir(message['cwd'])
+        with redirect_stdout(stdout), redirect_stderr(stderr):
+            response['result'] = main(message['args'])
+    except SystemExit as e:
+        if e.code is None or isinstance(e.code, int):
+            response['code'] = e.code if e.code else 0
+        else:
+            #the client raises the exit again, which prints the message
+            response['code'] = 1
+            response['exit'] = {'type': type(e).__name__, 'message': str(e.code)}
+            if hasattr(e, 'report'):
+                response['exit']['report'] = e.report
+    except Exception as e:
+        response['code'] = 1
+        response['error'] = str(e)
+        response['error_type'] = type(e).__name__
+        if e.__cause__ is not None:
+            response['error'] += ' (%s: %s)' % (type(e.__cause__).__name__, e.__cause__)
+    finally:
+        os.chdir(cwd)
+    response['stdout'] = stdout.getvalue()
+    response['stderr'] = stderr.getvalue()
+    return response
+
+def serve(path=None, do_print=print):
+    #Serves requests until a stop request is received.
+    #The database stays loaded between requests unless another process modifies it
+    if not hasattr(socket, 'AF_UNIX'):
+        sys.exit("Unable to start daemon: Unix domain sockets are not supported on this platform")
+    path = path if path else utils.daemonfile
+    if request({'ping': True}, path) is not None:
+        sys.exit("Unable to start daemon: A daemon is already running (%s)"%path)
+    if os.path.exists(path):
+        os.remove(path) #left behind by a daemon which did not shut down cleanly
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    umask = os.umask(0o077)
+    try:
+        server.bind(path)
+    finally:
+        os.umask(umask)
+    server.listen(16)
+    keep_database = utils._KEEP_DATABASE
+    no_daemon = os.environ.get('QUICKSAVE_NO_DAEMON')
+    utils._KEEP_DATABASE = True
+    #commands run by the daemon (or their subprocesses) must not be forwarded back to it
+    os.environ['QUICKSAVE_NO_DAEMON'] = '1'
+    served = 0
+    try:
+        while True:
+            (connection, _) = server.accept()
+            try:
+                message = _receive(connection)
+                if 'stop' in message:
+                    _send(connection, {'served': served})
+                    break
+                elif 'ping' in message:
+                    _send(connection, {'served': served})
+                else:
+                    _send(connection, _execute(message))
+                    served += 1
+            except (OSError, ValueError) as e:
+                do_print("Dropped request:", e)
+            finally:
+                connection.close()
+    finally:
+        server.close()
+        os.remove(path)
+        utils._KEEP_DATABASE = keep_database
+        if no_daemon is None:
+            del os.environ['QUICKSAVE_NO_DAEMON']
+        else:
+            os.environ['QUICKSAVE_NO_DAEMON'] = no_daemon
+    return served
@@ -1,102 +1,922 @@
 import os
+import io
+import re
 import shutil
-import csv
-from hashlib import md5
-
-def reserve_name(base_name, existence_set):
-    (filepath, filename) = os.path.split(base_name)
-    if filename not in existence_set:
-        return base_name
-    index = 1
-    (rootfile, extension) = os.path.splitext(filename)
-    current_name = '%s_%d%s' %(rootfile, index, extension)
-    while current_name in existence_set:
-        index+=1
-        current_name = '%s_%d%s' %(rootfile, index, extension)
-    return os.path.join(filepath, current_name)
-
-def make_key(base_name, existence_set):
-    index = 1
-    current_name = '%s%d'%(base_name, index)
-    while current_name in existence_set:
-        index+=1
-        current_name = '%s%d'%(base_name, index)
-    return current_name
+import pickle
+import gc
+import threading
+import time
+from bisect import bisect_left, insort
+from hashlib import sha256
+from .qs_engines import ENGINES, open_engine
+from . import qs_delta, qs_chunks, qs_copy
+from .qs_errors import KeyNotFound
+
+BLOB_PREFIX = '@' #data files named '@<digest>' are stored in the shared blob store
+DELTA_PREFIX = '^' #data files named '^<name>' are stored as a delta against another state of the file key
+COMPRESSED_PREFIX = '%' #data files named '%<name>' are compressed copies of <name>
+CHUNKED_PREFIX = '#' #data files named '#<name>' list the chunks of a state in the shared chunk store
+STAGING_PREFIX = '.ingest_' #files copied into a data folder before they are hashed and renamed
+_SPECIAL_STATES = {'~stash', '~trash'} #states which are never used as the base of a delta
+LAYOUT_FLAG = 'storage.layout' #how data files are placed in their data folder.  Changed by Database.relayout
+HASH_ALGORITHM = 'sha256' #the algorithm of the digests recorded in state metadata
+RELAYOUT_MARKER = '.relayout' #present in the database folder while data files are being moved to a new layout
+LAYOUTS = ('flat', 'sharded') #sharded data files are stored in subfolders named by a prefix of the hash of their name
+MIN_HASH_PREFIX = 4 #the shortest digest prefix which is resolved as a hash alias
+_HEX = re.compile(r'^[0-9a-f]+$')
+
+def shard(data_file):
+    #the subfolder of a sharded data folder which holds data_file
+    return sha256(data_file.encode()).hexdigest()[:2]
+
+def is_blob(data_file):
+    return data_file.lstrip(COMPRESSED_PREFIX).startswith(BLOB_PREFIX)
+
+def hash_like(alias):
+    #state aliases which could be read as a digest prefix are reserved for hash aliases
+    return len(alias) >= MIN_HASH_PREFIX and _HEX.match(alias) is not None
+
+def is_delta(data_file):
+    return data_file.lstrip(COMPRESSED_PREFIX).startswith(DELTA_PREFIX)
+
+def is_chunked(data_file):
+    return data_file.startswith(CHUNKED_PREFIX)
+
+def read_data(load, data_file, cache=None):
+    #Rebuilds a data file which may be stored as a delta.
+    #load returns the (decompressed) contents of a data file of the same file key
+    chain = []
+    while data_file is not None and is_delta(data_file) and (cache is None or data_file not in cache):
+        (data_file, depth, ops) = qs_delta.parse(load(data_file))
+        chain.append(ops)
+    if data_file is None:
+        data = b''
+    elif cache is not None and data_file in cache:
+        data = cache[data_file]
+    else:
+        data = load(data_file)
+    for ops in reversed(chain):
+        data = qs_delta.decode(data, ops)
+    return data
+
+def _digest(key, entry):
+    #(file key, digest) of a state entry which has recorded metadata
+    if entry is None or entry[0] or len(entry) < 4 or entry[3] is None:
+        return None
+    if key.split(':', 1)[1] in _SPECIAL_STATES:
+        return None
+    return (entry[1], entry[3][1])
+
+def _snapshot(entry):
+    #a hashable copy of an entry, used to detect in-place modification
+    if isinstance(entry, list):
+        return tuple(frozenset(item) if isinstance(item, set) else item for item in entry)
+    return entry
+
+def _restore(snapshot):
+    #the inverse of _snapshot
+    if isinstance(snapshot, tuple):
+        return [set(item) if isinstance(item, frozenset) else item for item in snapshot]
+    return snapshot
+
+class _Table(dict):
+    #A dictionary which remembers the original state of every entry touched
+    #since the last save, so that only modified entries need to be journaled
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._origin = {}
+        self._savepoint = None #original state of entries touched since the last savepoint
+        self._watchers = [] #callbacks of (key, old entry, new entry)
+
+    def _notify(self, key, old, new):
+        for watcher in self._watchers:
+            watcher(key, old, new)
+
+    def _touch(self, key):
+        if key not in self._origin:
+            self._origin[key] = _snapshot(dict.get(self, key))
+        if self._savepoint is not None and key not in self._savepoint:
+            self._savepoint[key] = _snapshot(dict.get(self, key))
+
+    def __getitem__(self, key):
+        if dict.__contains__(self, key):
+            self._touch(key)
+        return dict.__getitem__(self, key)
+
+    def __setitem__(self, key, value):
+        old = dict.get(self, key)
+        self._touch(key)
+        dict.__setitem__(self, key, value)
+        self._notify(key, old, value)
+
+    def __delitem__(self, key):
+        old = dict.get(self, key)
+        self._touch(key)
+        dict.__delitem__(self, key)
+        self._notify(key, old, None)
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def pop(self, key, *default):
+        if dict.__contains__(self, key):
+            value = self[key]
+            del self[key]
+            return value
+        return dict.pop(self, key, *default)
+
+    def popitem(self):
+        key = next(iter(self))
+        return (key, self.pop(key))
+
+    def setdefault(self, key, default=None):
+        if not dict.__contains__(self, key):
+            self[key] = default
+        return self[key]
+
+    def update(self, *args, **kwargs):
+        for (key, value) in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def clear(self):
+        for key in list(self):
+            del self[key]
+
+    def values(self):
+        return [self[key] for key in self]
+
+    def items(self):
+        return [(key, self[key]) for key in self]
+
+    def changes(self):
+        #yields (key, original entry, entry) for every modified entry.
+        #The original entry is a snapshot, and is None for new entries.
+        #The entry is None for deleted entries
+        for (key, origin) in self._origin.items():
+            current = dict.get(self, key)
+            stored = dict.__contains__(self, key)
+            if stored != (origin is not None) or _snapshot(current) != origin:
+                yield (key, origin, current if stored else None)
+
+    def mark_saved(self):
+        self._origin = {}
+        self._savepoint = None
+
+    def savepoint(self):
+        self._savepoint = {}
+
+    def rollback(self, full=False):
+        #restores every entry modified since the last savepoint.
+        #If full, or if there is no savepoint, restores every entry modified since the last save
+        if full or self._savepoint is None:
+            origin = self._origin
+            self._origin = {}
+            if self._savepoint is not None:
+                self._savepoint = {}
+        else:
+            origin = self._savepoint
+            self._savepoint = {}
+        for (key, entry) in origin.items():
+            if entry is None:
+                self.unload(key)
+            else:
+                self.load(key, _restore(entry))
+
+    def load(self, key, value):
+        #sets an entry which is already saved
+        old = dict.get(self, key)
+        dict.__setitem__(self, key, value)
+        self._notify(key, old, value)
+
+    def unload(self, key):
+        #deletes an entry which is already deleted from storage
+        if dict.__contains__(self, key):
+            old = dict.pop(self, key)
+            self._notify(key, old, None)
+
+class _StateTable(_Table):
+    #The state key table.  Keys which are not stored are passed to the resolver,
+    #which may return a virtual alias entry for them.  Virtual entries are never journaled.
+    #Stored keys take precedence, so an alias which looks like a digest prefix and was
+    #stored before such aliases were reserved keeps its target
+    def __init__(self, resolver, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._resolver = resolver
+
+    def __contains__(self, key):
+        return dict.__contains__(self, key) or self._resolver(key) is not None
+
+    def __getitem__(self, key):
+        if dict.__contains__(self, key):
+            return super().__getitem__(key)
+        entry = self._resolver(key)
+        if entry is None:
+            raise KeyError(key)
+        return entry
 
 class Database:
     def __init__(self, base_dir):
         self.base_dir = base_dir
         self.data_folders = set() #a set of used data folders
-        self.file_keys = {} #key: [None, data folder, set of data files] or alias: [authoriative key, None, None]
-        self.state_keys = {} #key: [None, file key, data file] or alias: [authoriative key, file key, None]
-        self.flags = {}
-        if not (os.path.isdir(self.base_dir) and
-                    os.path.isfile(os.path.join(
-                        self.base_dir,
-                        '.db_config'
-                    ))
-                ):
+        self.file_keys = _Table() #key: [None, data folder, set of data files] or alias: [authoriative key, None, None]
+        self.state_keys = _StateTable(self._hash_alias) #key: [None, file key, data file, metadata] or alias: [authoriative key, file key, None]
+        self.flags = _Table()
+        self.counters = _Table() #counter: the last index allocated by next_key or next_name
+        self._file_states = {} #file key: {state key or alias: None}, ordered by insertion
+        self._file_aliases = {} #target: {file alias: None}
+        self._state_aliases = {} #target: {state alias: None}
+        self._digests = {} #file key: {digest: {state key: None}}, ordered by insertion
+        self._digest_order = {} #file key: sorted list of digests, for prefix matching
+        self.blob_dir = os.path.join(base_dir, '.blobs') #the shared, content-addressed store
+        self.chunk_dir = os.path.join(base_dir, '.chunks') #chunks of the states listed by chunk manifests
+        self._blob_refs = {} #blob: number of state keys which store it
+        self._released = set() #blobs which lost their last reference since the last save
+        self._obsolete = set() #(file key, data file) replaced or released since the last save
+        self._obsolete_folders = set() #data folders of file keys deleted since the last save
+        self._created = [] #(file key, data file or None, path) of data files and folders written since the last save
+        self._created_mark = 0 #the length of _created at the last savepoint
+        self.copy_strategy = None #the strategy used by the last copy of a file into or out of the database
+        self.deferred = False #if set, save() only marks a savepoint until flush() is called
+        self._pending_checkpoint = False
+        self.engine = open_engine(self.base_dir)
+        exists = self.engine.exists()
+        if not exists:
             #initialize the database
-            configwriter = open(os.path.join(
-                self.base_dir,
-                '.db_config'
-            ), mode='w')
-            configwriter.write('<QUICKSAVE DB>\n')
-            configwriter.close()
+            self.engine.create()
         else:
-            configreader = open(os.path.join(
-                self.base_dir,
-                '.db_config'
-            ), mode='r')
-            verification = configreader.readline().strip()
-            if verification != "<QUICKSAVE DB>":
-                raise ValueError("Unable to verify database")
-            reader = csv.reader(configreader, delimiter='\t')
-            hasher = md5()
-            checksum = None
-            for data in reader:
-                if data[0] == 'MD5':
-                    checksum = data[1]
+            token = self.engine.checkpoint_token()
+            if not self._read_cache(token):
+                for data in self.engine.load_checkpoint():
+                    self._apply(data)
+                self._build_indexes()
+                if token is not None:
+                    self._write_cache(token)
+        self.file_keys._watchers.append(
+            lambda key, old, new: self._index_alias(self._file_aliases, key, old, new)
+        )
+        self.state_keys._watchers.append(self._index_state)
+        self.state_keys._watchers.append(
+            lambda key, old, new: self._index_alias(self._state_aliases, key, old, new)
+        )
+        self.state_keys._watchers.append(self._index_blob)
+        self.state_keys._watchers.append(self._index_digest)
+        if exists:
+            #journaled rows are applied after the indexes are built, so they update the indexes
+            for data in self.engine.load_journal():
+                self._apply(data)
+        self.data_folders |= {
+            entry[1] for entry in dict.values(self.file_keys) if not entry[0]
+        }
+        self._mark_saved()
+        self._version = self.engine.version()
+
+    def _build_indexes(self):
+        for (key, entry) in dict.items(self.file_keys):
+            self._index_alias(self._file_aliases, key, None, entry)
+        for (key, entry) in dict.items(self.state_keys):
+            self._index_state(key, None, entry)
+            self._index_alias(self._state_aliases, key, None, entry)
+            self._index_blob(key, None, entry)
+            self._index_digest(key, None, entry)
+
+    def _index_alias(self, index, key, old, new):
+        #keeps the reverse alias graph up to date.
+        #Alias entries must be replaced, not modified in place, to change their target
+        old_target = old[0] if old is not None else None
+        new_target = new[0] if new is not None else None
+        if old_target == new_target:
+            return
+        if old_target is not None and old_target in index:
+            del index[old_target][key]
+            if not len(index[old_target]):
+                del index[old_target]
+        if new_target is not None:
+            if new_target not in index:
+                index[new_target] = {}
+            index[new_target][key] = None
+
+    def _walk_aliases(self, index, key, recursive):
+        output = [alias for alias in index.get(key, ())]
+        if recursive:
+            visited = set(output)
+            for alias in output: #output grows as the walk continues
+                for item in index.get(alias, ()):
+                    if item not in visited:
+                        visited.add(item)
+                        output.append(item)
+        return output
+
+    def list_fa(self, key, recursive=False):
+        #lists the file aliases which point to the given key.
+        #If recursive, also lists all aliases which point to those aliases
+        return self._walk_aliases(self._file_aliases, key, recursive)
+
+    def list_sa(self, key, recursive=False):
+        #lists the state aliases which point to the given key.
+        #If recursive, also lists all aliases which point to those aliases
+        return self._walk_aliases(self._state_aliases, key, recursive)
+
+    def missing_targets(self, isfile):
+        #lists all alias targets which do not exist in the database
+        (index, table) = (self._file_aliases, self.file_keys) if isfile else (self._state_aliases, self.state_keys)
+        return [target for target in index if target not in table]
+
+    def _index_state(self, key, old, new):
+        #keeps the index of states under each file key up to date.
+        #State entries must be replaced, not modified in place, to change their file key
+        if old is not None and new is not None and old[1] == new[1]:
+            return
+        if old is not None and old[1] in self._file_states:
+            del self._file_states[old[1]][key]
+            if not len(self._file_states[old[1]]):
+                del self._file_states[old[1]]
+        if new is not None:
+            if new[1] not in self._file_states:
+                self._file_states[new[1]] = {}
+            self._file_states[new[1]][key] = None
+
+    def list_sk(self, filekey, aliases=True):
+        #lists all state keys (and aliases) stored under the given file key
+        return [
+            key for key in self._file_states.get(filekey, ())
+            if aliases or not dict.__getitem__(self.state_keys, key)[0]
+        ]
+
+    def _index_blob(self, key, old, new):
+        #counts the state keys which store each blob.
+        #State entries must be replaced, not modified in place, to change their data file
+        old_blob = old[2] if old is not None and old[2] and is_blob(old[2]) else None
+        new_blob = new[2] if new is not None and new[2] and is_blob(new[2]) else None
+        if old_blob == new_blob:
+            return
+        if old_blob is not None:
+            self._blob_refs[old_blob] -= 1
+            if not self._blob_refs[old_blob]:
+                del self._blob_refs[old_blob]
+                self._released.add(old_blob)
+        if new_blob is not None:
+            self._blob_refs[new_blob] = self._blob_refs.get(new_blob, 0) + 1
+
+    def _index_digest(self, key, old, new):
+        #keeps the index of state digests under each file key up to date.
+        #Stash and trash states are not indexed, so they never have hash aliases
+        old_digest = _digest(key, old)
+        new_digest = _digest(key, new)
+        if old_digest == new_digest:
+            return
+        if old_digest is not None:
+            digests = self._digests[old_digest[0]]
+            del digests[old_digest[1]][key]
+            if not len(digests[old_digest[1]]):
+                del digests[old_digest[1]]
+                order = self._digest_order[old_digest[0]]
+                del order[bisect_left(order, old_digest[1])]
+                if not len(digests):
+                    del self._digests[old_digest[0]]
+                    del self._digest_order[old_digest[0]]
+        if new_digest is not None:
+            digests = self._digests.setdefault(new_digest[0], {})
+            if new_digest[1] not in digests:
+                digests[new_digest[1]] = {}
+                insort(self._digest_order.setdefault(new_digest[0], []), new_digest[1])
+            digests[new_digest[1]][key] = None
+
+    def _hash_alias(self, key):
+        #the virtual alias entry of <file key>:<digest prefix>, which points to the
+        #first saved state with that digest.  The prefix must match exactly one digest
+        if not isinstance(key, str):
+            return None
+        (filekey, _, prefix) = key.rpartition(':')
+        if len(prefix) < MIN_HASH_PREFIX or filekey not in self._digests or not _HEX.match(prefix):
+            return None
+        order = self._digest_order[filekey]
+        index = bisect_left(order, prefix)
+        if index == len(order) or not order[index].startswith(prefix):
+            return None
+        if index+1 < len(order) and order[index+1].startswith(prefix):
+            return None
+        return [self.digest_owner(filekey, order[index]), filekey, None]
+
+    def digest_owner(self, filekey, digest):
+        #the first saved state of the file key with the given digest, or None
+        states = self._digests.get(filekey, {}).get(digest)
+        return next(iter(states)) if states else None
+
+    def is_hash_alias(self, key):
+        #true if the state key is a virtual hash alias
+        return not dict.__contains__(self.state_keys, key) and self._hash_alias(key) is not None
+
+    def hash_aliases(self, statekey):
+        #lists the hash aliases (the full digest and its 7 character prefix) which resolve to the given state key
+        meta = self.state_meta(statekey)
+        filekey = statekey.split(':', 1)[0]
+        if meta is None:
+            return []
+        return [
+            alias for alias in (meta[1], meta[1][:7])
+            if not dict.__contains__(self.state_keys, filekey+':'+alias)
+            and (self._hash_alias(filekey+':'+alias) or [None])[0] == statekey
+        ]
+
+    def drop_hash_aliases(self):
+        #Deletes stored state aliases which are identical to a virtual hash alias.
+        #These are written by older versions.  Returns the number of aliases deleted
+        dropped = 0
+        for (key, entry) in list(dict.items(self.state_keys)):
+            if entry[0] and self.resolve_key(key, False) == (self._hash_alias(key) or [None])[0]:
+                del self.state_keys[key]
+                dropped += 1
+        return dropped
+
+    def blob_refs(self, data_file):
+        #the number of state keys which store the given blob
+        return self._blob_refs.get(data_file, 0)
+
+    def data_path(self, filekey, data_file):
+        #the location of a stored state
+        if is_blob(data_file):
+            digest = data_file.lstrip(COMPRESSED_PREFIX)[len(BLOB_PREFIX):]
+            #compressed blobs are stored beside uncompressed blobs, as '%<digest>'
+            return os.path.join(self.blob_dir, digest[:2], data_file[:data_file.index(BLOB_PREFIX)]+digest)
+        if self.flags.get(LAYOUT_FLAG) == 'sharded':
+            return os.path.join(self.file_keys[filekey][1], shard(data_file), data_file)
+        return os.path.join(self.file_keys[filekey][1], data_file)
+
+    def layout(self):
+        return self.flags.get(LAYOUT_FLAG, 'flat')
+
+    def relayout(self, layout):
+        #Moves the data files of every file key into the given layout.  If this
+        #is interrupted, it may be repeated to finish moving the remaining files.
+        #Returns the number of data files moved
+        if layout not in LAYOUTS:
+            raise ValueError("Unknown layout: %s" % layout)
+        moved = 0
+        for entry in dict.values(self.file_keys):
+            if entry[0]:
+                continue
+            for data_file in entry[2]:
+                if is_blob(data_file):
+                    continue
+                paths = [os.path.join(entry[1], data_file), os.path.join(entry[1], shard(data_file), data_file)]
+                if layout == 'flat':
+                    paths.reverse()
+                if os.path.isfile(paths[0]):
+                    os.makedirs(os.path.dirname(paths[1]), exist_ok=True)
+                    os.replace(paths[0], paths[1])
+                    moved += 1
+            if layout == 'flat' and os.path.isdir(entry[1]):
+                for name in os.listdir(entry[1]):
+                    if re.match(r'^[0-9a-f]{2}$', name) and os.path.isdir(os.path.join(entry[1], name)):
+                        try:
+                            os.rmdir(os.path.join(entry[1], name))
+                        except OSError:
+                            pass
+        if layout == 'flat':
+            if LAYOUT_FLAG in self.flags:
+                del self.flags[LAYOUT_FLAG]
+        else:
+            self.flags[LAYOUT_FLAG] = layout
+        return moved
+
+    def release_data(self, statekey):
+        #Releases the data file of a state key which is about to be deleted.
+        #The file is only removed after the next save, so a rollback can restore
+        #the state key.  Blobs may be shared, so they are only removed after the
+        #save which deletes the last state key storing them
+        (filekey, data_file) = self.state_keys[statekey][1:3]
+        if is_blob(data_file):
+            if any(
+                dict.__getitem__(self.state_keys, key)[2] == data_file
+                for key in self.list_sk(filekey, False) if key != statekey
+            ):
+                return
+        else:
+            self.detach_data(filekey, data_file)
+            self._obsolete.add((filekey, data_file))
+        self.file_keys[filekey][2].discard(data_file)
+
+    def release_folder(self, filekey):
+        #Releases the data folder of a file key which is about to be deleted.
+        #The folder is only removed after the next save
+        self._obsolete_folders.add(self.file_keys[filekey][1])
+
+    def pending_files(self, filekey):
+        #data files of a file key which will be removed by the next save
+        return {data_file for (key, data_file) in self._obsolete if key == filekey}
+
+    def state_meta(self, statekey):
+        #(size, digest, hash algorithm, creation time) recorded for a state key,
+        #or None if it was saved by an older version and has not been backfilled
+        entry = dict.get(self.state_keys, self.resolve_key(statekey, False))
+        if entry is None or len(entry) < 4:
+            return None
+        return entry[3]
+
+    def content_meta(self, filekey, data_file):
+        #(size, sha-256) of the contents of a stored state, read from storage
+        hasher = sha256()
+        size = 0
+        if is_chunked(data_file):
+            for chunk in self.iter_chunks(filekey, data_file):
+                hasher.update(chunk)
+                size += len(chunk)
+        elif is_delta(data_file) or data_file.startswith(COMPRESSED_PREFIX):
+            data = self.read_data(filekey, data_file)
+            hasher.update(data)
+            size = len(data)
+        else:
+            with open(self.data_path(filekey, data_file), mode='rb') as reader:
+                for block in iter(lambda: reader.read(1 << 20), b''):
+                    hasher.update(block)
+                    size += len(block)
+        return (size, hasher.hexdigest())
+
+    def backfill_state(self, statekey):
+        #Records metadata for a state key which was saved without it.  The
+        #creation time is taken from the modification time of the data file.
+        #Returns the size of the state, or None if its data file is missing or unreadable
+        entry = dict.__getitem__(self.state_keys, statekey)
+        path = self.data_path(entry[1], entry[2])
+        if not os.path.isfile(path):
+            return None
+        try:
+            (size, digest) = self.content_meta(entry[1], entry[2])
+        except (OSError, ValueError):
+            return None
+        self.state_keys[statekey] = entry[:3]+[(size, digest, HASH_ALGORITHM, int(os.path.getmtime(path)))]
+        return size
+
+    def backfill_meta(self):
+        #Records metadata for every state key which was saved without it.
+        #States with missing data files are skipped.  Returns the number of states updated
+        updated = 0
+        for (key, entry) in list(dict.items(self.state_keys)):
+            if entry[0] or (len(entry) > 3 and entry[3] is not None):
+                continue
+            if self.backfill_state(key) is not None:
+                updated += 1
+        return updated
+
+    def chunk_path(self, digest):
+        return os.path.join(self.chunk_dir, digest[:2], digest)
+
+    def store_chunks(self, reader, hasher=None):
+        #Splits a file into chunks, and stores any new chunks.
+        #Returns the manifest of the file: a list of (digest, size).
+        #If hasher is provided, it is updated with the contents of the file
+        manifest = []
+        for chunk in qs_chunks.split(reader):
+            if hasher is not None:
+                hasher.update(chunk)
+            digest = sha256(chunk).hexdigest()
+            destination = self.chunk_path(digest)
+            if not os.path.isfile(destination):
+                os.makedirs(os.path.dirname(destination), exist_ok=True)
+                #concurrent saves may store the same chunk
+                staged = '%s.%d.tmp' % (destination, threading.get_ident())
+                with open(staged, mode='wb') as writer:
+                    writer.write(chunk)
+                os.replace(staged, destination)
+            manifest.append((digest, len(chunk)))
+        return manifest
+
+    def read_manifest(self, filekey, data_file):
+        with open(self.data_path(filekey, data_file), mode='rb') as reader:
+            return qs_chunks.read_manifest(reader)
+
+    def iter_chunks(self, filekey, data_file):
+        #yields the contents of a chunked state, one chunk at a time
+        for (digest, size) in self.read_manifest(filekey, data_file):
+            with open(self.chunk_path(digest), mode='rb') as reader:
+                yield reader.read()
+
+    def _load(self, filekey, data_file):
+        #the stored contents of a data file, decompressed but not rebuilt from deltas
+        if is_chunked(data_file):
+            return b''.join(self.iter_chunks(filekey, data_file))
+        with open(self.data_path(filekey, data_file), mode='rb') as reader:
+            if data_file.startswith(COMPRESSED_PREFIX):
+                from . import qs_compress
+                return qs_compress.read(reader)
+            return reader.read()
+
+    def _write(self, destination, data, codec=None):
+        #atomically writes data to a data file, compressed with codec
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        with open(destination+'.tmp', mode='wb') as writer:
+            if codec is not None:
+                from . import qs_compress
+                qs_compress.compress(io.BytesIO(data), writer, codec)
+            else:
+                writer.write(data)
+        os.replace(destination+'.tmp', destination)
+
+    def _codec(self, filekey, data_file):
+        #the codec a data file is compressed with, or None
+        if not data_file.startswith(COMPRESSED_PREFIX):
+            return None
+        from . import qs_compress
+        with open(self.data_path(filekey, data_file), mode='rb') as reader:
+            return qs_compress.read_codec(reader)
+
+    def delta_header(self, filekey, data_file):
+        #(base data file or None, depth) of a stored state
+        if not is_delta(data_file):
+            return (None, 0)
+        if data_file.startswith(COMPRESSED_PREFIX):
+            return qs_delta.parse(self._load(filekey, data_file))[:2]
+        with open(self.data_path(filekey, data_file), mode='rb') as reader:
+            return qs_delta.read_header(reader)
+
+    def read_data(self, filekey, data_file, cache=None):
+        #The contents of a stored state.  Deltas are applied from the nearest
+        #full copy, or from the nearest data file in cache ({data file: contents})
+        return read_data(
+            lambda name: self._load(filekey, name),
+            data_file,
+            cache
+        )
+
+    def copy_data(self, filekey, data_file, destination, strategy='auto'):
+        #writes the contents of a stored state to destination.  Uncompressed full
+        #copies are copied with the requested strategy (see qs_copy)
+        self.copy_strategy = None
+        if not (is_chunked(data_file) or is_delta(data_file) or data_file.startswith(COMPRESSED_PREFIX)):
+            self.copy_strategy = qs_copy.copy(self.data_path(filekey, data_file), destination, strategy)
+            return
+        qs_copy.unlink_shared(destination)
+        if is_chunked(data_file):
+            with open(destination, mode='wb') as writer:
+                for chunk in self.iter_chunks(filekey, data_file):
+                    writer.write(chunk)
+        elif is_delta(data_file):
+            with open(destination, mode='wb') as writer:
+                writer.write(self.read_data(filekey, data_file))
+        elif data_file.startswith(COMPRESSED_PREFIX):
+            from . import qs_compress
+            with open(self.data_path(filekey, data_file), mode='rb') as reader:
+                with open(destination, mode='wb') as writer:
+                    qs_compress.decompress(reader, writer)
+
+    def _delta_base(self, filekey):
+        #the data file which the next state of a file key should be stored against
+        for key in reversed(self.list_sk(filekey, False)):
+            data_file = dict.__getitem__(self.state_keys, key)[2]
+            if key.split(':', 1)[1] not in _SPECIAL_STATES and not (is_blob(data_file) or is_chunked(data_file)):
+                return data_file
+        return None
+
+    def detach_data(self, filekey, data_file):
+        #Rewrites any deltas stored against data_file against its own base instead,
+        #so that data_file may be removed or replaced
+        dependents = [
+            dependent for dependent in self.file_keys[filekey][2]
+            if is_delta(dependent) and self.delta_header(filekey, dependent)[0] == data_file
+        ]
+        if not len(dependents):
+            return
+        (base_file, depth) = self.delta_header(filekey, data_file)
+        base_data = self.read_data(filekey, base_file) if base_file is not None else b''
+        for dependent in dependents:
+            delta = io.BytesIO()
+            qs_delta.write(delta, base_file, depth, qs_delta.encode(base_data, self.read_data(filekey, dependent)))
+            self._write(self.data_path(filekey, dependent), delta.getvalue(), self._codec(filekey, dependent))
+
+    def repack(self, filekey, chain, compress=None):
+        #Rewrites the states of a file key so that each is stored as a delta
+        #against the previous state, with a full copy every <chain> states.
+        #If chain is 0, every state is stored as a full copy.
+        #States are compressed with the given codec, if it is worthwhile.
+        #The replaced data files are removed after the next save.  Returns the replaced data files
+        filekey = self.resolve_key(filekey, True)
+        names = set(self.file_keys[filekey][2])
+        replaced = {}
+        previous = None #(data file, contents, depth)
+        cache = {}
+        for key in self.list_sk(filekey, False):
+            data_file = dict.__getitem__(self.state_keys, key)[2]
+            if is_blob(data_file) or is_chunked(data_file):
+                continue
+            if data_file not in cache:
+                cache = {data_file: self.read_data(filekey, data_file, cache)}
+            if data_file not in replaced:
+                #drop the suffixes added by next_name, which would otherwise grow with each repack
+                (root, extension) = os.path.splitext(data_file.lstrip(COMPRESSED_PREFIX+DELTA_PREFIX))
+                name = re.sub(r'(_\d+)+$', '', root)+extension
+                stored = self._store(filekey, name, cache[data_file], previous, chain, names, compress)
+                names.add(stored[0])
+                self._created.append((filekey, stored[0], self.data_path(filekey, stored[0])))
+                replaced[data_file] = stored
+            (new_file, depth) = replaced[data_file]
+            if key.split(':', 1)[1] not in _SPECIAL_STATES:
+                previous = (new_file, cache[data_file], depth)
+            self.state_keys[key] = [None, filekey, new_file]+dict.__getitem__(self.state_keys, key)[3:]
+        self.file_keys[filekey][2] -= set(replaced)
+        self.file_keys[filekey][2] |= {stored[0] for stored in replaced.values()}
+        self._obsolete |= {(filekey, data_file) for data_file in replaced}
+        return [data_file for data_file in replaced]
+
+    def _store(self, filekey, name, data, previous, chain, names, compress=None):
+        #Stores data in the file key's folder as a delta against previous
+        #(data file, contents, depth), unless the chain is full or the delta
+        #is not smaller than the data.  Returns (data file, depth)
+        if compress is not None:
+            from . import qs_compress
+            if not qs_compress.compressible(io.BytesIO(data), compress):
+                compress = None
+        prefix = COMPRESSED_PREFIX if compress is not None else ''
+        if previous is not None and previous[2] < chain:
+            ops = qs_delta.encode(previous[1], data, len(data)//2)
+            if ops is not None:
+                data_file = self.next_name('DF:'+filekey+':'+prefix+DELTA_PREFIX+name, prefix+DELTA_PREFIX+name, names.__contains__)
+                delta = io.BytesIO()
+                qs_delta.write(delta, previous[0], previous[2]+1, ops)
+                self._write(self.data_path(filekey, data_file), delta.getvalue(), compress)
+                return (data_file, previous[2]+1)
+        data_file = self.next_name('DF:'+filekey+':'+prefix+name, prefix+name, names.__contains__)
+        self._write(self.data_path(filekey, data_file), data, compress)
+        return (data_file, 0)
+
+    def next_key(self, counter, base_name, exists):
+        #Returns the first key of the form <base_name><index> for which exists
+        #returns False.  Counting resumes after the last index allocated for
+        #this counter, so allocation does not slow down as keys accumulate
+        index = self.counters.get(counter, 0)+1
+        while exists('%s%d' % (base_name, index)):
+            index += 1
+        self.counters[counter] = index
+        return '%s%d' % (base_name, index)
+
+    def next_name(self, counter, base_name, exists):
+        #Returns base_name, or the first name with a _<index> suffix before its extension
+        #for which exists returns False.  Counting resumes after the last suffix allocated for this counter
+        index = self.counters.get(counter)
+        if index is None and not exists(base_name):
+            self.counters[counter] = 0
+            return base_name
+        (filepath, filename) = os.path.split(base_name)
+        (rootfile, extension) = os.path.splitext(filename)
+        index = (index or 0)+1
+        while exists(os.path.join(filepath, '%s_%d%s' % (rootfile, index, extension))):
+            index += 1
+        self.counters[counter] = index
+        return os.path.join(filepath, '%s_%d%s' % (rootfile, index, extension))
+
+    def prune_counters(self):
+        #Deletes the counters of deleted file keys, and the counters of aliases
+        #which no longer conflict with an existing alias.  Returns the number of counters deleted
+        stale = []
+        for counter in dict.keys(self.counters):
+            (kind, _, name) = counter.partition(':')
+            if kind in ('SK', 'DF'):
+                filekey = name.split(':', 1)[0]
+                if not (dict.__contains__(self.file_keys, filekey) and dict.__getitem__(self.file_keys, filekey)[0] is None):
+                    stale.append(counter)
+            elif (kind == 'FA' and not dict.__contains__(self.file_keys, name)) or (
+                    kind == 'SA' and not dict.__contains__(self.state_keys, name)):
+                stale.append(counter)
+        for counter in stale:
+            del self.counters[counter]
+        return len(stale)
+
+    def state_owners(self):
+        #lists all file keys (including missing file keys) which own state keys
+        return [filekey for filekey in self._file_states]
+
+    def _read_cache(self, token):
+        #Loads the parsed checkpoint and its indexes from the snapshot cache,
+        #if the cache matches the current checkpoint
+        cache = os.path.join(self.base_dir, '.db_cache')
+        if token is None or not os.path.isfile(cache):
+            return False
+        gc_enabled = gc.isenabled()
+        gc.disable() #collection passes while unpickling millions of small containers are pointless
+        try:
+            with open(cache, mode='rb') as reader:
+                (cache_token, base_dir, tables, indexes) = pickle.load(reader)
+        except Exception:
+            return False
+        finally:
+            if gc_enabled:
+                gc.enable()
+        if cache_token != token or base_dir != os.path.abspath(self.base_dir) or len(tables) != 4 or len(indexes) != 6:
+            return False
+        dict.update(self.file_keys, tables[0])
+        dict.update(self.state_keys, tables[1])
+        dict.update(self.flags, tables[2])
+        dict.update(self.counters, tables[3])
+        (self._file_states, self._file_aliases, self._state_aliases, self._blob_refs, self._digests, self._digest_order) = indexes
+        return True
+
+    def _write_cache(self, token):
+        cache = os.path.join(self.base_dir, '.db_cache')
+        try:
+            with open(cache+'.tmp', mode='wb') as writer:
+                pickle.dump(
+                    (
+                        token,
+                        os.path.abspath(self.base_dir),
+                        (dict(self.file_keys), dict(self.state_keys), dict(self.flags), dict(self.counters)),
+                        (self._file_states, self._file_aliases, self._state_aliases, self._blob_refs, self._digests, self._digest_order)
+                    ),
+                    writer,
+                    pickle.HIGHEST_PROTOCOL
+                )
+            os.replace(cache+'.tmp', cache)
+        except OSError:
+            #the cache is optional
+            if os.path.isfile(cache+'.tmp'):
+                os.remove(cache+'.tmp')
+
+    def _apply(self, data):
+        #applies a single row from the checkpoint or journal
+        if data[0] == 'FK': #file key
+            data_folder = os.path.abspath(os.path.join(self.base_dir, data[2]))
+            self.file_keys.load(data[1], [
+                None,
+                data_folder,
+                {item for item in data[3:]}
+            ])
+        elif data[0] == 'FA':
+            self.file_keys.load(data[1], [
+                data[2],
+                None,
+                None
+            ])
+        elif data[0] == 'SK':
+            self.state_keys.load(data[1], [
+                None,
+                data[2],
+                data[3]
+            ] + ([(int(data[4]), data[5], data[6], int(data[7]))] if len(data) > 4 else []))
+        elif data[0] == 'SA':
+            self.state_keys.load(data[1], [
+                data[2],
+                data[3],
+                None
+            ])
+        elif data[0] == 'FD':
+            entry = dict.__getitem__(self.file_keys, data[1])
+            for change in data[2:]:
+                if change[0] == '+':
+                    entry[2].add(change[1:])
                 else:
-                    hasher.update('\t'.join(data).encode())
-                    if data[0] == 'FK': #file key
-                        data_folder = os.path.abspath(os.path.join(self.base_dir, data[2]))
-                        self.file_keys[data[1]] = [
-                            None,
-                            data_folder,
-                            {item for item in data[3:]}
-                        ]
-                        self.data_folders.add(data_folder)
-                    elif data[0] == 'FA':
-                        self.file_keys[data[1]] = [
-                            data[2],
-                            None,
-                            None
-                        ]
-                    elif data[0] == 'SK':
-                        self.state_keys[data[1]] = [
-                            None,
-                            data[2],
-                            data[3]
-                        ]
-                    elif data[0] == 'SA':
-                        self.state_keys[data[1]] = [
-                            data[2],
-                            data[3],
-                            None
-                        ]
-                    elif data[0] == 'CONFIG':
-                        self.flags[data[1]] = data[2]
-            configreader.close()
-            if checksum is not None and hasher.hexdigest() != checksum:
-                raise ValueError("Unable to verify database")
+                    entry[2].discard(change[1:])
+        elif data[0] == 'CONFIG':
+            self.flags.load(data[1], data[2])
+        elif data[0] == 'DF':
+            self.file_keys.unload(data[1])
+        elif data[0] == 'DS':
+            self.state_keys.unload(data[1])
+        elif data[0] == 'DC':
+            self.flags.unload(data[1])
+        elif data[0] == 'CN':
+            self.counters.load(data[1], int(data[2]))
+        elif data[0] == 'DN':
+            self.counters.unload(data[1])
+
+    def _mark_saved(self):
+        self.file_keys.mark_saved()
+        self.state_keys.mark_saved()
+        self.flags.mark_saved()
+        self.counters.mark_saved()
+
+    def _row(self, table, key, entry, origin=None):
+        if table is self.flags:
+            return ['CONFIG', key, entry] if entry is not None else ['DC', key]
+        if table is self.counters:
+            return ['CN', key, str(entry)] if entry is not None else ['DN', key]
+        if table is self.file_keys:
+            if entry is None:
+                return ['DF', key]
+            if entry[0]:
+                return ['FA', key, entry[0]]
+            if (origin is not None and origin[:2] == tuple(entry[:2]) and
+                    isinstance(origin[2], frozenset) and isinstance(entry[2], set)):
+                #only record the data files which changed
+                return ['FD', key]+['+'+item for item in entry[2]-origin[2]]+['-'+item for item in origin[2]-entry[2]]
+            return ['FK', key, os.path.relpath(entry[1], self.base_dir)]+[item for item in entry[2]]
+        if entry is None:
+            return ['DS', key]
+        if entry[0]:
+            return ['SA', key, entry[0], entry[1]]
+        if len(entry) > 3 and entry[3] is not None:
+            return ['SK', key, entry[1], entry[2]]+[str(item) for item in entry[3]]
+        return ['SK', key, entry[1], entry[2]]
+
     def register_fk(self, filename):
         (filepath, root_name) = os.path.split(filename)
         canonical = ''.join(char for char in root_name if char.isalnum())
-        data_folder = os.path.abspath(os.path.join(self.base_dir, reserve_name(canonical, {os.path.basename(folder) for folder in self.data_folders})))
+        data_folder = os.path.abspath(os.path.join(self.base_dir, self.next_name(
+            'folder:'+canonical,
+            canonical,
+            lambda name: os.path.abspath(os.path.join(self.base_dir, name)) in self.data_folders
+        )))
         os.makedirs(data_folder, exist_ok=True)
         self.data_folders.add(data_folder)
-        key = make_key(canonical[:5]+"_FK", self.file_keys)
+        key = self.next_key('FK:'+canonical[:5], canonical[:5]+"_FK", self.file_keys.__contains__)
+        self._created.append((key, None, data_folder))
         self.file_keys[key] = [
             None,
             data_folder,
@@ -115,25 +935,127 @@ class Database:
             return True
         return False
 
-    def register_sk(self, filekey, filepath, forcekey = False):
+    def register_sk(self, filekey, filepath, forcekey = False, staged = None, digest = None, delta = 0, compress = None,
+                    chunks = 0, manifest = None, copy = 'auto', hashsum = None):
+        #Stores a copy of filepath as a new state.  If staged is provided, it is
+        #a copy which was already written to the database's filesystem, and is moved into place.
+        #If manifest is provided, or if the file is at least <chunks> bytes, the
+        #state is stored as a manifest of chunks in the shared chunk store.
+        #The manifest lists (digest, size) of chunks which were already stored.
+        #Otherwise, if digest is provided, the state is stored in the blob store, where
+        #identical states of any file key share a single copy.
+        #Otherwise, if delta is set, the state is stored as a delta against the
+        #previous state, with a full copy at least every <delta> states.
+        #If compress is a codec name, the state is compressed unless a sample
+        #of the file does not compress well.
+        #Full copies are made with the copy strategy (see qs_copy).  Files are
+        #never hardlinked into the database, since they may be modified in place.
+        #hashsum is the sha-256 of the file, which is recorded in the state's
+        #metadata.  If it is not provided, the file is hashed
         if filekey not in self.file_keys:
-            sys.exit("The provided file key does not exist in this database (%s)"%filekey)
+            raise KeyNotFound("The provided file key does not exist in this database (%s)"%filekey)
         filename =os.path.basename(filepath)
         filekey = self.resolve_key(filekey, True)
         canonical = ''.join(char for char in filename if char.isalnum() or char=='.')
-        data_file = reserve_name(canonical, self.file_keys[filekey][2])
-        key = make_key(canonical.replace('.','')[:5]+"_SK", {
-            sk.replace(filekey+':', '', 1)
-            for sk in self.state_keys if self.state_keys[sk][1]==filekey
-        })
+        source = staged if staged is not None else os.path.abspath(filepath)
+        size = os.path.getsize(source) if manifest is None else sum(chunk[1] for chunk in manifest)
+        if hashsum is None:
+            hasher = sha256()
+            with open(source, mode='rb') as reader:
+                for block in iter(lambda: reader.read(1 << 20), b''):
+                    hasher.update(block)
+            hashsum = hasher.hexdigest()
+        if manifest is None and chunks and size >= chunks:
+            with open(source, mode='rb') as reader:
+                manifest = self.store_chunks(reader)
+        if manifest is not None:
+            (digest, delta, compress) = (None, 0, None)
+        if compress is not None:
+            from . import qs_compress
+            with open(source, mode='rb') as reader:
+                if not qs_compress.compressible(reader, compress):
+                    compress = None
+        prefix = COMPRESSED_PREFIX if compress is not None else ''
+        if manifest is not None:
+            prefix = CHUNKED_PREFIX
+        if digest is None:
+            data_file = self.next_name('DF:'+filekey+':'+prefix+canonical, prefix+canonical, self.file_keys[filekey][2].__contains__)
+        else:
+            #an identical blob is reused, whether or not it is compressed
+            data_file = prefix+BLOB_PREFIX+digest
+            for candidate in (prefix+BLOB_PREFIX+digest, BLOB_PREFIX+digest, COMPRESSED_PREFIX+BLOB_PREFIX+digest):
+                if os.path.isfile(self.data_path(filekey, candidate)):
+                    data_file = candidate
+                    break
         if forcekey:
             key = forcekey
-        shutil.copyfile(os.path.abspath(filepath), os.path.join(self.file_keys[filekey][1], data_file))
+        else:
+            key = self.next_key(
+                'SK:'+filekey+':'+canonical.replace('.','')[:5],
+                canonical.replace('.','')[:5]+"_SK",
+                lambda key: filekey+':'+key in self.state_keys
+            )
+        destination = self.data_path(filekey, data_file)
+        if copy == 'hardlink':
+            copy = 'auto'
+        self.copy_strategy = None
+        base_file = self._delta_base(filekey) if digest is None and delta else None
+        depth = self.delta_header(filekey, base_file)[1] if base_file is not None else delta
+        if manifest is not None:
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+            with open(destination+'.tmp', mode='wb') as writer:
+                qs_chunks.write_manifest(writer, manifest)
+            os.replace(destination+'.tmp', destination)
+            if staged is not None:
+                os.remove(staged)
+        elif depth < delta:
+            with open(source, mode='rb') as reader:
+                data = reader.read()
+            (data_file, depth) = self._store(
+                filekey,
+                canonical,
+                data,
+                (base_file, self.read_data(filekey, base_file), depth),
+                delta,
+                self.file_keys[filekey][2],
+                compress
+            )
+            if staged is not None:
+                os.remove(staged)
+        elif digest is not None and os.path.isfile(destination):
+            #the blob is already stored
+            if staged is not None:
+                os.remove(staged)
+        elif compress is not None:
+            from . import qs_compress
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+            with open(source, mode='rb') as reader:
+                with open(destination+'.tmp', mode='wb') as writer:
+                    qs_compress.compress(reader, writer, compress)
+            os.replace(destination+'.tmp', destination)
+            if staged is not None:
+                os.remove(staged)
+        elif staged is not None:
+            #the staged copy was made with a plain copy
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+            os.replace(staged, destination)
+            self.copy_strategy = 'copy'
+        elif digest is not None:
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+            self.copy_strategy = qs_copy.copy(source, destination+'.tmp', copy)
+            os.replace(destination+'.tmp', destination)
+        else:
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+            self.copy_strategy = qs_copy.copy(source, destination, copy)
+        if not is_blob(data_file):
+            #blobs may be shared with saves in other processes, so they are left for '$ quicksave clean -w'
+            self._created.append((filekey, data_file, self.data_path(filekey, data_file)))
         self.file_keys[filekey][2].add(data_file)
         self.state_keys[filekey+":"+key] = [
             None,
             filekey,
-            data_file
+            data_file,
+            (size, hashsum, HASH_ALGORITHM, int(time.time()))
         ]
         return (key, data_file)
 
@@ -149,50 +1071,105 @@ class Database:
             return True
         return False
 
-    def save(self):
-        try:
-            configwriter = open(os.path.join(
-                self.base_dir,
-                '.db_config.tmp'
-            ), mode='w')
-            configwriter.write('<QUICKSAVE DB>\n')
-            hasher = md5()
-            writer = csv.writer(configwriter, delimiter='\t', lineterminator='\n')
-            def writerow(args):
-                hasher.update('\t'.join(args).encode())
-                writer.writerow(args)
-            for key in self.file_keys:
-                entry = self.file_keys[key]
-                if entry[0]:
-                    writerow(['FA', key, entry[0]])
-                else:
-                    writerow(['FK', key, os.path.relpath(entry[1], self.base_dir)]+[item for item in entry[2]])
-            for key in self.state_keys:
-                entry = self.state_keys[key]
-                if entry[0]:
-                    writerow(['SA', key, entry[0], entry[1]])
-                else:
-                    writerow(['SK', key, entry[1], entry[2]])
-            for key in self.flags:
-                writerow(['CONFIG', key, self.flags[key]])
-            writerow(['MD5', hasher.hexdigest()])
-            configwriter.close()
-        except Exception as e:
-            os.remove(os.path.join(
-                self.base_dir,
-                '.db_config.tmp'
-            ))
-        else:
-            shutil.move(
-                os.path.join(
-                    self.base_dir,
-                    '.db_config.tmp'
-                ),
-                os.path.join(
-                    self.base_dir,
-                    '.db_config'
-                )
-            )
+    def rows(self):
+        #yields every row in the database index
+        for table in (self.file_keys, self.state_keys, self.flags, self.counters):
+            for (key, entry) in dict.items(table):
+                yield self._row(table, key, entry)
+
+    def save(self, checkpoint=False):
+        #Commits all changes since the last save to the storage engine.
+        #If checkpoint is set, the engine also compacts its storage
+        if self.deferred:
+            self._pending_checkpoint = self._pending_checkpoint or checkpoint
+            self.savepoint()
+            return True
+        return self._commit(checkpoint)
+
+    def flush(self):
+        #Commits the changes held back while saves are deferred
+        checkpoint = self._pending_checkpoint
+        self._pending_checkpoint = False
+        return self._commit(checkpoint)
+
+    def _commit(self, checkpoint):
+        rows = [
+            self._row(table, key, entry, origin)
+            for table in (self.file_keys, self.state_keys, self.flags, self.counters)
+            for (key, origin, entry) in table.changes()
+        ]
+        if self.engine.commit(rows, self.rows, checkpoint):
+            self._mark_saved()
+            self._version = self.engine.version()
+            for blob in self._released:
+                if blob not in self._blob_refs and os.path.isfile(self.data_path(None, blob)):
+                    os.remove(self.data_path(None, blob))
+            self._released = set()
+            for (filekey, data_file) in self._obsolete:
+                #unless a rollback restored them
+                if (filekey in self.file_keys and data_file not in self.file_keys[filekey][2] and
+                        os.path.isfile(self.data_path(filekey, data_file))):
+                    os.remove(self.data_path(filekey, data_file))
+            self._obsolete = set()
+            folders = {entry[1] for entry in dict.values(self.file_keys)}
+            for folder in self._obsolete_folders - folders:
+                shutil.rmtree(os.path.join(os.path.abspath(self.base_dir), folder), ignore_errors=True)
+            self._obsolete_folders = set()
+            self._created = []
+            self._created_mark = 0
+            return True
+        return False
+
+    def savepoint(self):
+        #marks the current state.  Until the next save, rollback() only
+        #discards changes made after the savepoint
+        self.file_keys.savepoint()
+        self.state_keys.savepoint()
+        self.flags.savepoint()
+        self.counters.savepoint()
+        self._created_mark = len(self._created)
+
+    def rollback(self, full=False):
+        #discards all changes since the last savepoint.
+        #If full, discards all changes since the last save
+        self.file_keys.rollback(full)
+        self.state_keys.rollback(full)
+        self.flags.rollback(full)
+        self.counters.rollback(full)
+        #data files and folders written by the discarded changes are removed
+        start = 0 if full else self._created_mark
+        for (filekey, data_file, path) in reversed(self._created[start:]):
+            entry = dict.get(self.file_keys, filekey)
+            if data_file is None:
+                if entry is None or entry[1] != path:
+                    shutil.rmtree(path, ignore_errors=True)
+                    self.data_folders.discard(path)
+            elif (entry is None or data_file not in entry[2]) and os.path.isfile(path):
+                os.remove(path)
+        del self._created[start:]
+        self._created_mark = len(self._created)
+        if full:
+            #files released since the last save are kept
+            self._released = set()
+            self._obsolete = set()
+            self._obsolete_folders = set()
+
+    def stale(self):
+        #checks if the database index was modified by another process
+        return self.engine.version() != self._version
+
+    def migrate(self, engine):
+        #Moves the database index to a different storage engine
+        if engine == self.engine.name:
+            return False
+        new_engine = ENGINES[engine](self.base_dir)
+        if not new_engine.create(self.rows()):
+            raise ValueError("Unable to write the database index")
+        self.engine.destroy()
+        self.engine = new_engine
+        self._mark_saved()
+        self._version = self.engine.version()
+        return True
 
     def resolve_key(self, alias, isfile):
         if isfile:
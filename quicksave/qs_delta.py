@@ -0,0 +1,150 @@
+import io
+import struct
+
+# A delta is a sequence of operations which rebuild a target from a base:
+#   C <offset> <length>: copy <length> bytes of the base, starting at <offset>
+#   L <length> <data>: insert <length> literal bytes
+# Delta files start with a header naming the data file of their base (blank
+# if there is none) and their depth: the number of deltas which must be applied
+# to rebuild them, counting from the nearest full copy
+
+_MAGIC = b'QSDELTA1\n'
+_COPY = struct.Struct('>cQQ')
+_LITERAL = struct.Struct('>cQ')
+_BLOCK = 1024 #the shortest run of the base which is copied, other than the common prefix and suffix
+_KEY = 32 #blocks are looked up by their first bytes, then compared in full
+_STRIDE = 128 #the base is indexed at offsets which are multiples of this
+_SKIP = 7 #unmatched regions of the target are scanned in steps of this many bytes.
+#Since _SKIP and _STRIDE are coprime, every run of at least _STRIDE*_SKIP+_BLOCK
+#matching bytes is found, wherever it is in the base
+_SAMPLES = 16 #windows of a large unmatched region which are looked up before it is scanned
+
+def _common_prefix(a, a_start, b, b_start, limit):
+    #the number of matching bytes (up to limit) in a and b from the given offsets
+    limit = min(limit, len(a)-a_start, len(b)-b_start)
+    length = 0
+    step = _BLOCK
+    while length < limit:
+        size = min(step, limit-length)
+        if a[a_start+length:a_start+length+size] == b[b_start+length:b_start+length+size]:
+            length += size
+            step *= 2
+        elif size == 1:
+            break
+        else:
+            step = size//2
+    return length
+
+def _common_suffix(a, b, limit):
+    #the number of matching bytes (up to limit) at the ends of a and b
+    limit = min(limit, len(a), len(b))
+    length = 0
+    step = _BLOCK
+    while length < limit:
+        size = min(step, limit-length)
+        if a[len(a)-length-size:len(a)-length] == b[len(b)-length-size:len(b)-length]:
+            length += size
+            step *= 2
+        elif size == 1:
+            break
+        else:
+            step = size//2
+    return length
+
+def _matched_samples(base, target, start, end):
+    #the number of evenly spaced windows of target[start:end] found anywhere in base
+    step = (end-start-_KEY)//(_SAMPLES-1)
+    return sum(
+        base.find(target[offset:offset+_KEY]) >= 0
+        for offset in range(start, start+step*_SAMPLES, step)
+    )
+
+def encode(base, target, limit=None):
+    #Returns the operations which rebuild target from base, or None if they
+    #would be larger than limit.
+    #Edits usually leave most of a file in place, so the common prefix and
+    #suffix are matched first.  The remainder is matched against an index of
+    #the base's blocks, which also finds content moved to a different offset
+    ops = []
+    size = 0 #literal bytes in ops
+    prefix = _common_prefix(base, 0, target, 0, len(target))
+    if prefix:
+        ops.append(_COPY.pack(b'C', 0, prefix))
+    suffix = _common_suffix(base, target, min(len(base), len(target))-prefix)
+    end = len(target)-suffix
+    if limit is not None and end-prefix >= _SAMPLES*_BLOCK:
+        #the remainder is scanned in Python, so a remainder which mostly does
+        #not appear in the base is rejected by sampling it first
+        missed = _SAMPLES-_matched_samples(base, target, prefix, end)
+        if (end-prefix)*missed//_SAMPLES > limit:
+            return None
+    index = {}
+    for offset in range(0, len(base)-_BLOCK+1, _STRIDE):
+        index.setdefault(base[offset:offset+_KEY], offset)
+    position = literal = prefix
+    while position+_BLOCK <= end:
+        offset = index.get(target[position:position+_KEY])
+        if offset is None or base[offset:offset+_BLOCK] != target[position:position+_BLOCK]:
+            position += _SKIP
+            if limit is not None and size+position-literal > limit:
+                return None
+            continue
+        #the run may have started up to _STRIDE*_SKIP bytes earlier
+        back = _common_suffix(
+            base[max(offset-_BLOCK, 0):offset],
+            target[max(position-_BLOCK, literal):position],
+            _BLOCK
+        )
+        length = _BLOCK + _common_prefix(base, offset+_BLOCK, target, position+_BLOCK, end-position-_BLOCK)
+        if position-back > literal:
+            ops.append(_LITERAL.pack(b'L', position-back-literal))
+            ops.append(target[literal:position-back])
+            size += position-back-literal
+        ops.append(_COPY.pack(b'C', offset-back, length+back))
+        position = literal = position+length
+    if end > literal:
+        ops.append(_LITERAL.pack(b'L', end-literal))
+        ops.append(target[literal:end])
+    if suffix:
+        ops.append(_COPY.pack(b'C', len(base)-suffix, suffix))
+    ops = b''.join(ops)
+    if limit is not None and len(ops) > limit:
+        return None
+    return ops
+
+def decode(base, ops):
+    #Rebuilds the target from base and the operations returned by encode
+    output = []
+    position = 0
+    while position < len(ops):
+        if ops[position:position+1] == b'C':
+            (_, offset, length) = _COPY.unpack_from(ops, position)
+            output.append(base[offset:offset+length])
+            position += _COPY.size
+        elif ops[position:position+1] == b'L':
+            (_, length) = _LITERAL.unpack_from(ops, position)
+            position += _LITERAL.size
+            output.append(ops[position:position+length])
+            position += length
+        else:
+            raise ValueError("Invalid delta operation at offset %d" % position)
+    return b''.join(output)
+
+def write(writer, base_file, depth, ops):
+    writer.write(_MAGIC)
+    writer.write(('%s\n%d\n' % (base_file if base_file is not None else '', depth)).encode())
+    writer.write(ops)
+
+def read_header(reader):
+    #Returns (base data file or None, depth), leaving the reader at the operations
+    if reader.readline() != _MAGIC:
+        raise ValueError("Not a delta file")
+    base_file = reader.readline().decode().rstrip('\n')
+    depth = int(reader.readline())
+    return (base_file if len(base_file) else None, depth)
+
+def parse(data):
+    #Returns (base data file or None, depth, operations) of the contents of a delta file
+    reader = io.BytesIO(data)
+    (base_file, depth) = read_header(reader)
+    return (base_file, depth, reader.read())
@@ -0,0 +1,350 @@
+import os
+import shutil
+import csv
+from hashlib import md5
+
+# Storage engines persist the database index as a stream of rows:
+#   ['FK', key, data folder, *data files]     file key
+#   ['FA', alias, target]                     file alias
+#   ['FD', key, *('+'/'-' + data file)]       data files added to/removed from a file key
+#   ['SK', key, file key, data file, *meta]   state key.  meta is (size, digest, hash algorithm, creation time), if recorded
+#   ['SA', alias, target, file key]           state alias
+#   ['CONFIG', key, value]                    database configuration
+#   ['CN', counter, value]                    the last index allocated by a name counter
+#   ['DF', key], ['DS', key], ['DC', key]     deleted file key, state key, or config entry
+#   ['DN', counter]                           deleted name counter
+# Data folders are always relative to the database directory
+
+def _stat(path):
+    try:
+        stat = os.stat(path)
+        return (stat.st_size, stat.st_mtime_ns)
+    except OSError:
+        return None
+
+class TextEngine:
+    #The original tab-separated format.  .db_config holds a checkpoint of the
+    #full index and .db_journal holds every transaction committed since then
+    name = 'text'
+
+    def __init__(self, base_dir):
+        self.base_dir = base_dir
+        self.config = os.path.join(base_dir, '.db_config')
+        self.journal = os.path.join(base_dir, '.db_journal')
+        self.journal_ok = True
+
+    def exists(self):
+        return os.path.isdir(self.base_dir) and os.path.isfile(self.config)
+
+    def version(self):
+        #Changes whenever the index is modified
+        return (_stat(self.config), _stat(self.journal))
+
+    def checkpoint_token(self):
+        #Identifies the current checkpoint by its size, modification time, and
+        #checksum without reading the whole file
+        stat = os.stat(self.config)
+        with open(self.config, mode='rb') as reader:
+            reader.seek(max(0, stat.st_size-64))
+            trailer = reader.read().split(b'\n')
+        checksum = trailer[-2] if len(trailer) > 1 else b''
+        return (
+            stat.st_size,
+            stat.st_mtime_ns,
+            checksum.decode(errors='replace') if checksum.startswith(b'MD5\t') else ''
+        )
+
+    def load_checkpoint(self):
+        configreader = open(self.config, mode='r')
+        verification = configreader.readline().strip()
+        if verification != "<QUICKSAVE DB>":
+            raise ValueError("Unable to verify database")
+        reader = csv.reader(configreader, delimiter='\t')
+        hasher = md5()
+        checksum = None
+        for data in reader:
+            if data[0] == 'MD5':
+                checksum = data[1]
+            else:
+                hasher.update('\t'.join(data).encode())
+                yield data
+        configreader.close()
+        if checksum is not None and hasher.hexdigest() != checksum:
+            raise ValueError("Unable to verify database")
+
+    def load_journal(self):
+        #Yields each complete transaction from the journal.  Each transaction
+        #is terminated by an MD5 row.  An incomplete or corrupted tail is
+        #discarded and forces a checkpoint on the next commit
+        if not os.path.isfile(self.journal):
+            return
+        with open(self.journal, mode='r') as journalreader:
+            if journalreader.readline().strip() != '<QUICKSAVE JOURNAL>':
+                self.journal_ok = False
+                return
+            pending = []
+            hasher = md5()
+            for data in csv.reader(journalreader, delimiter='\t'):
+                if not len(data):
+                    self.journal_ok = False
+                    break
+                if data[0] == 'MD5':
+                    if len(data) < 2 or hasher.hexdigest() != data[1]:
+                        self.journal_ok = False
+                        break
+                    for row in pending:
+                        yield row
+                    pending = []
+                    hasher = md5()
+                else:
+                    hasher.update('\t'.join(data).encode())
+                    pending.append(data)
+            if len(pending):
+                self.journal_ok = False
+
+    def create(self, rows=()):
+        #Writes a new checkpoint containing the provided rows
+        try:
+            configwriter = open(self.config+'.tmp', mode='w')
+            configwriter.write('<QUICKSAVE DB>\n')
+            hasher = md5()
+            writer = csv.writer(configwriter, delimiter='\t', lineterminator='\n')
+            count = 0
+            for row in rows:
+                hasher.update('\t'.join(row).encode())
+                writer.writerow(row)
+                count += 1
+            if count:
+                writer.writerow(['MD5', hasher.hexdigest()])
+            configwriter.close()
+        except Exception as e:
+            os.remove(self.config+'.tmp')
+            return False
+        shutil.move(self.config+'.tmp', self.config)
+        #the journal (if any) is now part of the checkpoint
+        if os.path.isfile(self.journal):
+            os.remove(self.journal)
+        self.journal_ok = True
+        return True
+
+    def commit(self, rows, snapshot, checkpoint=False):
+        #Appends the rows to the journal as a single transaction.
+        #The journal is compacted into a new checkpoint when requested, or once
+        #it has grown larger than the checkpoint itself
+        checkpoint = checkpoint or not self.journal_ok
+        if not checkpoint:
+            if not len(rows):
+                return True
+            journal_size = os.path.getsize(self.journal) if os.path.isfile(self.journal) else 0
+            checkpoint = journal_size + sum(
+                len('\t'.join(row))+1 for row in rows
+            ) > os.path.getsize(self.config)
+        if checkpoint:
+            return self.create(snapshot())
+        try:
+            exists = os.path.isfile(self.journal)
+            journalwriter = open(self.journal, mode='a')
+            if not exists:
+                journalwriter.write('<QUICKSAVE JOURNAL>\n')
+            hasher = md5()
+            writer = csv.writer(journalwriter, delimiter='\t', lineterminator='\n')
+            for row in rows:
+                hasher.update('\t'.join(row).encode())
+                writer.writerow(row)
+            writer.writerow(['MD5', hasher.hexdigest()])
+            journalwriter.close()
+        except Exception:
+            #an incomplete transaction is discarded when the journal is replayed
+            self.journal_ok = False
+            return False
+        return True
+
+    def destroy(self):
+        for path in (self.config, self.journal):
+            if os.path.isfile(path):
+                os.remove(path)
+
+class SQLiteEngine:
+    #Stores the index in an SQLite database (.db_sqlite) with indexed tables
+    #for keys, aliases, and data files.  Each commit only writes the changed rows
+    name = 'sqlite'
+    schema = [
+        'CREATE TABLE IF NOT EXISTS file_keys (key TEXT PRIMARY KEY, target TEXT, folder TEXT)',
+        'CREATE INDEX IF NOT EXISTS file_keys_target ON file_keys (target)',
+        'CREATE TABLE IF NOT EXISTS data_files (filekey TEXT, datafile TEXT, PRIMARY KEY (filekey, datafile))',
+        'CREATE TABLE IF NOT EXISTS state_keys (key TEXT PRIMARY KEY, target TEXT, filekey TEXT, datafile TEXT)',
+        'CREATE INDEX IF NOT EXISTS state_keys_target ON state_keys (target)',
+        'CREATE INDEX IF NOT EXISTS state_keys_filekey ON state_keys (filekey)',
+        'CREATE TABLE IF NOT EXISTS config (key TEXT PRIMARY KEY, value TEXT)',
+        'CREATE TABLE IF NOT EXISTS counters (key TEXT PRIMARY KEY, value TEXT)',
+        'CREATE TABLE IF NOT EXISTS state_meta (key TEXT PRIMARY KEY, size TEXT, digest TEXT, algorithm TEXT, created TEXT)',
+    ]
+
+    def __init__(self, base_dir):
+        self.base_dir = base_dir
+        self.path = os.path.join(base_dir, '.db_sqlite')
+        self._connection = None
+
+    def exists(self):
+        return os.path.isfile(self.path)
+
+    def _connect(self, path=None):
+        try:
+            import sqlite3
+        except ImportError:
+            raise ValueError("The sqlite3 module is not available")
+        connection = sqlite3.connect(path if path else self.path, isolation_level=None)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        return connection
+
+    @property
+    def connection(self):
+        if self._connection is None:
+            self._connection = self._connect()
+            #adds any tables which are missing from indexes created by older versions
+            for statement in self.schema:
+                self._connection.execute(statement)
+        return self._connection
+
+    def version(self):
+        #Changes whenever the index is modified
+        return (_stat(self.path), _stat(self.path+'-wal'))
+
+    def checkpoint_token(self):
+        #SQLite databases are not cached
+        return None
+
+    def load_journal(self):
+        return []
+
+    def load_checkpoint(self):
+        data_files = {}
+        for (filekey, datafile) in self.connection.execute('SELECT filekey, datafile FROM data_files'):
+            if filekey not in data_files:
+                data_files[filekey] = []
+            data_files[filekey].append(datafile)
+        for (key, target, folder) in self.connection.execute('SELECT key, target, folder FROM file_keys'):
+            if target is None:
+                yield ['FK', key, folder]+data_files.get(key, [])
+            else:
+                yield ['FA', key, target]
+        for (key, target, filekey, datafile, *meta) in self.connection.execute(
+            'SELECT state_keys.key, target, filekey, datafile, size, digest, algorithm, created '
+            'FROM state_keys LEFT JOIN state_meta ON state_keys.key = state_meta.key'
+        ):
+            if target is None:
+                yield ['SK', key, filekey, datafile]+(meta if meta[0] is not None else [])
+            else:
+                yield ['SA', key, target, filekey]
+        for (key, value) in self.connection.execute('SELECT key, value FROM config'):
+            yield ['CONFIG', key, value]
+        for (key, value) in self.connection.execute('SELECT key, value FROM counters'):
+            yield ['CN', key, value]
+
+    def _execute(self, connection, row):
+        if row[0] == 'FK':
+            connection.execute('INSERT OR REPLACE INTO file_keys VALUES (?, NULL, ?)', (row[1], row[2]))
+            connection.execute('DELETE FROM data_files WHERE filekey=?', (row[1],))
+            connection.executemany(
+                'INSERT OR IGNORE INTO data_files VALUES (?, ?)',
+                [(row[1], datafile) for datafile in row[3:]]
+            )
+        elif row[0] == 'FA':
+            connection.execute('INSERT OR REPLACE INTO file_keys VALUES (?, ?, NULL)', (row[1], row[2]))
+            connection.execute('DELETE FROM data_files WHERE filekey=?', (row[1],))
+        elif row[0] == 'FD':
+            for change in row[2:]:
+                if change[0] == '+':
+                    connection.execute('INSERT OR IGNORE INTO data_files VALUES (?, ?)', (row[1], change[1:]))
+                else:
+                    connection.execute('DELETE FROM data_files WHERE filekey=? AND datafile=?', (row[1], change[1:]))
+        elif row[0] == 'SK':
+            connection.execute('INSERT OR REPLACE INTO state_keys VALUES (?, NULL, ?, ?)', (row[1], row[2], row[3]))
+            if len(row) > 4:
+                connection.execute('INSERT OR REPLACE INTO state_meta VALUES (?, ?, ?, ?, ?)', tuple(row[1:2]+row[4:8]))
+            else:
+                connection.execute('DELETE FROM state_meta WHERE key=?', (row[1],))
+        elif row[0] == 'SA':
+            connection.execute('INSERT OR REPLACE INTO state_keys VALUES (?, ?, ?, NULL)', (row[1], row[2], row[3]))
+            connection.execute('DELETE FROM state_meta WHERE key=?', (row[1],))
+        elif row[0] == 'CONFIG':
+            connection.execute('INSERT OR REPLACE INTO config VALUES (?, ?)', (row[1], row[2]))
+        elif row[0] == 'DF':
+            connection.execute('DELETE FROM file_keys WHERE key=?', (row[1],))
+            connection.execute('DELETE FROM data_files WHERE filekey=?', (row[1],))
+        elif row[0] == 'DS':
+            connection.execute('DELETE FROM state_keys WHERE key=?', (row[1],))
+            connection.execute('DELETE FROM state_meta WHERE key=?', (row[1],))
+        elif row[0] == 'CN':
+            connection.execute('INSERT OR REPLACE INTO counters VALUES (?, ?)', (row[1], row[2]))
+        elif row[0] == 'DC':
+            connection.execute('DELETE FROM config WHERE key=?', (row[1],))
+        elif row[0] == 'DN':
+            connection.execute('DELETE FROM counters WHERE key=?', (row[1],))
+
+    def create(self, rows=()):
+        #Builds a new index containing the provided rows, then replaces the
+        #current index (if any) in a single rename
+        tmp_path = self.path+'.tmp'
+        for path in (tmp_path, tmp_path+'-wal', tmp_path+'-shm'):
+            if os.path.isfile(path):
+                os.remove(path)
+        connection = self._connect(tmp_path)
+        try:
+            connection.execute('PRAGMA journal_mode=DELETE')
+            connection.execute('BEGIN')
+            for statement in self.schema:
+                connection.execute(statement)
+            for row in rows:
+                self._execute(connection, row)
+            connection.execute('COMMIT')
+        except Exception:
+            connection.close()
+            os.remove(tmp_path)
+            return False
+        connection.close()
+        self.close()
+        for path in (self.path+'-wal', self.path+'-shm'):
+            if os.path.isfile(path):
+                os.remove(path)
+        shutil.move(tmp_path, self.path)
+        return True
+
+    def commit(self, rows, snapshot, checkpoint=False):
+        if len(rows):
+            try:
+                self.connection.execute('BEGIN')
+                for row in rows:
+                    self._execute(self.connection, row)
+                self.connection.execute('COMMIT')
+            except Exception:
+                self.connection.execute('ROLLBACK')
+                return False
+        if checkpoint:
+            self.connection.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        return True
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def destroy(self):
+        self.close()
+        for path in (self.path, self.path+'-wal', self.path+'-shm'):
+            if os.path.isfile(path):
+                os.remove(path)
+
+ENGINES = {
+    engine.name: engine
+    for engine in (TextEngine, SQLiteEngine)
+}
+
+def open_engine(base_dir):
+    #Returns the engine which holds the database index in this directory.
+    #Databases are created with the text engine
+    for engine in (SQLiteEngine, TextEngine):
+        if engine(base_dir).exists():
+            return engine(base_dir)
+    return TextEngine(base_dir)
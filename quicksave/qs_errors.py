@@ -0,0 +1,24 @@
+# Errors raised by commands in place of sys.exit.  They are SystemExit
+# subclasses, so the command line still prints the message and exits, while
+# Repository can tell errors apart without reading their messages
+
+class CommandError(SystemExit):
+    pass
+
+class KeyNotFound(CommandError):
+    pass
+
+class KeyConflict(CommandError):
+    pass
+
+class ReservedKey(KeyConflict):
+    pass
+
+class DatabaseFailure(CommandError):
+    pass
+
+class VerifyFailure(DatabaseFailure):
+    #report holds the results of the verification
+    def __init__(self, message, report):
+        super().__init__(message)
+        self.report = report
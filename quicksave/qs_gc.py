@@ -0,0 +1,177 @@
+import os
+import time
+import heapq
+from .qs_database import _SPECIAL_STATES, STAGING_PREFIX, is_delta, shard
+
+# Incremental garbage collection.  Each run works through the database in two
+# phases, and stops once its budget is spent:
+#   states: prunes state keys with missing data files, records missing metadata,
+#           and removes states which duplicate an earlier state of their file key
+#   folders: removes files which are not listed by their data folder's file key.
+#            Once every folder is scanned, the name counters of deleted file keys are removed
+# The position of the last processed item is saved in the CURSOR_FILE, in the
+# database folder, so the next run continues from there.  The index is saved
+# after every batch.  The shared blob and chunk stores are only collected by '$ quicksave clean -w'
+# Other processes may copy data files into the database before saving the index,
+# so unlisted files are only removed once they are older than GRACE_PERIOD
+CURSOR_FILE = '.gc_cursor'
+GRACE_PERIOD = 3600 #seconds since an unlisted file was last modified before it is removed
+STAGING_GRACE = 86400 #seconds before an abandoned staging file is removed
+BATCH_SIZE = 1000 #items processed between saves
+PHASES = ('states', 'folders')
+
+def scan_files(path):
+    #yields (folder, name) for every file below path.  Only the folders waiting
+    #to be scanned are kept in memory
+    pending = [path]
+    while len(pending):
+        folder = pending.pop()
+        try:
+            iterator = os.scandir(folder)
+        except FileNotFoundError:
+            continue
+        with iterator:
+            for entry in iterator:
+                if entry.is_dir(follow_symlinks=False):
+                    pending.append(entry.path)
+                else:
+                    yield (folder, entry.name)
+
+def in_progress(folder, name, now=None):
+    #whether an unlisted file may belong to a save which has not been committed.
+    #Staging files are kept for longer, since a save may hold them while other files are hashed
+    try:
+        stat = os.stat(os.path.join(folder, name))
+    except FileNotFoundError:
+        return True
+    age = (now if now is not None else time.time()) - max(stat.st_mtime, stat.st_ctime)
+    if name.startswith(STAGING_PREFIX) or name.endswith('.tmp'):
+        return age < STAGING_GRACE
+    return age < GRACE_PERIOD
+
+def cursor(database):
+    #(phase, last processed key) of an unfinished collection
+    try:
+        with open(os.path.join(database.base_dir, CURSOR_FILE)) as reader:
+            (phase, _, position) = reader.read().partition(':')
+    except FileNotFoundError:
+        return (PHASES[0], '')
+    if phase not in PHASES:
+        return (PHASES[0], '')
+    return (phase, position)
+
+def _save_cursor(database, phase, position):
+    #saves the index, then the position it was saved at
+    database.save()
+    path = os.path.join(database.base_dir, CURSOR_FILE)
+    with open(path+'.tmp', mode='w') as writer:
+        writer.write(phase+':'+position)
+    os.replace(path+'.tmp', path)
+
+def _pending(table, position):
+    #the authoritative keys after position, as a heap.  Keys are popped in order
+    #as they are processed, so a run which stops early does not sort every key
+    keys = [key for (key, entry) in dict.items(table) if not entry[0] and key > position]
+    heapq.heapify(keys)
+    return keys
+
+def _collect_state(database, key, summary):
+    entry = dict.__getitem__(database.state_keys, key)
+    if entry[1] not in database.file_keys:
+        return #states of missing file keys are removed by '$ quicksave clean -s'
+    if not os.path.isfile(database.data_path(entry[1], entry[2])):
+        for alias in database.list_sa(key, True):
+            del database.state_keys[alias]
+        del database.state_keys[key]
+        summary['prune_statekeys'].append(key)
+        return
+    if database.state_meta(key) is None:
+        size = database.backfill_state(key)
+        if size is not None:
+            summary['metadata'] += 1
+            summary['bytes'] += size
+    meta = database.state_meta(key)
+    if meta is None or key.split(':', 1)[1] in _SPECIAL_STATES:
+        return
+    owner = database.digest_owner(entry[1], meta[1])
+    if owner is not None and owner != key:
+        for alias in database.list_sa(key):
+            database.state_keys[alias] = [owner, entry[1], None]
+        database.release_data(key)
+        del database.state_keys[key]
+        summary['deduplicate'][key] = owner
+
+def orphaned_files(database, filekey):
+    #yields (folder, name) for every file in a file key's data folder which is
+    #not stored by the file key, and is not the base of a stored delta
+    (folder, listed) = dict.__getitem__(database.file_keys, filekey)[1:3]
+    listed = set(listed) | {
+        dict.__getitem__(database.state_keys, key)[2] for key in database.list_sk(filekey, False)
+    } | database.pending_files(filekey) #released files are removed once the index is saved
+    pending = [data_file for data_file in listed if is_delta(data_file)]
+    while len(pending):
+        #the base of a delta is kept, even if no state key stores it
+        data_file = pending.pop()
+        if os.path.isfile(database.data_path(filekey, data_file)):
+            base = database.delta_header(filekey, data_file)[0]
+            if base is not None and base not in listed:
+                listed.add(base)
+                pending.append(base)
+    sharded = database.layout() == 'sharded'
+    for (parent, name) in scan_files(folder):
+        if name in listed and (parent == folder or (
+            sharded and os.path.dirname(parent) == folder and os.path.basename(parent) == shard(name)
+        )):
+            continue
+        yield (parent, name)
+
+def _collect_folder(database, filekey, summary):
+    now = time.time()
+    for (parent, name) in list(orphaned_files(database, filekey)):
+        if in_progress(parent, name, now):
+            continue
+        os.remove(os.path.join(parent, name))
+        summary['prune_files'].append(os.path.relpath(os.path.join(parent, name), database.base_dir))
+
+def collect(database, budget=None, max_bytes=None, batch=BATCH_SIZE):
+    #Continues the incremental collection until it finishes, or until budget
+    #seconds have passed or max_bytes of stored states have been read.
+    #Returns a summary of the changes made.  'complete' is set if the collection finished
+    start = time.monotonic()
+    summary = {
+        'prune_statekeys': [],
+        'metadata': 0,
+        'deduplicate': {},
+        'prune_files': [],
+        'items': 0,
+        'bytes': 0,
+        'counters': 0,
+        'complete': False
+    }
+    (phase, position) = cursor(database)
+    while True:
+        keys = _pending(database.state_keys if phase == 'states' else database.file_keys, position)
+        processed = 0
+        while len(keys):
+            if (budget is not None and time.monotonic()-start >= budget) or (max_bytes is not None and summary['bytes'] >= max_bytes):
+                _save_cursor(database, phase, position)
+                return summary
+            position = heapq.heappop(keys)
+            if phase == 'states':
+                if dict.__contains__(database.state_keys, position):
+                    _collect_state(database, position, summary)
+            elif dict.__contains__(database.file_keys, position):
+                _collect_folder(database, position, summary)
+            summary['items'] += 1
+            processed += 1
+            if processed % batch == 0:
+                _save_cursor(database, phase, position)
+        if phase == PHASES[-1]:
+            break
+        (phase, position) = (PHASES[PHASES.index(phase)+1], '')
+    summary['counters'] = database.prune_counters()
+    database.save()
+    if os.path.exists(os.path.join(database.base_dir, CURSOR_FILE)):
+        os.remove(os.path.join(database.base_dir, CURSOR_FILE))
+    summary['complete'] = True
+    return summary
@@ -0,0 +1,342 @@
+import os
+import argparse
+import threading
+from contextlib import contextmanager
+from . import utils
+from . import commands
+from . import qs_errors
+from .qs_database import Database
+
+class QuicksaveError(Exception):
+    #Base class for all errors raised by Repository
+    pass
+
+class DatabaseError(QuicksaveError):
+    pass
+
+class VerificationError(DatabaseError):
+    #Raised by verify if states are missing or corrupted.  report holds the full report
+    report = None
+
+class KeyNotFoundError(QuicksaveError):
+    pass
+
+class KeyConflictError(QuicksaveError):
+    pass
+
+class ReservedKeyError(KeyConflictError):
+    pass
+
+# Commands raise qs_errors subclasses of SystemExit.  Repository translates
+# them into the matching QuicksaveError subclass.  Other exits are raised as QuicksaveError
+_ERRORS = {
+    qs_errors.VerifyFailure: VerificationError,
+    qs_errors.ReservedKey: ReservedKeyError,
+    qs_errors.KeyNotFound: KeyNotFoundError,
+    qs_errors.KeyConflict: KeyConflictError,
+    qs_errors.DatabaseFailure: DatabaseError,
+}
+
+# Commands find the database through the module globals in utils, which _call
+# swaps for the duration of each command.  Commands from every Repository
+# therefore run one at a time, while this lock is held
+_LOCK = threading.RLock()
+
+def _error(exit):
+    message = str(exit.code)
+    for kind in type(exit).__mro__:
+        if kind in _ERRORS:
+            error = _ERRORS[kind](message)
+            if hasattr(exit, 'report'):
+                error.report = exit.report
+            return error
+    return QuicksaveError(message)
+
+def _quiet(*args, **kwargs):
+    pass
+
+def _registered(result, copy_strategy):
+    return {
+        'file_key': result[0],
+        'file_aliases': result[1],
+        'state_key': result[2],
+        'state_aliases': result[3],
+        'copy_strategy': copy_strategy
+    }
+
+def _saved(result, copy_strategy):
+    return {
+        'file_key': result[0],
+        'state_key': result[1],
+        'aliases': result[2],
+        'copy_strategy': copy_strategy
+    }
+
+class Repository:
+    #A quicksave database opened directly, without the global configuration.
+    #flags replaces the settings of '$ quicksave config --global'.
+    #Each method runs the corresponding command and returns its result.
+    #Errors are raised as QuicksaveError subclasses, and leave the database unchanged.
+    #Separate Repository objects may be used from different threads, but their
+    #commands are run one at a time.  A single Repository should not be shared between threads
+    def __init__(self, path, create=True, flags=None):
+        path = os.path.abspath(path)
+        if not os.path.isdir(path):
+            if not create:
+                raise DatabaseError("The database does not exist (%s)" % path)
+            os.makedirs(path)
+        self.path = path
+        self.flags = dict(flags) if flags is not None else {}
+        try:
+            self.database = Database(path)
+        except ValueError as e:
+            raise DatabaseError("The database is corrupted (%s)" % path) from e
+
+    def _call(self, command, **kwargs):
+        args = argparse.Namespace(return_result=True, help=_quiet, **kwargs)
+        with _LOCK:
+            state = (utils._CURRENT_DATABASE, utils._DATABASE_PATH, utils._KEEP_DATABASE, utils._FLAGS)
+            utils._CURRENT_DATABASE = self.database
+            utils._DATABASE_PATH = self.path
+            utils._KEEP_DATABASE = True
+            utils._FLAGS = self.flags
+            try:
+                return command(args, _quiet)
+            except SystemExit as e:
+                utils._CURRENT_DATABASE.rollback()
+                raise _error(e) from None
+            except BaseException:
+                utils._CURRENT_DATABASE.rollback()
+                raise
+            finally:
+                #initdb reloads the database if another process modified it
+                self.database = utils._CURRENT_DATABASE
+                (utils._CURRENT_DATABASE, utils._DATABASE_PATH, utils._KEEP_DATABASE, utils._FLAGS) = state
+                for handle in kwargs.values():
+                    if hasattr(handle, 'close'):
+                        handle.close()
+
+    def _files(self, command, convert, **kwargs):
+        results = self._call(command, **kwargs)
+        return [
+            {
+                'path': result['path'],
+                'result': convert(result['result'], result['copy_strategy']) if result['error'] is None else None,
+                'error': result['error']
+            }
+            for result in results
+        ]
+
+    @contextmanager
+    def transaction(self):
+        #Defers saves until the block exits.  Changes are committed once, or
+        #discarded if the block raises an exception.  Nested transactions join the outer one.
+        #Data files released by deleted states are kept until the changes are committed,
+        #so a discarded transaction leaves every state readable.  Files copied into
+        #the database by discarded saves are removed, except for shared blobs,
+        #which are left for '$ quicksave clean -w'
+        if self.database.deferred:
+            yield self
+            return
+        self.database.deferred = True
+        try:
+            yield self
+        except BaseException:
+            self.database.rollback(True)
+            raise
+        finally:
+            self.database.deferred = False
+        if not self.database.flush():
+            raise DatabaseError("Unable to write the database index")
+
+    def register(self, filename, aliases=(), file_aliases=(), ignore_filepath=False, copy_strategy=None):
+        result = self._call(
+            commands.command_register,
+            filename=open(filename, 'rb'),
+            aliases=list(aliases),
+            file_alias=list(file_aliases),
+            ignore_filepath=ignore_filepath,
+            copy_strategy=copy_strategy,
+            files=None,
+            include=[],
+            exclude=[],
+            workers=None
+        )
+        return _registered(result, self.database.copy_strategy)
+
+    def register_files(self, paths, aliases=(), file_aliases=(), ignore_filepath=False, copy_strategy=None,
+                       include=(), exclude=(), workers=None):
+        #Registers every file named by paths (files, globs, or directories), and saves the index once.
+        #Returns a list of {path, result, error}, where result matches the result of register
+        return self._files(
+            commands.command_register,
+            _registered,
+            filename=None,
+            files=list(paths),
+            aliases=list(aliases),
+            file_alias=list(file_aliases),
+            ignore_filepath=ignore_filepath,
+            copy_strategy=copy_strategy,
+            include=list(include),
+            exclude=list(exclude),
+            workers=workers
+        )
+
+    def save(self, filename, file_key=None, aliases=(), force=False, allow_duplicate=False, no_cache=False, copy_strategy=None):
+        result = self._call(
+            commands.command_save,
+            filename=open(filename, 'rb'),
+            file_key=file_key,
+            aliases=list(aliases),
+            force=force,
+            allow_duplicate=allow_duplicate,
+            no_cache=no_cache,
+            copy_strategy=copy_strategy,
+            files=None,
+            include=[],
+            exclude=[],
+            workers=None
+        )
+        return _saved(result, self.database.copy_strategy)
+
+    def save_files(self, paths, file_key=None, aliases=(), force=False, allow_duplicate=False, no_cache=False,
+                   copy_strategy=None, include=(), exclude=(), workers=None):
+        #Saves every file named by paths (files, globs, or directories), and saves the index once.
+        #Returns a list of {path, result, error}, where result matches the result of save
+        return self._files(
+            commands.command_save,
+            _saved,
+            filename=None,
+            files=list(paths),
+            file_key=file_key,
+            aliases=list(aliases),
+            force=force,
+            allow_duplicate=allow_duplicate,
+            no_cache=no_cache,
+            copy_strategy=copy_strategy,
+            include=list(include),
+            exclude=list(exclude),
+            workers=workers
+        )
+
+    def revert(self, filename, state, file_key=None, stash=None, force=False, no_cache=False, copy_strategy=None):
+        #If stash is None, the 'revert.stash' setting is used
+        result = self._call(
+            commands.command_revert,
+            filename=open(filename, 'rb'),
+            state=state,
+            file_key=file_key,
+            stash=stash is True,
+            nstash=stash is False,
+            force=force,
+            no_cache=no_cache,
+            copy_strategy=copy_strategy
+        )
+        return {
+            'file_key': result[0],
+            'state_key': result[1],
+            'copy_strategy': self.database.copy_strategy
+        }
+
+    def status(self, filename, file_key=None, no_cache=False):
+        result = self._call(
+            commands.command_status,
+            filename=open(filename, 'rb'),
+            file_key=file_key,
+            no_cache=no_cache
+        )
+        return {
+            'file_key': result[0],
+            'state_key': result[1].replace(result[0]+':', '', 1) if result[1] else None
+        }
+
+    def list(self, file_key=None, aliases=False, target=None, long=False):
+        return self._call(
+            commands.command_list,
+            filekey=file_key,
+            aliases=aliases,
+            target=target,
+            long=long
+        )
+
+    def alias(self, link, target=None, file_key=None, delete=False):
+        #Creates (or deletes) the file alias <link>, or the state alias <link> if file_key is provided
+        if delete and file_key is not None:
+            (target, file_key) = (file_key, None) #the command expects the file key in place of the target
+        result = self._call(
+            commands.command_alias,
+            link=link,
+            target=target,
+            filekey=file_key,
+            d=delete
+        )
+        if delete:
+            return {
+                'alias': result[0],
+                'target': None,
+                'file_key': result[1] if len(result) > 1 else None
+            }
+        return {
+            'alias': result[0],
+            'target': result[1],
+            'file_key': result[2] if len(result) > 2 else None
+        }
+
+    def delete(self, target, file_key=None, trash=None, clean_aliases=False):
+        #If trash is None, the 'delete.trash' setting is used
+        self._call(
+            commands.command_delete,
+            target=target,
+            filekey=file_key,
+            save=trash is True,
+            nsave=trash is False,
+            clean_aliases=clean_aliases
+        )
+
+    def clean(self, trash=False, deduplicate=False, walk_database=False, aliases=False,
+              states=False, rebuild_file_index=False, journal=False, metadata=False, clean_all=False, workers=None, dry_run=False,
+              incremental=False, budget=None, max_bytes=None):
+        return self._call(
+            commands.command_clean,
+            trash=trash,
+            deduplicate=deduplicate,
+            walk_database=walk_database,
+            aliases=aliases,
+            states=states,
+            rebuild_file_index=rebuild_file_index,
+            journal=journal,
+            metadata=metadata,
+            clean_all=clean_all,
+            workers=workers,
+            dry_run=dry_run,
+            incremental=incremental,
+            budget=budget,
+            max_bytes=max_bytes
+        )
+
+    def layout(self, layout=None):
+        #If layout is None, the current layout is returned without changes
+        return self._call(
+            commands.command_layout,
+            layout=layout
+        )
+
+    def verify(self, file_key=None, states=(), fast=False, workers=None):
+        #Returns the report of unverified states and orphaned files.  If any states
+        #are missing or corrupted, VerificationError is raised with the report
+        return self._call(
+            commands.command_verify,
+            filekey=file_key,
+            states=list(states),
+            fast=fast,
+            output=None,
+            workers=workers
+        )
+
+    def repack(self, file_key=None, chain=None):
+        #If chain is None, the 'storage.delta' setting is used
+        return self._call(
+            commands.command_repack,
+            filekey=file_key,
+            chain=chain
+        )
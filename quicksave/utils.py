@@ -2,13 +2,24 @@ import os
 import csv
 import argparse
 import sys
+import time
+import itertools
 from hashlib import sha256
-from .qs_database import Database as db
+from .qs_database import Database as db, STAGING_PREFIX
+from . import qs_copy
+from .qs_errors import DatabaseFailure
 _SPECIAL_FILE = ['~trash', '~last']
 _SPECIAL_STATE = ['~stash', '~trash']
 _CURRENT_DATABASE = None
+_KEEP_DATABASE = False #if set, initdb reuses the loaded database while it is up to date
+_DATABASE_PATH = None #if set, overrides the database path from the global configuration
 _FLAGS = {}
 configfile = os.path.join(os.path.expanduser('~'), '.quicksave_config')
+daemonfile = os.path.join(os.path.expanduser('~'), '.quicksave_daemon')
+hashcachefile = os.path.join(os.path.expanduser('~'), '.quicksave_hashes')
+_CHUNK_SIZE = 1<<20
+_RACY_NS = 2*10**9 #files changed this recently are not cached, since a further edit might not change their stat
+_STAGING_IDS = itertools.count() #staging files of concurrent ingests must not collide
 
 def _fetch_db(do_print, init=True):
     if init:
@@ -56,33 +67,212 @@ def initdb(do_print):
     global _CURRENT_DATABASE
     database_path = ''
     msg = "No database loaded.  Please run '$ quicksave init' to create or load a database"
-    if os.path.isfile(configfile):
-        reader = open(configfile)
-        database_path = reader.readline().strip()
+    if _DATABASE_PATH is not None or os.path.isfile(configfile):
+        reader = None
+        if _DATABASE_PATH is not None:
+            #databases opened by path (Repository) keep the flags they were given,
+            #and do not read the global configuration
+            database_path = _DATABASE_PATH
+        else:
+            reader = open(configfile)
+            database_path = reader.readline().strip()
         if database_path != "<N/A>":
             try:
-                _CURRENT_DATABASE = db(database_path)
-                _loadflags(reader)
+                if (_KEEP_DATABASE and _CURRENT_DATABASE is not None and
+                        _CURRENT_DATABASE.base_dir == database_path and
+                        (_CURRENT_DATABASE.deferred or not _CURRENT_DATABASE.stale())):
+                    #reuse the database already loaded by this process,
+                    #but discard changes left behind by a failed command.
+                    #A database with deferred saves is kept even if another process modified it
+                    _CURRENT_DATABASE.rollback()
+                else:
+                    _CURRENT_DATABASE = db(database_path)
+                if reader is not None:
+                    _FLAGS.clear()
+                    _loadflags(reader)
             except FileNotFoundError:
                 do_print("Bad database path:", database_path)
                 msg = "Unable to open the database.  It may have been deleted, or the config file may have been manually edited. Run '$ quicksave init <databse path>' to resolve"
             except:
-                sys.exit("The database is corrupted.  Use '$ quicksave init <database path>' and initialize a new database")
+                raise DatabaseFailure("The database is corrupted.  Use '$ quicksave init <database path>' and initialize a new database")
     if not _CURRENT_DATABASE:
+        if _DATABASE_PATH is not None:
+            raise DatabaseFailure(msg)
         writer = open(configfile, mode='w')
         writer.write("<N/A>\n")
         writer.close()
-        sys.exit(msg)
+        raise DatabaseFailure(msg)
     return database_path
 
 def gethash(reader):
     hasher = sha256()
-    chunk = reader.read(4096)
+    chunk = reader.read(_CHUNK_SIZE)
     while len(chunk):
         hasher.update(chunk)
-        chunk = reader.read(4096)
+        chunk = reader.read(_CHUNK_SIZE)
     return hasher.hexdigest()
 
+def _stat_key(stat):
+    return [str(item) for item in (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns, stat.st_ctime_ns)]
+
+class _HashCache(dict):
+    #file path: [device, inode, size, mtime, ctime, digest].
+    #changed is set once a digest is recorded, so that unchanged caches are not rewritten
+    changed = False
+
+def _load_hash_cache():
+    cache = _HashCache()
+    if os.path.isfile(hashcachefile):
+        with open(hashcachefile, newline='') as reader:
+            for line in csv.reader(reader, delimiter='\t'):
+                if len(line) == 7:
+                    cache[line[0]] = line[1:]
+    return cache
+
+def _write_hash_cache(cache):
+    #Files which no longer exist are dropped
+    try:
+        with open(hashcachefile+'.tmp', mode='w', newline='') as writer:
+            csv.writer(writer, delimiter='\t', lineterminator='\n').writerows(
+                [path]+entry for (path, entry) in cache.items() if os.path.exists(path)
+            )
+        os.replace(hashcachefile+'.tmp', hashcachefile)
+        cache.changed = False
+    except OSError:
+        #the cache is optional
+        if os.path.isfile(hashcachefile+'.tmp'):
+            os.remove(hashcachefile+'.tmp')
+
+def lookup_hash(reader, cache=None):
+    #Returns the recorded digest of an open file if its device, inode, size,
+    #mtime, and ctime have not changed since it was hashed.  Otherwise returns None.
+    #If cache is provided, it is used instead of the cache file
+    entry = (_load_hash_cache() if cache is None else cache).get(os.path.abspath(reader.name))
+    if entry is not None and entry[:5] == _stat_key(os.fstat(reader.fileno())):
+        return entry[5]
+    return None
+
+def record_hash(reader, key, digest, cache=None):
+    #Records the digest of an open file, given its stat key from before it was read.
+    #If cache is provided, the digest is recorded there, and the caller must write it
+    stat = os.fstat(reader.fileno())
+    if _stat_key(stat) == key and time.time() - max(stat.st_mtime, stat.st_ctime) > _RACY_NS/1e9:
+        if cache is not None:
+            cache[os.path.abspath(reader.name)] = key+[digest]
+            cache.changed = True
+            return
+        cache = _load_hash_cache()
+        cache[os.path.abspath(reader.name)] = key+[digest]
+        cache.changed = True
+        _write_hash_cache(cache)
+
+def gethash_cached(reader, use_cache=True, cache=None):
+    #Hashes an open file, but reuses the recorded digest if the file has not changed
+    if not use_cache:
+        return gethash(reader)
+    digest = lookup_hash(reader, cache)
+    if digest is None:
+        key = _stat_key(os.fstat(reader.fileno()))
+        digest = gethash(reader)
+        record_hash(reader, key, digest, cache)
+    return digest
+
+def ingest(reader, folder, use_cache=True, cache=None):
+    #Copies an open file into a staging file in folder while hashing it, so that
+    #the file is only read once.  Returns (staging file, digest).
+    #The staging file should be passed to Database.register_sk, or removed
+    key = _stat_key(os.fstat(reader.fileno()))
+    staged = os.path.join(folder, '%s%d_%d' % (STAGING_PREFIX, os.getpid(), next(_STAGING_IDS)))
+    hasher = sha256()
+    try:
+        with open(staged, mode='wb') as writer:
+            chunk = reader.read(_CHUNK_SIZE)
+            while len(chunk):
+                hasher.update(chunk)
+                writer.write(chunk)
+                chunk = reader.read(_CHUNK_SIZE)
+    except BaseException:
+        if os.path.isfile(staged):
+            os.remove(staged)
+        raise
+    digest = hasher.hexdigest()
+    if use_cache:
+        record_hash(reader, key, digest, cache)
+    return (staged, digest)
+
+def storage_options(filekey, digest):
+    #The register_sk arguments which apply the storage settings to a new state
+    #of filekey.  'storage.compression.<file key>' overrides 'storage.compression'
+    filekey = _CURRENT_DATABASE.resolve_key(filekey, True)
+    codec = _checkflag('storage.compression.'+filekey, _checkflag('storage.compression', 'none'))
+    if codec == 'none':
+        codec = None
+    else:
+        from .qs_compress import CODECS
+        if codec not in CODECS:
+            sys.exit("Unknown compression codec (%s).  Must be one of: none, %s" % (codec, ', '.join(sorted(CODECS))))
+    return {
+        'digest': digest if _checkflag('storage.blobs', '0')=='1' else None,
+        'delta': int(_checkflag('storage.delta', '0')),
+        'compress': codec,
+        'chunks': chunk_size()
+    }
+
+def copy_strategy(override=None):
+    #The strategy used to copy files into and out of the database: the command's
+    #override, or the 'storage.copy' setting
+    strategy = override if override is not None else _checkflag('storage.copy', 'auto')
+    if strategy not in qs_copy.STRATEGIES:
+        sys.exit("Unknown copy strategy (%s).  Must be one of: %s" % (strategy, ', '.join(qs_copy.STRATEGIES)))
+    return strategy
+
+def worker_count(override=None, flag='clean.workers'):
+    #The number of threads used to read stored states: the command's
+    #override, or the given setting.  Defaults to the number of CPUs
+    workers = override if override is not None else _checkflag(flag, str(os.cpu_count() or 1))
+    try:
+        workers = int(workers)
+    except ValueError:
+        workers = 0
+    if workers < 1:
+        sys.exit("Invalid number of workers (%s).  Must be a positive integer" % workers)
+    return workers
+
+def chunk_size():
+    #files of at least this many bytes are stored as chunks.  0 if chunking is disabled
+    return int(_checkflag('storage.chunks', '0'))
+
+def ingest_chunks(reader, use_cache=True, cache=None):
+    #Stores the chunks of an open file while hashing it, so that the file is
+    #only read once.  Returns (manifest, digest).
+    #The manifest should be passed to Database.register_sk.  Chunks which end up
+    #unused are removed by '$ quicksave clean -w'
+    key = _stat_key(os.fstat(reader.fileno()))
+    hasher = sha256()
+    manifest = _CURRENT_DATABASE.store_chunks(reader, hasher)
+    digest = hasher.hexdigest()
+    if use_cache:
+        record_hash(reader, key, digest, cache)
+    return (manifest, digest)
+
+def prepare_file(reader, folder, strategy, use_cache=True, cache=None):
+    #Hashes an open file before it is stored.  Files which will be stored as chunks
+    #are chunked.  Other files are copied to a staging file in folder while they are
+    #hashed, unless they can be cloned.  Returns (digest, staging file, chunk manifest),
+    #which should be passed to Database.register_sk
+    digest = lookup_hash(reader, cache) if use_cache else None
+    staged = None
+    manifest = None
+    if digest is None and 0 < chunk_size() <= os.fstat(reader.fileno()).st_size:
+        (manifest, digest) = ingest_chunks(reader, use_cache, cache)
+    elif digest is None and strategy in ('auto', 'reflink') and qs_copy.reflink_supported(folder):
+        #hash the file first, so that it can be cloned without reading it again
+        digest = gethash_cached(reader, use_cache, cache)
+    elif digest is None:
+        #copy the file while hashing it, so that it is only read once
+        (staged, digest) = ingest(reader, folder, use_cache, cache)
+    return (digest, staged, manifest)
+
 def fetchstate(hashalias, filekey):
     if filekey+":"+hashalias in _CURRENT_DATABASE.state_keys:
         return _CURRENT_DATABASE.resolve_key(filekey+":"+hashalias, False)
@@ -58,6 +58,33 @@ class test(unittest.TestCase):
         compiled_path = compile(self.script_path)
         self.assertTrue(compiled_path)
 
+    def test_startup(self):
+        import subprocess
+
+        home = tempfile.TemporaryDirectory()
+        try:
+            process = subprocess.run(
+                [sys.executable, '-X', 'importtime', '-m', 'quicksave', 'show'],
+                cwd=os.path.dirname(os.path.dirname(self.script_path)),
+                env=dict(os.environ, HOME=home.name, QUICKSAVE_NO_DAEMON='1'),
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE
+            )
+        finally:
+            home.cleanup()
+        imports = {}
+        for line in process.stderr.decode().splitlines():
+            if line.startswith('import time:') and '|' in line:
+                (_, cumulative, module) = line[len('import time:'):].split('|')
+                if cumulative.strip().isdigit():
+                    imports[module.strip()] = int(cumulative)
+        self.assertIn('quicksave.utils', imports)
+        for module in ['zipfile', 'tarfile', 'tempfile', 'subprocess', 'socket', 'sqlite3']:
+            self.assertNotIn(module, imports)
+        self.assertListEqual([], [module for module in imports if module.startswith('quicksave.commands.')])
+        #cumulative import times are in microseconds
+        self.assertLess(sum(time for (module, time) in imports.items() if module.startswith('quicksave')), 2000000)
+
     def test_a_init(self):
         from quicksave.__main__ import main
 
@@ -775,7 +802,9 @@ class test(unittest.TestCase):
         register_result = main([
             '--return-result',
             'register',
-            writer.name
+            writer.name,
+            random_string(),
+            random_string()
         ])
         database = _fetch_db(_do_print)
         _statekey = register_result[0]+":"+register_result[2]
@@ -784,12 +813,15 @@ class test(unittest.TestCase):
         database.save()
         invalid_state_aliases = {key for key in database.state_keys if database.state_keys[key][0]==_statekey}
 
-        #finaly run the clean
-        result = main([
-            '--return-result',
-            'clean',
-            '-dtwras'
-        ])
+        #finaly run the clean.  The orphans were just created, so the grace period is disabled
+        from unittest import mock
+        from quicksave import qs_gc
+        with mock.patch.object(qs_gc, 'GRACE_PERIOD', 0):
+            result = main([
+                '--return-result',
+                'clean',
+                '-dtwras'
+            ])
 
         self.assertTrue("prune_folders" in result)
         self.assertEqual(len(result['prune_folders']), 2)
@@ -818,7 +850,7 @@ class test(unittest.TestCase):
         self.assertTrue(duplicate_state_key in result['deduplicate'])
 
         self.assertTrue('states' in result)
-        self.assertEqual(len(result['states']), 5)
+        self.assertEqual(len(result['states']), 1)
         self.assertFalse(set(result['states'])^orphan_states)
 
         self.assertTrue('file_aliases' in result)
@@ -1053,3 +1085,1167 @@ class test(unittest.TestCase):
                 'init',
                 self.db_directory.name
             ])
+    def test_n_daemon(self):
+        from quicksave import qs_daemon
+        from quicksave.qs_errors import KeyNotFound
+        import threading
+        import json
+
+        socket_path = os.path.join(self.test_directory.name, 'daemon')
+        self.assertIsNone(qs_daemon.forward(['--return-result', 'show'], socket_path))
+        served = []
+        server = threading.Thread(target=lambda: served.append(qs_daemon.serve(socket_path)))
+        server.start()
+        while not os.path.exists(socket_path):
+            server.join(0.01)
+        try:
+            response = qs_daemon.forward(['--return-result', 'show'], socket_path)
+            self.assertEqual(0, response['code'])
+            self.assertEqual(self.db_directory.name, response['result'])
+            response = qs_daemon.forward(['lookup', DATA['register-filekey']], socket_path)
+            self.assertEqual(0, response['code'])
+            self.assertIn(DATA['register-filekey']+' -->', response['stdout'])
+            #errors are raised by the client with their original class
+            response = qs_daemon.forward(['--return-result', 'lookup', 'Probably not a real key though'], socket_path)
+            self.assertEqual(1, response['code'])
+            self.assertIsInstance(qs_daemon.error(response), KeyNotFound)
+            self.assertIn('Unable to lookup', str(qs_daemon.error(response)))
+            response = qs_daemon.request({
+                'args': ['--return-result', 'status', os.path.basename(DATA['register-sourcefile']), '-k', DATA['register-filekey']],
+                'cwd': os.path.dirname(DATA['register-sourcefile'])
+            }, socket_path)
+            self.assertEqual(0, response['code'])
+            self.assertEqual(DATA['register-filekey'], response['result'][0])
+            #results have the same types as in the client's process
+            result = {'set': {('a', 1)}, ('tuple', 2): ['list', (3,)], 'nested': {'__set__': []}}
+            self.assertEqual(result, json.loads(json.dumps(qs_daemon._pack(result)), object_hook=qs_daemon._unpack))
+        finally:
+            qs_daemon.request({'stop': True}, socket_path)
+            server.join()
+        self.assertListEqual([4], served)
+        self.assertFalse(os.path.exists(socket_path))
+        self.assertNotIn('QUICKSAVE_NO_DAEMON', os.environ)
+        #a setting made before the daemon started is kept
+        os.environ['QUICKSAVE_NO_DAEMON'] = '1'
+        try:
+            server = threading.Thread(target=lambda: served.append(qs_daemon.serve(socket_path)))
+            server.start()
+            while not os.path.exists(socket_path):
+                server.join(0.01)
+            qs_daemon.request({'stop': True}, socket_path)
+            server.join()
+            self.assertEqual('1', os.environ['QUICKSAVE_NO_DAEMON'])
+        finally:
+            del os.environ['QUICKSAVE_NO_DAEMON']
+    def test_o_batch(self):
+        from quicksave.__main__ import main
+        from quicksave.qs_database import Database
+        import json
+
+        sources = []
+        for _ in range(3):
+            sourcefile = open(os.path.join(self.test_directory.name, random_string(90)), 'w+b')
+            sourcefile.write(os.urandom(1024))
+            sourcefile.close()
+            sources.append(sourcefile.name)
+        batchfile = os.path.join(self.test_directory.name, 'batch.txt')
+        with open(batchfile, 'w') as writer:
+            writer.write('# registers two files\n')
+            writer.write('register "%s" -a __batch_alias__\n' % sources[0])
+            writer.write('\n')
+            writer.write(json.dumps(['register', sources[1]])+'\n')
+            writer.write('lookup "Probably not a real key though"\n')
+            writer.write('register "%s" ~stash\n' % sources[2]) #fails after registering the file key
+            writer.write('quicksave alias __batch_alias_2__ __batch_alias__\n')
+        with self.assertRaises(SystemExit):
+            main(['batch', batchfile])
+        database = Database(self.db_directory.name)
+        self.assertIn('__batch_alias__', database.file_keys)
+        self.assertIn('__batch_alias_2__', database.file_keys)
+        self.assertIn(sources[1], database.file_keys)
+        self.assertNotIn(sources[2], database.file_keys)
+        self.assertNotIn(os.path.basename(sources[2]), database.file_keys)
+
+        with open(batchfile, 'w') as writer:
+            writer.write('register "%s"\n' % sources[2])
+            writer.write('alias __batch_alias_5__ __batch_alias_2__\n')
+        results = main(['--return-result', 'batch', batchfile, '-c', '1'])
+        self.assertListEqual([0, 0], [result['code'] for result in results])
+        self.assertEqual(results[0]['result'][0], Database(self.db_directory.name).resolve_key(sources[2], True))
+
+        from quicksave import qs_batch
+        with open(batchfile, 'w') as writer:
+            writer.write('alias __batch_alias_3__ __batch_alias__\n')
+            writer.write('delete %s --save\n' % database.resolve_key(sources[1], True))
+            writer.write('lookup "Probably not a real key though"\n')
+            writer.write('alias __batch_alias_4__ __batch_alias__\n')
+        with open(batchfile) as reader:
+            results = qs_batch.run_batch(reader, atomic=True, do_print=_do_print)
+        self.assertListEqual([0, 0, 1], [result['code'] for result in results])
+        self.assertEqual(3, results[-1]['line'])
+        database = Database(self.db_directory.name)
+        self.assertIn(sources[1], database.file_keys)
+        self.assertNotIn('__batch_alias_3__', database.file_keys)
+        self.assertNotIn('__batch_alias_4__', database.file_keys)
+        with self.assertRaises(SystemExit):
+            main(['batch', batchfile, '--atomic', '-c', '2'])
+
+class test_database(unittest.TestCase):
+    def setUp(self):
+        self.db_directory = tempfile.TemporaryDirectory()
+        self.test_directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.db_directory.cleanup()
+        self.test_directory.cleanup()
+
+    def make_file(self):
+        sourcefile = open(os.path.join(self.test_directory.name, random_string(90)), 'w+b')
+        sourcefile.write(os.urandom(4096))
+        sourcefile.close()
+        return sourcefile.name
+
+    def test_journal(self):
+        from quicksave.qs_database import Database
+
+        database = Database(self.db_directory.name)
+        for _ in range(10):
+            sourcefile = self.make_file()
+            (filekey, _) = database.register_fk(sourcefile)
+            database.register_fa(filekey, sourcefile)
+            (statekey, _) = database.register_sk(filekey, sourcefile)
+            database.register_sa(filekey, statekey, random_string())
+        database.flags['test.flag'] = '1'
+        database.save(checkpoint=True)
+        checkpoint = os.path.join(self.db_directory.name, '.db_config')
+        journal = os.path.join(self.db_directory.name, '.db_journal')
+        self.assertFalse(os.path.isfile(journal))
+        checkpoint_stat = os.stat(checkpoint)
+
+        #small changes are appended to the journal
+        database.file_keys[filekey][2] = 'fish'
+        del database.state_keys[filekey+":"+statekey]
+        del database.flags['test.flag']
+        database.register_fa(filekey, 'new alias')
+        database.save()
+        self.assertTrue(os.path.isfile(journal))
+        self.assertEqual(os.stat(checkpoint).st_mtime_ns, checkpoint_stat.st_mtime_ns)
+        self.assertLess(os.path.getsize(journal), checkpoint_stat.st_size)
+
+        reloaded = Database(self.db_directory.name)
+        self.assertSetEqual(set(database.file_keys), set(reloaded.file_keys))
+        self.assertSetEqual(reloaded.file_keys[filekey][2], set('fish'))
+        self.assertNotIn(filekey+":"+statekey, reloaded.state_keys)
+        self.assertDictEqual(database.state_keys, reloaded.state_keys)
+        self.assertDictEqual({}, reloaded.flags)
+        self.assertSetEqual(database.data_folders, reloaded.data_folders)
+
+        #a torn write at the end of the journal is discarded
+        writer = open(journal, 'a')
+        writer.write('DF\t%s\n' % filekey)
+        writer.close()
+        reloaded = Database(self.db_directory.name)
+        self.assertIn(filekey, reloaded.file_keys)
+        reloaded.save()
+        self.assertFalse(os.path.isfile(journal))
+        self.assertDictEqual(database.state_keys, Database(self.db_directory.name).state_keys)
+
+    def test_state_index(self):
+        from quicksave.qs_database import Database
+
+        database = Database(self.db_directory.name)
+        sourcefile = self.make_file()
+        (filekey, _) = database.register_fk(sourcefile)
+        (otherkey, _) = database.register_fk(self.make_file())
+        states = set()
+        for _ in range(5):
+            (statekey, _) = database.register_sk(filekey, sourcefile)
+            database.register_sa(filekey, statekey, statekey+'_alias')
+            states |= {filekey+':'+statekey, filekey+':'+statekey+'_alias'}
+        database.register_sk(otherkey, sourcefile)
+        self.assertSetEqual(states, set(database.list_sk(filekey)))
+        self.assertEqual(5, len(database.list_sk(filekey, False)))
+
+        del database.state_keys[filekey+':'+statekey+'_alias']
+        states.remove(filekey+':'+statekey+'_alias')
+        moved = database.state_keys.pop(filekey+':'+statekey)
+        database.state_keys[otherkey+':'+statekey] = [moved[0], otherkey, moved[2]]
+        states.remove(filekey+':'+statekey)
+        self.assertSetEqual(states, set(database.list_sk(filekey)))
+        self.assertIn(otherkey+':'+statekey, database.list_sk(otherkey))
+        database.save()
+
+        reloaded = Database(self.db_directory.name)
+        self.assertSetEqual(states, set(reloaded.list_sk(filekey)))
+        self.assertSetEqual(set(database.list_sk(otherkey)), set(reloaded.list_sk(otherkey)))
+        del reloaded.file_keys[otherkey]
+        self.assertSetEqual({filekey, otherkey}, set(reloaded.state_owners()))
+
+    def test_alias_graph(self):
+        from quicksave.qs_database import Database
+
+        database = Database(self.db_directory.name)
+        sourcefile = self.make_file()
+        (filekey, _) = database.register_fk(sourcefile)
+        (statekey, _) = database.register_sk(filekey, sourcefile)
+        chain = ['first', 'second', 'third']
+        database.register_fa(filekey, chain[0])
+        database.register_sa(filekey, statekey, chain[0])
+        for i in range(1, len(chain)):
+            database.file_keys[chain[i]] = [chain[i-1], None, None]
+            database.state_keys[filekey+':'+chain[i]] = [filekey+':'+chain[i-1], filekey, None]
+        self.assertListEqual([chain[0]], database.list_fa(filekey))
+        self.assertListEqual(chain, database.list_fa(filekey, True))
+        self.assertListEqual(
+            [filekey+':'+alias for alias in chain],
+            database.list_sa(filekey+':'+statekey, True)
+        )
+        self.assertListEqual([], database.missing_targets(True))
+        database.save()
+
+        reloaded = Database(self.db_directory.name)
+        self.assertListEqual(chain, reloaded.list_fa(filekey, True))
+        reloaded.file_keys[chain[1]] = [filekey, None, None]
+        self.assertSetEqual({chain[0], chain[1]}, set(reloaded.list_fa(filekey)))
+        del reloaded.file_keys[filekey]
+        del reloaded.state_keys[filekey+':'+statekey]
+        self.assertListEqual([filekey], reloaded.missing_targets(True))
+        self.assertListEqual([filekey+':'+statekey], reloaded.missing_targets(False))
+        self.assertListEqual(
+            [filekey+':'+alias for alias in chain],
+            reloaded.list_sa(filekey+':'+statekey, True)
+        )
+
+    def test_engines(self):
+        from quicksave.qs_database import Database
+
+        database = Database(self.db_directory.name)
+        sourcefile = self.make_file()
+        (filekey, _) = database.register_fk(sourcefile)
+        database.register_fa(filekey, sourcefile)
+        for _ in range(5):
+            (statekey, _) = database.register_sk(filekey, sourcefile)
+            database.register_sa(filekey, statekey, random_string())
+        database.flags['test.flag'] = '1'
+        database.save()
+        self.assertEqual('text', database.engine.name)
+
+        self.assertTrue(database.migrate('sqlite'))
+        self.assertFalse(database.migrate('sqlite'))
+        self.assertFalse(os.path.isfile(os.path.join(self.db_directory.name, '.db_config')))
+        reloaded = Database(self.db_directory.name)
+        self.assertEqual('sqlite', reloaded.engine.name)
+        self.assertDictEqual(database.file_keys, reloaded.file_keys)
+        self.assertDictEqual(database.state_keys, reloaded.state_keys)
+        self.assertDictEqual(database.flags, reloaded.flags)
+
+        #incremental changes
+        (newkey, _) = reloaded.register_sk(filekey, sourcefile)
+        reloaded.register_sa(filekey, newkey, 'new alias')
+        del reloaded.state_keys[filekey+':'+statekey]
+        reloaded.file_keys[filekey][2].remove(database.state_keys[filekey+':'+statekey][2])
+        del reloaded.flags['test.flag']
+        reloaded.save(checkpoint=True)
+        reloaded.engine.close()
+        database = Database(self.db_directory.name)
+        self.assertDictEqual(database.file_keys, reloaded.file_keys)
+        self.assertDictEqual(database.state_keys, reloaded.state_keys)
+        self.assertDictEqual({}, database.flags)
+
+        self.assertTrue(database.migrate('text'))
+        self.assertFalse(os.path.isfile(os.path.join(self.db_directory.name, '.db_sqlite')))
+        reloaded = Database(self.db_directory.name)
+        self.assertEqual('text', reloaded.engine.name)
+        self.assertDictEqual(database.file_keys, reloaded.file_keys)
+        self.assertDictEqual(database.state_keys, reloaded.state_keys)
+
+    def test_snapshot_cache(self):
+        from quicksave.qs_database import Database
+
+        database = Database(self.db_directory.name)
+        sourcefile = self.make_file()
+        (filekey, _) = database.register_fk(sourcefile)
+        for _ in range(5):
+            (statekey, _) = database.register_sk(filekey, sourcefile)
+            database.register_sa(filekey, statekey, random_string())
+        database.save(checkpoint=True)
+        checkpoint = os.path.join(self.db_directory.name, '.db_config')
+        cache = os.path.join(self.db_directory.name, '.db_cache')
+        self.assertFalse(os.path.isfile(cache))
+        reloaded = Database(self.db_directory.name)
+        self.assertTrue(os.path.isfile(cache))
+        self.assertDictEqual(database.state_keys, reloaded.state_keys)
+
+        #the journal is replayed over the cached checkpoint
+        database.register_sa(filekey, statekey, 'journaled alias')
+        database.save()
+        reloaded = Database(self.db_directory.name)
+        self.assertDictEqual(database.state_keys, reloaded.state_keys)
+        self.assertListEqual(database.list_sk(filekey), reloaded.list_sk(filekey))
+
+        #a valid cache skips parsing the checkpoint entirely
+        stat = os.stat(checkpoint)
+        with open(checkpoint, 'r+b') as writer:
+            writer.seek(len('<QUICKSAVE DB>\nFK'))
+            writer.write(b'?')
+        os.utime(checkpoint, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        reloaded = Database(self.db_directory.name)
+        self.assertDictEqual(database.state_keys, reloaded.state_keys)
+        os.utime(checkpoint, ns=(stat.st_atime_ns, stat.st_mtime_ns+10**9))
+        with self.assertRaises(ValueError):
+            Database(self.db_directory.name)
+
+    def test_repository(self):
+        import quicksave
+        from quicksave.qs_database import Database
+
+        repository = quicksave.Repository(os.path.join(self.db_directory.name, 'repository'))
+        sourcefile = self.make_file()
+        result = repository.register(sourcefile, ['first'], ['__repository_alias__'])
+        filekey = result['file_key']
+        self.assertIn('__repository_alias__', result['file_aliases'])
+        self.assertDictEqual({'file_key': filekey, 'state_key': result['state_key']}, repository.status(sourcefile))
+        with self.assertRaises(quicksave.KeyConflictError):
+            repository.save(sourcefile)
+        with self.assertRaises(quicksave.KeyNotFoundError):
+            repository.list('Probably not a real key though')
+        with self.assertRaises(quicksave.ReservedKeyError):
+            repository.alias('~trash', filekey)
+        self.assertEqual(filekey, repository.alias('__repository_alias_2__', '__repository_alias__')['target'])
+
+        with open(sourcefile, 'ab') as writer:
+            writer.write(b'second')
+        with repository.transaction():
+            state = repository.save(sourcefile, aliases=['second'])['state_key']
+            with self.assertRaises(quicksave.KeyNotFoundError):
+                repository.save(sourcefile, 'Probably not a real key though')
+            repository.alias('third', 'second', filekey)
+            self.assertNotIn(filekey+':'+state, Database(repository.path).state_keys)
+        reloaded = Database(repository.path)
+        self.assertIn(filekey+':'+state, reloaded.state_keys)
+        self.assertEqual(filekey+':'+state, reloaded.resolve_key(filekey+':third', False))
+
+        with self.assertRaises(RuntimeError):
+            with repository.transaction():
+                repository.alias('fourth', 'first', filekey)
+                repository.alias('fourth', delete=True, file_key=filekey)
+                repository.delete(state, filekey)
+                self.assertNotIn(filekey+':third', repository.database.state_keys)
+                raise RuntimeError()
+        self.assertIn(filekey+':third', repository.database.state_keys)
+        self.assertDictEqual(repository.database.state_keys, Database(repository.path).state_keys)
+        self.assertListEqual([result['state_key'], state], repository.list(filekey))
+        #a discarded delete keeps the state's data
+        with self.assertRaises(RuntimeError):
+            with repository.transaction():
+                repository.delete(state, filekey, trash=False)
+                raise RuntimeError()
+        repository.revert(sourcefile, 'first', filekey, stash=False, force=True)
+        repository.revert(sourcefile, state, filekey, stash=False)
+        with open(sourcefile, 'rb') as reader:
+            self.assertTrue(reader.read().endswith(b'second'))
+
+        #separate repositories can be used from different threads
+        from concurrent.futures import ThreadPoolExecutor
+        others = [quicksave.Repository(os.path.join(self.db_directory.name, name)) for name in ('thread_a', 'thread_b')]
+        sources = [[self.make_file() for _ in range(5)] for _ in others]
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            registered = list(pool.map(
+                lambda pair: [pair[0].register(path)['file_key'] for path in pair[1]],
+                zip(others, sources)
+            ))
+        for (other, keys) in zip(others, registered):
+            reloaded = Database(other.path)
+            self.assertSetEqual(set(keys), {key for key in reloaded.file_keys if not reloaded.file_keys[key][0]})
+
+        #flags are taken from the Repository instead of the global configuration
+        blobs = quicksave.Repository(os.path.join(self.db_directory.name, 'blobs'), flags={'storage.blobs': '1'})
+        filekey = blobs.register(self.make_file())['file_key']
+        data_files = [
+            entry[2] for (key, entry) in blobs.database.state_keys.items()
+            if key.startswith(filekey+':') and entry[2] is not None
+        ]
+        self.assertEqual(1, len(data_files))
+        self.assertTrue(data_files[0].startswith('@'))
+        self.assertDictEqual({}, repository.flags)
+
+    def test_hash_cache(self):
+        from quicksave import utils
+
+        (hashcachefile, racy) = (utils.hashcachefile, utils._RACY_NS)
+        utils.hashcachefile = os.path.join(self.test_directory.name, 'hashes')
+        try:
+            sourcefile = self.make_file()
+            digest = hashfile(sourcefile)
+            with open(sourcefile, 'rb') as reader:
+                self.assertEqual(digest, utils.gethash_cached(reader))
+            #the file was just written, so its stat may not change after another edit
+            self.assertDictEqual({}, utils._load_hash_cache())
+
+            utils._RACY_NS = 0
+            with open(sourcefile, 'rb') as reader:
+                self.assertEqual(digest, utils.gethash_cached(reader))
+            cache = utils._load_hash_cache()
+            self.assertEqual(digest, cache[sourcefile][5])
+            cache[sourcefile][5] = 'cached digest'
+            utils._write_hash_cache(cache)
+            with open(sourcefile, 'rb') as reader:
+                self.assertEqual('cached digest', utils.gethash_cached(reader))
+            with open(sourcefile, 'rb') as reader:
+                self.assertEqual(digest, utils.gethash_cached(reader, False))
+
+            with open(sourcefile, 'ab') as writer:
+                writer.write(b'modified')
+            with open(sourcefile, 'rb') as reader:
+                self.assertEqual(hashfile(sourcefile), utils.gethash_cached(reader))
+            self.assertEqual(hashfile(sourcefile), utils._load_hash_cache()[sourcefile][5])
+
+            #files which no longer exist are dropped when the cache is written
+            removed = self.make_file()
+            with open(removed, 'rb') as reader:
+                utils.gethash_cached(reader)
+            self.assertIn(removed, utils._load_hash_cache())
+            os.remove(removed)
+            utils._write_hash_cache(utils._load_hash_cache())
+            self.assertListEqual([sourcefile], list(utils._load_hash_cache()))
+            #a cache which is passed in is only written by the caller
+            cache = utils._load_hash_cache()
+            with open(self.make_file(), 'rb') as reader:
+                utils.gethash_cached(reader, cache=cache)
+            self.assertTrue(cache.changed)
+            self.assertEqual(1, len(utils._load_hash_cache()))
+            utils._write_hash_cache(cache)
+            self.assertEqual(2, len(utils._load_hash_cache()))
+        finally:
+            (utils.hashcachefile, utils._RACY_NS) = (hashcachefile, racy)
+
+    def test_ingest(self):
+        import quicksave
+        from filecmp import cmp
+
+        repository = quicksave.Repository(os.path.join(self.db_directory.name, 'repository'))
+        sourcefile = self.make_file()
+        filekey = repository.register(sourcefile)['file_key']
+        folder = repository.database.file_keys[filekey][1]
+        self.assertEqual(1, len(os.listdir(folder)))
+        with self.assertRaises(quicksave.KeyConflictError):
+            repository.save(sourcefile, no_cache=True)
+        #the copy made while hashing a duplicate is discarded
+        self.assertEqual(1, len(os.listdir(folder)))
+        with open(sourcefile, 'ab') as writer:
+            writer.write(os.urandom(3 << 20))
+        statekey = repository.save(sourcefile, no_cache=True)['state_key']
+        datafile = repository.database.state_keys[filekey+':'+statekey][2]
+        self.assertListEqual(sorted(repository.database.file_keys[filekey][2]), sorted(os.listdir(folder)))
+        self.assertTrue(cmp(sourcefile, os.path.join(folder, datafile), False))
+        self.assertEqual(
+            filekey+':'+statekey,
+            repository.database.resolve_key(filekey+':'+hashfile(sourcefile), False)
+        )
+
+    def test_blobs(self):
+        import quicksave
+        from filecmp import cmp
+
+        repository = quicksave.Repository(os.path.join(self.db_directory.name, 'repository'))
+        repository.database.flags['storage.blobs'] = '1'
+        repository.database.save()
+        sourcefile = self.make_file()
+        duplicate = os.path.join(self.test_directory.name, random_string(90))
+        copyfile(sourcefile, duplicate)
+        first = repository.register(sourcefile)
+        second = repository.register(duplicate)
+        database = repository.database
+        blob = database.state_keys[first['file_key']+':'+first['state_key']][2]
+        self.assertTrue(blob.startswith(quicksave.qs_database.BLOB_PREFIX))
+        self.assertEqual(blob, database.state_keys[second['file_key']+':'+second['state_key']][2])
+        self.assertEqual(2, database.blob_refs(blob))
+        blobfile = database.data_path(None, blob)
+        self.assertTrue(cmp(sourcefile, blobfile, False))
+        #neither file key folder stores a copy
+        self.assertListEqual([], os.listdir(database.file_keys[first['file_key']][1]))
+        self.assertListEqual([], os.listdir(database.file_keys[second['file_key']][1]))
+        with open(sourcefile, 'ab') as writer:
+            writer.write(os.urandom(16))
+        repository.revert(sourcefile, first['state_key'], stash=False)
+        self.assertTrue(cmp(duplicate, sourcefile, False))
+        repository.delete(first['state_key'], first['file_key'], trash=False)
+        self.assertEqual(1, database.blob_refs(blob))
+        self.assertTrue(os.path.isfile(blobfile))
+        repository.clean(walk_database=True)
+        self.assertTrue(os.path.isfile(blobfile))
+        repository.delete(second['state_key'], second['file_key'], trash=False)
+        self.assertEqual(0, repository.database.blob_refs(blob))
+        self.assertFalse(os.path.isfile(blobfile))
+
+    def test_delta(self):
+        import quicksave
+
+        repository = quicksave.Repository(os.path.join(self.db_directory.name, 'repository'))
+        repository.database.flags['storage.delta'] = '3'
+        repository.database.save()
+        sourcefile = self.make_file()
+        with open(sourcefile, 'rb') as reader:
+            data = reader.read()
+        states = {}
+        filekey = repository.register(sourcefile)['file_key']
+        states[repository.status(sourcefile)['state_key']] = data
+        for i in range(5):
+            offset = random.randint(0, len(data))
+            data = data[:offset]+os.urandom(16)+data[offset+8:]
+            with open(sourcefile, 'wb') as writer:
+                writer.write(data)
+            states[repository.save(sourcefile)['state_key']] = data
+        database = repository.database
+        datafiles = [database.state_keys[filekey+':'+state][2] for state in states]
+        #a full copy is stored every 4 states
+        self.assertListEqual(
+            [False, True, True, True, False, True],
+            [datafile.startswith(quicksave.qs_database.DELTA_PREFIX) for datafile in datafiles]
+        )
+        self.assertLess(
+            os.path.getsize(database.data_path(filekey, datafiles[1])),
+            len(data)//4
+        )
+        #removing the base of a delta rebases the states stored against it
+        deleted = list(states)[2]
+        repository.delete(deleted, filekey, trash=False)
+        del states[deleted]
+        for (state, contents) in states.items():
+            repository.revert(sourcefile, state, stash=False, force=True)
+            with open(sourcefile, 'rb') as reader:
+                self.assertEqual(contents, reader.read())
+        result = repository.repack(filekey, 0)
+        self.assertGreater(result[filekey][1], result[filekey][0])
+        folder = database.file_keys[filekey][1]
+        self.assertListEqual(sorted(database.file_keys[filekey][2]), sorted(os.listdir(folder)))
+        for (state, contents) in states.items():
+            datafile = database.state_keys[filekey+':'+state][2]
+            self.assertFalse(datafile.startswith(quicksave.qs_database.DELTA_PREFIX))
+            with open(os.path.join(folder, datafile), 'rb') as reader:
+                self.assertEqual(contents, reader.read())
+        repository.repack(filekey, 2)
+        self.assertListEqual(sorted(database.file_keys[filekey][2]), sorted(os.listdir(folder)))
+        self.assertEqual(
+            [False, True, True, False, True],
+            [database.state_keys[filekey+':'+state][2].startswith(quicksave.qs_database.DELTA_PREFIX) for state in states]
+        )
+        for (state, contents) in states.items():
+            self.assertEqual(contents, database.read_data(filekey, database.state_keys[filekey+':'+state][2]))
+        #runs moved to any offset are copied, and unrelated data is rejected
+        from quicksave import qs_delta
+        base = os.urandom(1 << 18)
+        moved = base[1001:50000]+os.urandom(300)+base[:1001]+base[50000:]
+        ops = qs_delta.encode(base, moved, len(moved)//2)
+        self.assertEqual(moved, qs_delta.decode(base, ops))
+        self.assertLess(len(ops), 2048)
+        self.assertIsNone(qs_delta.encode(base, os.urandom(1 << 18), 1 << 17))
+
+    def test_compression(self):
+        import quicksave
+
+        repository = quicksave.Repository(os.path.join(self.db_directory.name, 'repository'))
+        database = repository.database
+        database.flags['storage.compression'] = 'zlib'
+        database.save()
+        textfile = os.path.join(self.test_directory.name, random_string(90))
+        text = ''.join(random_string()+'\n' for i in range(64)).encode()*64
+        with open(textfile, 'wb') as writer:
+            writer.write(text)
+        randomfile = self.make_file()
+        text_state = repository.register(textfile)
+        random_state = repository.register(randomfile)
+        datafile = database.state_keys[text_state['file_key']+':'+text_state['state_key']][2]
+        self.assertTrue(datafile.startswith(quicksave.qs_database.COMPRESSED_PREFIX))
+        self.assertLess(os.path.getsize(database.data_path(text_state['file_key'], datafile)), len(text)//5)
+        #incompressible files are stored as they are
+        self.assertFalse(database.state_keys[random_state['file_key']+':'+random_state['state_key']][2].startswith(
+            quicksave.qs_database.COMPRESSED_PREFIX
+        ))
+        #the policy can be set for each file key
+        database.flags['storage.compression.'+text_state['file_key']] = 'lzma'
+        database.save()
+        with open(textfile, 'ab') as writer:
+            writer.write(b'more text\n')
+        state = repository.save(textfile)['state_key']
+        datafile = database.state_keys[text_state['file_key']+':'+state][2]
+        self.assertEqual('lzma', database._codec(text_state['file_key'], datafile))
+        repository.revert(textfile, text_state['state_key'], stash=False)
+        with open(textfile, 'rb') as reader:
+            self.assertEqual(text, reader.read())
+        self.assertEqual(text_state['state_key'], repository.status(textfile)['state_key'])
+        repository.save(textfile, allow_duplicate=True)
+        result = repository.clean(deduplicate=True)
+        self.assertEqual(1, len(result['deduplicate']))
+        database.flags['storage.compression'] = 'none'
+        del database.flags['storage.compression.'+text_state['file_key']]
+        database.save()
+        repository.repack(text_state['file_key'], 0)
+        for key in database.list_sk(text_state['file_key'], False):
+            self.assertFalse(database.state_keys[key][2].startswith(quicksave.qs_database.COMPRESSED_PREFIX))
+
+    def test_chunks(self):
+        import quicksave
+        from quicksave import qs_gc
+        from unittest import mock
+
+        repository = quicksave.Repository(os.path.join(self.db_directory.name, 'repository'))
+        database = repository.database
+        database.flags['storage.chunks'] = '1'
+        database.save()
+        sourcefile = self.make_file()
+        original = os.urandom(2 << 20)
+        with open(sourcefile, 'wb') as writer:
+            writer.write(original)
+        first = repository.register(sourcefile)
+        filekey = first['file_key']
+        edited = original[:1 << 20]+os.urandom(100)+original[1 << 20:]
+        with open(sourcefile, 'wb') as writer:
+            writer.write(edited)
+        second = repository.save(sourcefile)['state_key']
+        manifests = [
+            database.read_manifest(filekey, database.state_keys[filekey+':'+state][2])
+            for state in (first['state_key'], second)
+        ]
+        self.assertTrue(all(database.state_keys[filekey+':'+state][2].startswith(quicksave.qs_database.CHUNKED_PREFIX)
+                            for state in (first['state_key'], second)))
+        #only the chunks around the edit are stored again
+        self.assertLessEqual(len({chunk for manifest in manifests for chunk in manifest}), len(manifests[0])+2)
+        repository.revert(sourcefile, first['state_key'], stash=False)
+        with open(sourcefile, 'rb') as reader:
+            self.assertEqual(original, reader.read())
+        self.assertEqual(first['state_key'], repository.status(sourcefile)['state_key'])
+        repository.delete(first['state_key'], filekey, trash=False)
+        with mock.patch.object(qs_gc, 'GRACE_PERIOD', 0):
+            result = repository.clean(walk_database=True)
+        self.assertGreater(result['prune_chunks'], 0)
+        self.assertEqual(
+            sorted(digest for (digest, size) in manifests[1]),
+            sorted(
+                name for folder in os.listdir(database.chunk_dir)
+                for name in os.listdir(os.path.join(database.chunk_dir, folder))
+            )
+        )
+        repository.revert(sourcefile, second, stash=False)
+        with open(sourcefile, 'rb') as reader:
+            self.assertEqual(edited, reader.read())
+
+        #boundaries do not depend on any particular byte value, so binary data
+        #without newlines is not split into fixed size chunks
+        import io
+        from quicksave import qs_chunks
+        binary = os.urandom(2 << 20).replace(b'\n', b'\0')
+        inserted = binary
+        for offset in sorted(random.sample(range(len(binary)), 3), reverse=True):
+            inserted = inserted[:offset]+os.urandom(random.randint(1, 100)).replace(b'\n', b'\0')+inserted[offset:]
+        (before, after) = (list(qs_chunks.split(io.BytesIO(data))) for data in (binary, inserted))
+        self.assertEqual(inserted, b''.join(after))
+        self.assertGreater(len({len(chunk) for chunk in before}), 1)
+        #each insert changes at most two chunks
+        self.assertGreaterEqual(len(set(before) & set(after)), len(after)-6)
+
+    def test_copy_strategy(self):
+        import quicksave
+        from quicksave import qs_copy
+
+        sourcefile = self.make_file()
+        copied = os.path.join(self.test_directory.name, random_string(90))
+        self.assertEqual('copy', qs_copy.copy(sourcefile, copied, 'copy'))
+        self.assertTrue(cmp(sourcefile, copied, False))
+        os.remove(copied)
+        self.assertIn(qs_copy.copy(sourcefile, copied), ('reflink', 'copy_file_range', 'copy'))
+        self.assertTrue(cmp(sourcefile, copied, False))
+        from unittest import mock
+        #a copy_file_range which stops early falls back to a plain copy
+        calls = []
+        def short_copy(source, destination, count, offset_src, offset_dst):
+            calls.append(count)
+            if len(calls) > 1:
+                return 0
+            return os.pwrite(destination, os.pread(source, 100, offset_src), offset_dst)
+        os.remove(copied)
+        with mock.patch('os.copy_file_range', short_copy, create=True):
+            self.assertEqual('copy', qs_copy.copy(sourcefile, copied, 'copy_file_range'))
+        self.assertEqual(2, len(calls))
+        self.assertTrue(cmp(sourcefile, copied, False))
+        repository = quicksave.Repository(os.path.join(self.db_directory.name, 'repository'))
+        database = repository.database
+        first = repository.register(sourcefile, copy_strategy='copy')
+        self.assertEqual('copy', first['copy_strategy'])
+        filekey = first['file_key']
+        database.flags['storage.copy'] = 'copy_file_range'
+        database.save()
+        with open(sourcefile, 'ab') as writer:
+            writer.write(os.urandom(1 << 16))
+        second = repository.save(sourcefile)
+        self.assertIn(second['copy_strategy'], ('copy_file_range', 'copy'))
+        storedfile = database.data_path(filekey, database.state_keys[filekey+':'+first['state_key']][2])
+        #root can write to read-only files, so it never hardlinks stored states
+        with mock.patch('os.geteuid', return_value=0):
+            result = repository.revert(sourcefile, first['state_key'], stash=False, copy_strategy='hardlink')
+        self.assertNotEqual('hardlink', result['copy_strategy'])
+        self.assertFalse(os.path.samefile(sourcefile, storedfile))
+        repository.revert(sourcefile, second['state_key'], stash=False)
+        with mock.patch('os.geteuid', return_value=1000):
+            result = repository.revert(sourcefile, first['state_key'], stash=False, copy_strategy='hardlink')
+        self.assertEqual('hardlink', result['copy_strategy'])
+        self.assertTrue(os.path.samefile(sourcefile, storedfile))
+        self.assertFalse(os.stat(sourcefile).st_mode & 0o222)
+        #writing over a hardlinked checkout never modifies the stored state
+        original = hashfile(storedfile)
+        repository.revert(sourcefile, second['state_key'], stash=False)
+        self.assertFalse(os.path.samefile(sourcefile, storedfile))
+        self.assertEqual(original, hashfile(storedfile))
+        self.assertEqual(second['state_key'], repository.status(sourcefile)['state_key'])
+        #files are only hashed ahead of a copy if they can be cloned, otherwise they are read once
+        from quicksave import utils
+        for supported in (False, True):
+            with mock.patch('quicksave.qs_copy.reflink_supported', return_value=supported):
+                with open(sourcefile, 'rb') as reader:
+                    (digest, staged, manifest) = utils.prepare_file(reader, self.test_directory.name, 'auto', False)
+            self.assertEqual(hashfile(sourcefile), digest)
+            self.assertEqual(supported, staged is None)
+            if staged is not None:
+                self.assertTrue(cmp(sourcefile, staged, False))
+                os.remove(staged)
+        self.assertIn(qs_copy.reflink_supported(self.test_directory.name), (True, False))
+        self.assertListEqual([], [name for name in os.listdir(self.test_directory.name) if name.startswith('.reflink')])
+
+    def test_layout(self):
+        import quicksave
+        from quicksave.qs_database import shard
+
+        repository = quicksave.Repository(os.path.join(self.db_directory.name, 'repository'))
+        database = repository.database
+        database.flags['storage.delta'] = '2'
+        database.save()
+        sourcefile = self.make_file()
+        filekey = repository.register(sourcefile)['file_key']
+        folder = database.file_keys[filekey][1]
+        states = {}
+        for _ in range(4):
+            with open(sourcefile, 'ab') as writer:
+                writer.write(os.urandom(64))
+            states[repository.save(sourcefile)['state_key']] = hashfile(sourcefile)
+        self.assertEqual(['flat'], repository.layout())
+        self.assertEqual(len(database.file_keys[filekey][2]), repository.layout('sharded')[2])
+        for datafile in database.file_keys[filekey][2]:
+            self.assertTrue(os.path.isfile(os.path.join(folder, shard(datafile), datafile)))
+        with open(sourcefile, 'ab') as writer:
+            writer.write(os.urandom(64))
+        states[repository.save(sourcefile)['state_key']] = hashfile(sourcefile)
+        self.assertNotIn('prune_files', repository.clean(walk_database=True))
+        for (state, digest) in states.items():
+            repository.revert(sourcefile, state, stash=False)
+            self.assertEqual(digest, hashfile(sourcefile))
+        repository.layout('flat')
+        self.assertListEqual(sorted(database.file_keys[filekey][2]), sorted(os.listdir(folder)))
+        for (state, digest) in states.items():
+            repository.revert(sourcefile, state, stash=False, force=True)
+            self.assertEqual(digest, hashfile(sourcefile))
+
+    def test_name_counters(self):
+        import quicksave
+        from quicksave.qs_database import Database
+
+        path = os.path.join(self.db_directory.name, 'repository')
+        repository = quicksave.Repository(path)
+        sourcefile = self.make_file()
+        first = repository.register(sourcefile)
+        filekey = first['file_key']
+        prefix = first['state_key'][:-1]
+        for _ in range(2):
+            repository.save(sourcefile, allow_duplicate=True)
+        name = os.path.basename(sourcefile)
+        self.assertSetEqual({name, name+'_1', name+'_2'}, repository.database.file_keys[filekey][2])
+        #allocation resumes from the last index, instead of probing from 1
+        repository.database.counters['SK:'+filekey+':'+prefix[:5]] = 1000
+        repository.database.save()
+        self.assertEqual(prefix+'1001', repository.save(sourcefile, allow_duplicate=True)['state_key'])
+        repository.delete(prefix+'1001', filekey, trash=False)
+        self.assertEqual(prefix+'1002', repository.save(sourcefile, allow_duplicate=True)['state_key'])
+        for engine in ('sqlite', 'text'):
+            self.assertTrue(repository.database.migrate(engine))
+            reloaded = Database(path)
+            self.assertDictEqual(dict(repository.database.counters), dict(reloaded.counters))
+            self.assertEqual(4, reloaded.counters['DF:'+filekey+':'+name])
+        #the counters of a deleted file key are removed by clean
+        other = repository.register(self.make_file())['file_key']
+        repository.delete(filekey, trash=False)
+        self.assertEqual(2, repository.clean(metadata=True)['counters'])
+        reloaded = Database(path)
+        self.assertFalse([counter for counter in reloaded.counters if filekey+':' in counter])
+        self.assertIn('SK:'+other+':', ' '.join(reloaded.counters))
+
+    def test_state_meta(self):
+        import time
+        import quicksave
+        from quicksave.qs_database import Database
+
+        path = os.path.join(self.db_directory.name, 'repository')
+        repository = quicksave.Repository(path)
+        database = repository.database
+        sourcefile = self.make_file()
+        start = int(time.time())
+        result = repository.register(sourcefile)
+        statekey = result['file_key']+':'+result['state_key']
+        meta = database.state_meta(statekey)
+        self.assertEqual((4096, hashfile(sourcefile), 'sha256'), meta[:3])
+        self.assertLessEqual(start, meta[3])
+        self.assertEqual(meta, database.state_meta(result['file_key']+':'+hashfile(sourcefile)))
+        for engine in ('sqlite', 'text'):
+            self.assertTrue(database.migrate(engine))
+            self.assertEqual(meta, Database(path).state_meta(statekey))
+        #states saved by older versions are backfilled
+        database.state_keys[statekey] = database.state_keys[statekey][:3]
+        database.save()
+        self.assertIsNone(Database(path).state_meta(statekey))
+        self.assertEqual(1, repository.clean(metadata=True)['metadata'])
+        self.assertEqual(meta[:3], database.state_meta(statekey)[:3])
+        self.assertListEqual([result['state_key']], repository.list(result['file_key'], long=True))
+
+    def test_hash_aliases(self):
+        import quicksave
+        from quicksave.qs_database import Database
+
+        path = os.path.join(self.db_directory.name, 'repository')
+        repository = quicksave.Repository(path)
+        database = repository.database
+        sourcefile = self.make_file()
+        result = repository.register(sourcefile)
+        filekey = result['file_key']
+        statekey = filekey+':'+result['state_key']
+        digest = hashfile(sourcefile)
+        self.assertIn(digest[:7], result['state_aliases'])
+        #hash aliases are not stored
+        self.assertFalse([row for row in database.rows() if row[0] == 'SA' and digest[:4] in row[1]])
+        for prefix in (digest, digest[:7], digest[:4], digest[:20]):
+            self.assertEqual(statekey, database.resolve_key(filekey+':'+prefix, False))
+        self.assertNotIn(filekey+':'+digest[:3], database.state_keys)
+        self.assertEqual(result['state_key'], repository.status(sourcefile)['state_key'])
+        #prefixes shared by two digests are ambiguous
+        with open(sourcefile, 'w') as writer:
+            writer.write(digest)
+        second = repository.save(sourcefile)['state_key']
+        other = hashfile(sourcefile)
+        shared = os.path.commonprefix([digest, other])
+        if len(shared) >= 4:
+            self.assertNotIn(filekey+':'+shared, database.state_keys)
+        self.assertEqual(filekey+':'+second, Database(path).resolve_key(filekey+':'+other[:12], False))
+        repository.revert(sourcefile, digest[:7], stash=False)
+        self.assertEqual(digest, hashfile(sourcefile))
+        self.assertIn(digest, repository.list(filekey, aliases=True))
+        with self.assertRaises(quicksave.QuicksaveError):
+            repository.alias(digest[:7], file_key=filekey, delete=True)
+        #deleting the state removes its hash aliases
+        repository.delete(second, filekey, trash=False)
+        self.assertNotIn(filekey+':'+other, database.state_keys)
+        #aliases stored by older versions are removed once the digest index covers them
+        database.state_keys[filekey+':'+digest[:7]] = [statekey, filekey, None]
+        database.save()
+        self.assertEqual(1, repository.clean(metadata=True)['hash_aliases'])
+        self.assertEqual(statekey, Database(path).resolve_key(filekey+':'+digest[:7], False))
+        #aliases which could be read as a digest prefix are reserved
+        for alias in ('cafe', '1234', digest[:5]):
+            with self.assertRaises(quicksave.ReservedKeyError):
+                repository.alias(alias, result['state_key'], filekey)
+            with self.assertRaises(quicksave.ReservedKeyError):
+                repository.register(self.make_file(), [alias])
+        for alias in ('CAFE', 'abc', 'cafe_'):
+            repository.alias(alias, result['state_key'], filekey)
+            self.assertEqual(statekey, database.resolve_key(filekey+':'+alias, False))
+        #aliases stored by older versions take precedence over hash aliases
+        with open(sourcefile, 'wb') as writer:
+            writer.write(os.urandom(100))
+        third = filekey+':'+repository.save(sourcefile)['state_key']
+        database.state_keys[filekey+':'+digest[:6]] = [third, filekey, None]
+        database.save()
+        self.assertEqual(third, Database(path).resolve_key(filekey+':'+digest[:6], False))
+        self.assertEqual(statekey, Database(path).resolve_key(filekey+':'+digest[:7], False))
+        #files named like a digest prefix are not aliased by their name
+        hexfile = os.path.join(self.test_directory.name, 'beef')
+        copyfile(sourcefile, hexfile)
+        self.assertNotIn('beef', repository.save(hexfile, filekey, allow_duplicate=True)['aliases'])
+
+    def test_dedupe_buckets(self):
+        import quicksave
+
+        repository = quicksave.Repository(os.path.join(self.db_directory.name, 'repository'))
+        database = repository.database
+        sourcefile = self.make_file()
+        with open(sourcefile, 'rb') as reader:
+            original = reader.read()
+        filekey = repository.register(sourcefile)['file_key']
+        with open(sourcefile, 'wb') as writer:
+            writer.write(os.urandom(100))
+        unique = repository.save(sourcefile)['state_key']
+        with open(sourcefile, 'wb') as writer:
+            writer.write(os.urandom(len(original)))
+        repository.save(sourcefile)
+        with open(sourcefile, 'wb') as writer:
+            writer.write(original)
+        duplicate = repository.save(sourcefile, allow_duplicate=True)['state_key']
+        #states saved by older versions have no recorded digest
+        for key in database.list_sk(filekey, False):
+            database.state_keys[key] = database.state_keys[key][:3]
+        database.save()
+        hashed = []
+        content_meta = database.content_meta
+        database.content_meta = lambda filekey, data_file: hashed.append(data_file) or content_meta(filekey, data_file)
+        result = repository.clean(deduplicate=True, workers=2)
+        self.assertListEqual([filekey+':'+duplicate], list(result['deduplicate']))
+        self.assertEqual(3, len(hashed))
+        self.assertNotIn(database.state_keys[filekey+':'+unique][2], hashed)
+        with self.assertRaises(quicksave.QuicksaveError):
+            repository.clean(deduplicate=True, workers=0)
+
+    def test_walk_dry_run(self):
+        import quicksave
+        from quicksave import qs_gc
+        from quicksave.qs_database import shard
+        from unittest import mock
+
+        path = os.path.join(self.db_directory.name, 'repository')
+        repository = quicksave.Repository(path)
+        database = repository.database
+        sourcefile = self.make_file()
+        registered = repository.register(sourcefile)
+        filekey = registered['file_key']
+        with open(sourcefile, 'wb') as writer:
+            writer.write(os.urandom(1024))
+        missing = repository.save(sourcefile)['state_key']
+        repository.layout('sharded')
+        folder = database.file_keys[filekey][1]
+        os.remove(database.data_path(filekey, database.state_keys[filekey+':'+missing][2]))
+        orphans = [
+            os.path.join(folder, 'orphan'),
+            os.path.join(folder, shard('orphan'), 'orphan'),
+            os.path.join(folder, 'nested', shard('orphan'), 'orphan')
+        ]
+        for orphan in orphans:
+            os.makedirs(os.path.dirname(orphan), exist_ok=True)
+            with open(orphan, 'w') as writer:
+                writer.write('orphan')
+        os.mkdir(os.path.join(path, 'stray'))
+        expected = {
+            'prune_folders': ['stray'],
+            'prune_statekeys': [filekey+':'+missing]
+        }
+        #new files and folders may belong to a save in another process
+        report = repository.clean(walk_database=True, dry_run=True, workers=2)
+        self.assertDictEqual({'prune_statekeys': [filekey+':'+missing]}, report)
+        #the dry run only covers --walk-database
+        with self.assertRaises(quicksave.QuicksaveError):
+            repository.clean(walk_database=True, trash=True, dry_run=True)
+        grace = mock.patch.object(qs_gc, 'GRACE_PERIOD', 0)
+        grace.start()
+        self.addCleanup(grace.stop)
+        report = repository.clean(walk_database=True, dry_run=True, workers=2)
+        self.assertDictEqual(expected, {key:report[key] for key in expected})
+        self.assertSetEqual({os.path.relpath(orphan, path) for orphan in orphans}, set(report['prune_files']))
+        self.assertTrue(all(os.path.isfile(orphan) for orphan in orphans))
+        self.assertTrue(os.path.isdir(os.path.join(path, 'stray')))
+        self.assertIn(filekey+':'+missing, database.state_keys)
+        result = repository.clean(walk_database=True)
+        self.assertDictEqual(report, result)
+        self.assertFalse(any(os.path.exists(orphan) for orphan in orphans))
+        self.assertNotIn(filekey+':'+missing, database.state_keys)
+        self.assertIn(filekey+':'+registered['state_key'], database.state_keys)
+
+    def test_incremental_gc(self):
+        import quicksave
+        from quicksave.qs_database import Database
+        from quicksave import qs_gc
+        from quicksave.qs_gc import CURSOR_FILE, cursor
+        from unittest import mock
+
+        path = os.path.join(self.db_directory.name, 'repository')
+        repository = quicksave.Repository(path)
+        database = repository.database
+        sourcefile = self.make_file()
+        with open(sourcefile, 'rb') as reader:
+            original = reader.read()
+        result = repository.register(sourcefile)
+        filekey = result['file_key']
+        statekey = filekey+':'+result['state_key']
+        with open(sourcefile, 'wb') as writer:
+            writer.write(os.urandom(1024))
+        missing = filekey+':'+repository.save(sourcefile)['state_key']
+        with open(sourcefile, 'wb') as writer:
+            writer.write(original)
+        duplicate = filekey+':'+repository.save(sourcefile, allow_duplicate=True, aliases=['dup'])['state_key']
+        os.remove(database.data_path(filekey, database.state_keys[missing][2]))
+        orphan = os.path.join(database.file_keys[filekey][1], 'orphan')
+        with open(orphan, 'w') as writer:
+            writer.write('orphan')
+        for key in database.list_sk(filekey, False):
+            database.state_keys[key] = database.state_keys[key][:3]
+        database.save()
+        #each run stops once it has read a state, and saves its position
+        grace = mock.patch.object(qs_gc, 'GRACE_PERIOD', 0)
+        grace.start()
+        result = repository.clean(incremental=True, max_bytes=1)['incremental']
+        self.assertEqual((1, 1, False), (result['items'], result['metadata'], result['complete']))
+        self.assertEqual(('states', database.list_sk(filekey, False)[0]), cursor(Database(path)))
+        #the cursor is internal, and is not listed with the settings
+        self.assertFalse([key for key in Database(path).flags if 'cursor' in key])
+        results = [result]
+        while not results[-1]['complete']:
+            results.append(repository.clean(incremental=True, max_bytes=1)['incremental'])
+            self.assertLessEqual(results[-1]['items'], 3)
+        self.assertFalse(os.path.exists(os.path.join(path, CURSOR_FILE)))
+        self.assertEqual([missing], [key for result in results for key in result['prune_statekeys']])
+        self.assertEqual(
+            [os.path.relpath(orphan, path)],
+            [key for result in results for key in result['prune_files']]
+        )
+        self.assertEqual(
+            [{duplicate: statekey}],
+            [result['deduplicate'] for result in results if result['deduplicate']]
+        )
+        self.assertEqual(statekey, database.resolve_key(filekey+':dup', False))
+        self.assertListEqual([statekey], database.list_sk(filekey, False))
+        self.assertTrue(all(database.state_meta(key) for key in database.list_sk(filekey, False)))
+        grace.stop()
+
+        #recent files and staging files may belong to a save in another process
+        staging = os.path.join(database.file_keys[filekey][1], qs_gc.STAGING_PREFIX+'1_1')
+        for recent in (orphan, staging):
+            with open(recent, 'w') as writer:
+                writer.write('orphan')
+        self.assertListEqual([], repository.clean(incremental=True)['incremental']['prune_files'])
+        with mock.patch.object(qs_gc, 'GRACE_PERIOD', 0):
+            self.assertListEqual(
+                [os.path.relpath(orphan, path)],
+                repository.clean(incremental=True)['incremental']['prune_files']
+            )
+            with mock.patch.object(qs_gc, 'STAGING_GRACE', 0):
+                self.assertListEqual(
+                    [os.path.relpath(staging, path)],
+                    repository.clean(incremental=True)['incremental']['prune_files']
+                )
+
+    def test_verify(self):
+        import quicksave
+
+        path = os.path.join(self.db_directory.name, 'repository')
+        repository = quicksave.Repository(path)
+        database = repository.database
+        sourcefile = self.make_file()
+        result = repository.register(sourcefile)
+        filekey = result['file_key']
+        states = [filekey+':'+result['state_key']]
+        for _ in range(3):
+            with open(sourcefile, 'wb') as writer:
+                writer.write(os.urandom(2048))
+            states.append(filekey+':'+repository.save(sourcefile)['state_key'])
+        report = repository.verify(workers=2)
+        self.assertEqual(4, report['checked'])
+        self.assertFalse(report['missing'] + report['corrupted'] + report['unverified'] + report['orphaned'])
+        os.remove(database.data_path(filekey, database.state_keys[states[1]][2]))
+        with open(database.data_path(filekey, database.state_keys[states[2]][2]), 'r+b') as writer:
+            writer.write(b'corrupted') #same size, different digest
+        with open(database.data_path(filekey, database.state_keys[states[3]][2]), 'ab') as writer:
+            writer.write(b'grown')
+        os.makedirs(os.path.join(database.blob_dir, 'ab'))
+        with open(os.path.join(database.blob_dir, 'ab', 'ab'+'0'*62), 'w') as writer:
+            writer.write('orphan')
+        os.makedirs(os.path.join(database.chunk_dir, 'cd'))
+        with open(os.path.join(database.chunk_dir, 'cd', 'cd'+'0'*62), 'w') as writer:
+            writer.write('orphan')
+        with open(os.path.join(database.file_keys[filekey][1], 'orphan'), 'w') as writer:
+            writer.write('orphan')
+        with self.assertRaises(quicksave.VerificationError) as context:
+            repository.verify()
+        report = context.exception.report
+        self.assertListEqual([states[1]], report['missing'])
+        self.assertListEqual(sorted(states[2:]), sorted(report['corrupted']))
+        self.assertListEqual(sorted([
+            os.path.join('.blobs', 'ab', 'ab'+'0'*62),
+            os.path.join('.chunks', 'cd', 'cd'+'0'*62),
+            os.path.relpath(os.path.join(database.file_keys[filekey][1], 'orphan'), database.base_dir)
+        ]), report['orphaned'])
+        #the fast mode only checks existence and size
+        with self.assertRaises(quicksave.VerificationError) as context:
+            repository.verify(filekey, [state.split(':', 1)[1] for state in states[1:]], fast=True)
+        report = context.exception.report
+        self.assertEqual((3, [states[1]], [states[3]], []), (report['checked'], report['missing'], report['corrupted'], report['orphaned']))
+
+    def test_bulk_save(self):
+        import quicksave
+
+        repository = quicksave.Repository(os.path.join(self.db_directory.name, 'repository'))
+        database = repository.database
+        root = os.path.join(self.test_directory.name, random_string())
+        paths = [os.path.join(root, name) for name in ('a.txt', 'b.txt', os.path.join('sub', 'c.txt'), 'd.log')]
+        for path in paths:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as writer:
+                writer.write(os.urandom(4096))
+        commits = []
+        commit = database.engine.commit
+        database.engine.commit = lambda *args: commits.append(args) or commit(*args)
+        results = repository.register_files([root], exclude=['*.log'], workers=2)
+        self.assertEqual(1, len(commits))
+        self.assertListEqual(paths[:3], [result['path'] for result in results])
+        for (path, result) in zip(paths, results):
+            self.assertIsNone(result['error'])
+            self.assertEqual(result['result']['file_key'], database.resolve_key(path, True))
+            self.assertIn(hashfile(path)[:7], result['result']['state_aliases'])
+            self.assertIsNotNone(result['result']['copy_strategy'])
+        #unchanged files are reported as duplicates, without stopping the others
+        with open(paths[1], 'wb') as writer:
+            writer.write(os.urandom(4096))
+        results = repository.save_files([os.path.join(root, '*.txt'), paths[2]], workers=2)
+        self.assertEqual(2, len(commits))
+        self.assertIn('Duplicate of', results[0]['error'])
+        self.assertIn('Duplicate of', results[2]['error'])
+        saved = results[1]['result']
+        self.assertEqual(hashfile(paths[1]), database.state_meta(saved['file_key']+':'+saved['state_key'])[1])
+        self.assertIn(hashfile(paths[1])[:7], saved['aliases'])
+        self.assertEqual(saved['state_key'], repository.status(paths[1])['state_key'])
+        with self.assertRaises(quicksave.QuicksaveError):
+            repository.save_files([os.path.join(root, '*.none')])
+
+    def test_atomic_batch_rollback(self):
+        import quicksave
+        from quicksave import qs_batch
+
+        repository = quicksave.Repository(os.path.join(self.db_directory.name, 'repository'))
+        database = repository.database
+        sourcefile = self.make_file()
+        filekey = repository.register(sourcefile)['file_key']
+        with open(sourcefile, 'rb') as reader:
+            original = reader.read()
+        with open(sourcefile, 'wb') as writer:
+            writer.write(os.urandom(1024))
+        statekey = repository.save(sourcefile)['state_key']
+        datafile = database.data_path(filekey, database.state_keys[filekey+':'+statekey][2])
+        folders = set(os.listdir(repository.path))
+        files = set(os.listdir(database.file_keys[filekey][1]))
+        edited = self.make_file()
+        with open(edited, 'wb') as writer:
+            writer.write(os.urandom(1024))
+        #the deleted state's data file is kept until the batch commits, and the
+        #files and folders written by the discarded commands are removed
+        lines = [
+            'delete "%s" "%s" --no-save' % (filekey, statekey),
+            'save "%s" -k "%s" --force' % (edited, filekey),
+            'register "%s"' % self.make_file(),
+            'lookup "Probably not a real key though"'
+        ]
+        results = repository._call(lambda args, do_print: qs_batch.run_batch(lines, atomic=True, do_print=do_print))
+        self.assertListEqual([0, 0, 0, 1], [result['code'] for result in results])
+        self.assertTrue(os.path.isfile(datafile))
+        self.assertSetEqual(folders, set(os.listdir(repository.path)))
+        self.assertSetEqual(files, set(os.listdir(database.file_keys[filekey][1])))
+        database = quicksave.Repository(repository.path).database
+        self.assertIn(filekey+':'+statekey, database.state_keys)
+        with open(sourcefile, 'wb') as writer:
+            writer.write(original)
+        repository = quicksave.Repository(repository.path)
+        repository.revert(sourcefile, statekey, filekey, stash=False, force=True)
+        self.assertEqual(hashfile(sourcefile), database.state_meta(filekey+':'+statekey)[1])
+        #once committed, the data file is removed
+        repository.delete(statekey, filekey, trash=False)
+        self.assertFalse(os.path.isfile(datafile))